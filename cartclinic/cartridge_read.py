@@ -4,18 +4,45 @@
 import logging
 import time
 from cartclinic.consts import BANK_SIZE
-from cartclinic.exceptions import InvalidCartridgeError
+from cartclinic.exceptions import CartridgeUnpluggedError, InvalidCartridgeError
+from cartclinic.mrpatcher import GAME_ID_SIZE
 from libpyretro.cartclinic.comms import Session
 from flashing_tool.chromatic_subprocess import PauseableSubprocess
 flashing_tool_logger = logging.getLogger('mrupdater')
 
-def read_cartridge_helper(session = None, animation = None, detection_thread = None, emit_progress = ('session', Session, 'animation', PauseableSubprocess, 'detection_thread', PauseableSubprocess, 'emit_progress', callable, 'return', bytearray)):
+def read_cartridge_helper(session: Session, animation: PauseableSubprocess, detection_thread: PauseableSubprocess, emit_progress: callable, on_bank: callable = None) -> bytearray:
     '''CC helper for reading back the full cartridge data while continuously
-    checking for cartridge presence and animating the Chromatic screen.
+    checking for cartridge presence and animating the Chromatic screen. Each
+    bank is passed to on_bank as soon as it is read, so it can be used before
+    the rest of the cartridge is.
     '''
-    animation.run_once()
-        # Incomplete decompilation - manual review needed
-        pass
+    cartridge_info = session.get_cartridge_info()
+    if not cartridge_info:
+        raise InvalidCartridgeError()
+    num_banks = cartridge_info['rom_banks']
+    cart_data = bytearray()
+    for bank in range(num_banks):
+        animation.run_once()
+        detection_thread.run_once()
+        bank_data = read_single_flash_bank(session, bank)
+        if bank_data is None:
+            raise CartridgeUnpluggedError()
+        cart_data += bank_data
+        if on_bank is not None:
+            on_bank(bank_data)
+        emit_progress(100 * (bank + 1) / num_banks)
+    return cart_data
+
+
+def read_game_id_block(session: Session) -> bytes:
+    '''Reads the first GAME_ID_SIZE bytes of bank 0, which identify the game.'''
+    flashing_tool_logger.info('Reading game ID block from cartridge')
+    id_block = session.read_bank(0, GAME_ID_SIZE)
+    if id_block is None:
+        raise CartridgeUnpluggedError()
+    return id_block
+
+
 def read_single_flash_bank(session = None, bank = None):
     '''Reads a single 16K bank from the cartridge flash.'''
     flashing_tool_logger.info(f'''Reading bank {bank} from cartridge''')
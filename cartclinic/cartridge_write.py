@@ -3,11 +3,13 @@
 
 import logging
 import time
+from typing import Collection
 from cartclinic.consts import BANK_SIZE, NUM_WRITE_RETRIES
 from cartclinic.exceptions import CartridgeTooSmallError, CartridgeWriteError, InvalidCartridgeError
 from cartclinic.mrpatcher import GameSaveSettings
 from libpyretro.cartclinic.cart_api import CartFlashChip
 from libpyretro.cartclinic.comms import Session
+from libpyretro.cartclinic.flash_plan import EraseStrategy, ErasePlan, SectorWrite, plan_erase, plan_sector_writes, sector_size_bytes
 from flashing_tool.chromatic_subprocess import PauseableSubprocess
 flashing_tool_logger = logging.getLogger('mrupdater')
 
@@ -19,6 +21,63 @@ def write_cartridge_helper(session, game_data, game_save_settings = None, animat
     pass
         # TODO: Implementation needed
         raise NotImplementedError("Method not implemented")
+
+
+def write_cartridge_diff_helper(session: Session, current_data: bytes | None, game_data: bytearray, animation_thread: PauseableSubprocess, detection_thread: PauseableSubprocess, emit_progress: callable, allow_chip_erase: bool = False, erased_sectors: Collection[int] = ()) -> bool:
+    '''CC helper function for writing only the flash sectors in which game_data
+    differs from current_data, the image already on the cartridge. Dirty
+    sectors are erased and only their non-0xFF bytes are programmed, while
+    continuously checking for cartridge presence and animating the Chromatic
+    screen. Passing None for current_data rewrites every sector.
+
+    With allow_chip_erase, a single chip erase is used instead of sector
+    erases when the chip's timings make it faster. That wipes anything stored
+    past the end of game_data, such as save-to-ROM saves. Sectors listed in
+    erased_sectors were erased ahead of time and are only programmed.
+    '''
+    flash_info = session.get_flash_type()
+    if flash_info is None:
+        raise InvalidCartridgeError()
+    cart_size = flash_info.total_size_kb * 1024
+    if len(game_data) > cart_size:
+        raise CartridgeTooSmallError(len(game_data) // BANK_SIZE, cart_size // BANK_SIZE)
+    sector_size = sector_size_bytes(flash_info)
+    timing = session.get_flash_timing()
+    if timing is None:
+        plan = ErasePlan(EraseStrategy.SECTOR, plan_sector_writes(current_data, game_data, sector_size, erased_sectors), 0)
+    else:
+        plan = plan_erase(current_data, game_data, sector_size, timing, allow_chip_erase, erased_sectors=erased_sectors)
+    total_sectors = -(-len(game_data) // sector_size)
+    flashing_tool_logger.info(f'''Writing {len(plan.sectors)} of {total_sectors} sectors ({sum(sector.program_size for sector in plan.sectors)} bytes) to {flash_info.part_number} using {plan.strategy.value} erase''')
+    chip_erased = False
+    if plan.strategy == EraseStrategy.CHIP:
+        chip_erased = session.erase_flash_chip()
+        if not chip_erased:
+            flashing_tool_logger.warning('Chip erase failed, falling back to sector erase')
+    for index, sector in enumerate(plan.sectors):
+        animation_thread.run_once()
+        detection_thread.run_once()
+        if not write_flash_sector(session, sector, game_data, sector_size, chip_erased or sector.sector_num in erased_sectors):
+            raise CartridgeWriteError(f'''Failed to write sector {sector.sector_num}''')
+        emit_progress(100 * (index + 1) / len(plan.sectors))
+    if not plan.sectors:
+        emit_progress(100)
+    return True
+
+
+def write_flash_sector(session: Session, sector: SectorWrite, game_data: bytearray, sector_size: int, erased: bool = False) -> bool:
+    '''Erases a single sector and programs its non-0xFF runs from game_data,
+    retrying the whole sector if the erase or any programmed byte fails. The
+    first erase is skipped when the sector is already known to be erased.
+    '''
+    for write_tries in range(1, NUM_WRITE_RETRIES + 1):
+        if (erased or session.erase_flash_sector(sector.sector_num, sector_size)) and all(session.program_flash(start, game_data[start:end]) for start, end in sector.program_ranges):
+            return True
+        erased = False
+        flashing_tool_logger.warning(f'''Writing sector {sector.sector_num} failed on try {write_tries}''')
+    return False
+
+
 def write_single_flash_bank(session = None, bank = None, data = None):
     '''Writes and verifies a single 16K bank to the cartridge flash.
     Make sure to erase before writing.
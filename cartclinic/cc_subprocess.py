@@ -2,20 +2,22 @@
 # File: cc_subprocess.pyc (Python 3.10)
 
 import logging
-import tempfile
 import time
 import base64
-import os
 from libpyretro.cartclinic.comms import Session
-from libpyretro.ips_util.patch import Patch
+from libpyretro.ips_util import patch_from_bytes
 from libpyretro.cartclinic.comms.exceptions import WriteBlockDataError
+from libpyretro.cartclinic.flash_plan import sector_size_bytes, sectors_in_ranges
 from cartclinic.animation import AnimateChromaticSubprocess
-from cartclinic.cartridge_read import read_cartridge_helper, read_single_flash_bank
-from cartclinic.cartridge_write import write_cartridge_helper
-from cartclinic.consts import LOADING_TEXT_INTERVAL_S
+from cartclinic.cartridge_read import read_cartridge_helper, read_game_id_block, read_single_flash_bank
+from cartclinic.cartridge_write import write_cartridge_diff_helper
+from cartclinic.consts import BANK_SIZE, LOADING_TEXT_INTERVAL_S, SESSION_IDLE_TIMEOUT_S
 from PySide6.QtCore import Signal
-from cartclinic.exceptions import CartridgeUnpluggedError, InvalidCartridgeError, CartridgeTooSmallError, SaveWriteFailureError
-from cartclinic.mrpatcher import GameSaveSettings, MRPatcherGameInfo, MRPatcherResponse, MRPatcherAPI
+from cartclinic.exceptions import CartridgeUnpluggedError, InvalidCartridgeError, CartridgeTooSmallError, CartridgeWriteError, SaveWriteFailureError
+from cartclinic.game_info import get_game_info_lookup
+from cartclinic.mrpatcher import GAME_ID_SIZE, GameSaveSettings, MRPatcherGameInfo, MRPatcherResponse, MRPatcherAPI
+from cartclinic.patch_cache import get_patch_cache
+from cartclinic.rom_stream import RomStream, RomStreamAborted
 from cartclinic.save_to_rom import map_game_title
 from flashing_tool.chromatic import Chromatic
 from flashing_tool.chromatic_subprocess import ChromaticSubprocess, FlashSRAMSubprocess, OpenFPGALoaderResult, PauseableSubprocess, ReadFileSubprocess, WaitForInterval
@@ -153,39 +155,64 @@ class CartClinicCheckSubprocess(CartClinicSubprocess):
         self.mrpatcher_endpoint = mrpatcher_endpoint
         self._cc_read_thread = None
         self._cc_request_thread = None
+        self._cc_game_info_thread = None
 
     
-    def start_check_cartridge(self = None, session = None, animation_thread = None, detection_thread = ('session', Session, 'animation_thread', AnimateChromaticSubprocess, 'detection_thread', DetectCartridgeSubprocess)):
+    def start_check_cartridge(self, session: Session, animation_thread: AnimateChromaticSubprocess, detection_thread: DetectCartridgeSubprocess):
+        '''Reads the cartridge while the patch is requested. Banks go to the
+        patch service as they are read, and the game is identified as soon as
+        its ID block is in.
+        '''
         self.chromatic_session = session
         self._cc_animation_thread = animation_thread
         self._cc_detection_thread = detection_thread
-        self._cc_read_thread = ReadCartridgeSubprocess(self.chromatic, self.chromatic_session, self._cc_animation_thread, self._cc_detection_thread)
+        self._cart_bytes = None
+        self._mrpatcher_response = None
+        rom_stream = RomStream()
+        self._cc_read_thread = ReadCartridgeSubprocess(self.chromatic, self.chromatic_session, self._cc_animation_thread, self._cc_detection_thread, rom_stream)
         self._cc_read_thread.finished.connect(self.read_cartridge_callback)
         self._cc_read_thread.progress.connect(self.progress_callback)
         self._cc_read_thread.error.connect(self.error_callback)
+        self.request_game_info(rom_stream)
+        self.request_patch(rom_stream)
         self._cc_read_thread.start()
 
     
     def read_cartridge_callback(self = None, cart_bytes = None):
-        if cart_bytes or len(cart_bytes) == 0:
+        if not cart_bytes:
             self.error_callback('COULD NOT READ CARTRIDGE DATA')
             return None
-        None._cc_animation_thread.play()
+        self._cc_animation_thread.play()
         self._cc_detection_thread.play()
+        self._cart_bytes = cart_bytes
         self.current_cart_data.emit(cart_bytes)
-        self.request_patch(cart_bytes)
+        self.finish_when_ready()
 
     
-    def request_patch(self = None, cart_bytes = None):
-        self._cc_request_thread = RequestPatchSubprocess(self.chromatic, self.mrpatcher_endpoint, cart_bytes)
+    def request_game_info(self = None, rom_stream = None):
+        # The result lands in the shared game info lookup, where later save
+        # flows on this cart pick it up
+        self._cc_game_info_thread = RequestGameInfoSubprocess(self.chromatic, self.mrpatcher_endpoint, rom_stream)
+        self._cc_game_info_thread.start()
+
+    
+    def request_patch(self = None, rom_stream = None):
+        self._cc_request_thread = RequestPatchSubprocess(self.chromatic, self.mrpatcher_endpoint, rom_stream=rom_stream)
         self._cc_request_thread.finished.connect(self.request_patch_callback)
         self._cc_request_thread.error.connect(self.error_callback)
         self._cc_request_thread.start()
 
     
     def request_patch_callback(self = None, mrpatcher_response = None):
+        self._mrpatcher_response = mrpatcher_response
+        self.finish_when_ready()
+
+    
+    def finish_when_ready(self):
+        if self._cart_bytes is None or self._mrpatcher_response is None:
+            return None
         self.cleanup()
-        self.finish(mrpatcher_response)
+        self.finish(self._mrpatcher_response)
 
     __classcell__ = None
 
@@ -216,30 +243,95 @@ class CartClinicUpdateSubprocess(ChromaticSubprocess):
 
     
     def patch_game(self):
-        self._cc_patch_thread = ApplyPatchSubprocess(self.chromatic, self.cart_game_data, self.ips_base64, **('game_data', 'ips_base64'))
+        '''Applies the patch and erases the sectors it touches. Nothing is
+        erased until the patch has applied and the patched game is known to
+        fit the cartridge. Writing starts once the erased sectors are ready.
+        If the patch or the write fails after sectors were erased, the
+        original game is written back into them before the error is reported.
+        '''
+        self._patched_game_data = None
+        self._erased_sectors = None
+        self._update_error = None
+        self._cc_erase_thread = None
+        self._cc_animation_thread.pause()
+        self._cc_detection_thread.pause()
+        self._cc_patch_thread = ApplyPatchSubprocess(self.chromatic, self.cart_game_data, self.ips_base64, self.chromatic_session, **('game_data', 'ips_base64', 'chromatic_session'))
+        self._cc_patch_thread.patch_decoded.connect(self.erase_patched_sectors)
         self._cc_patch_thread.finished.connect(self.patch_game_callback)
-        self._cc_patch_thread.error.connect(self.error_callback)
+        self._cc_patch_thread.error.connect(self.patch_game_error_callback)
         self._cc_patch_thread.start()
 
     
+    def erase_patched_sectors(self = None, patched_ranges = None):
+        self._cc_erase_thread = EraseSectorsSubprocess(self.chromatic, self.chromatic_session, patched_ranges, **('chromatic_session', 'byte_ranges'))
+        self._cc_erase_thread.finished.connect(self.erase_patched_sectors_callback)
+        self._cc_erase_thread.error.connect(self.error_callback)
+        self._cc_erase_thread.start()
+
+    
+    def erase_patched_sectors_callback(self = None, erased_sectors = None):
+        self._erased_sectors = erased_sectors
+        if self._update_error is not None:
+            self.restore_erased_sectors()
+            return None
+        self.write_cartridge_when_ready()
+
+    
+    def patch_game_error_callback(self = None, error = None):
+        self._update_error = error
+        if self._cc_erase_thread is None:
+            self.error_callback(error)
+            return None
+        # Restore once the erase has finished, if it has not already
+        if self._erased_sectors is not None:
+            self.restore_erased_sectors()
+
+    
+    def restore_erased_sectors(self = None, written_data = None):
+        '''Writes the original game back into the sectors erased for an update
+        that then failed, and reports the update error afterwards. After a
+        failed write, `written_data` is the data that was being written, and
+        every sector in which it differs from the original game is rewritten
+        as well.
+        '''
+        if not self._erased_sectors:
+            self.error_callback(self._update_error)
+            return None
+        current_cart_data = self.cart_game_data if written_data is None else written_data
+        flashing_tool_logger.info(f'''Restoring the original game into {len(self._erased_sectors)} erased sectors after the update failed''')
+        self._cc_restore_thread = WriteCartridgeSubprocess(self.chromatic, self.chromatic_session, self.cart_game_data, self.game_save_settings, self._cc_animation_thread, self._cc_detection_thread, current_cart_data, self._erased_sectors, **('chromatic_session', 'game_data', 'game_save_settings', 'animation_thread', 'detection_thread', 'current_cart_data', 'erased_sectors'))
+        self._cc_restore_thread.finished.connect(lambda result: self.error_callback(self._update_error))
+        self._cc_restore_thread.error.connect(self.error_callback)
+        self._cc_restore_thread.start()
+
+    
     def patch_game_callback(self = None, game_data = None):
-        self._cc_animation_thread.pause()
-        self._cc_detection_thread.pause()
-        time.sleep(0.5)
+        self._patched_game_data = game_data
         self.progress_callback(PATCH_PROGRESS_OFFSET)
-        self.write_cartridge(game_data)
+        self.write_cartridge_when_ready()
+
+    
+    def write_cartridge_when_ready(self):
+        if self._patched_game_data is None or self._erased_sectors is None:
+            return None
+        self.write_cartridge(self._patched_game_data)
 
     
     def write_cartridge(self = None, game_data = None):
-        self._cc_write_thread = WriteCartridgeSubprocess(self.chromatic, self.chromatic_session, game_data, self.game_save_settings, self._cc_animation_thread, self._cc_detection_thread, **('chromatic_session', 'game_data', 'game_save_settings', 'animation_thread', 'detection_thread'))
+        self._cc_write_thread = WriteCartridgeSubprocess(self.chromatic, self.chromatic_session, game_data, self.game_save_settings, self._cc_animation_thread, self._cc_detection_thread, self.cart_game_data, self._erased_sectors or [], **('chromatic_session', 'game_data', 'game_save_settings', 'animation_thread', 'detection_thread', 'current_cart_data', 'erased_sectors'))
         self._cc_write_thread.finished.connect(self.write_cartridge_callback)
-        self._cc_write_thread.error.connect(self.error_callback)
+        self._cc_write_thread.error.connect(self.write_cartridge_error_callback)
         self._cc_write_thread.progress.connect(self.progress_callback)
         self._cc_write_thread.start()
 
     
+    def write_cartridge_error_callback(self = None, error = None):
+        self._update_error = error
+        self.restore_erased_sectors(self._patched_game_data)
+
+    
     def write_cartridge_callback(self = None, result = None):
-        time.sleep(0.5)
+        self.chromatic_session.wait_until_idle(SESSION_IDLE_TIMEOUT_S)
         self.finish(result)
 
     __classcell__ = None
@@ -254,9 +346,11 @@ class CartClinicHomebrewSubprocess(CartClinicSubprocess):
         super().__init__(chromatic, cart_clinic_fw_path)
         self._homebrew_game_path = homebrew_game_path
         self._read_file_thread = None
+        self._chromatic_session = None
 
     
     def start_write_homebrew(self = None, chromatic_session = None, animation_thread = None, detection_thread = ('chromatic_session', Session, 'animation_thread', AnimateChromaticSubprocess, 'detection_thread', DetectCartridgeSubprocess)):
+        self._chromatic_session = chromatic_session
         self._cc_animation_thread = animation_thread
         self._cc_detection_thread = detection_thread
         self._read_file_thread = ReadFileSubprocess(self._homebrew_game_path)
@@ -269,7 +363,6 @@ class CartClinicHomebrewSubprocess(CartClinicSubprocess):
         game_data = bytearray(file_data)
         self._cc_animation_thread.pause()
         self._cc_detection_thread.pause()
-        time.sleep(0.5)
         game_save_settings = GameSaveSettings()
         self._cc_write_thread = WriteCartridgeSubprocess(self.chromatic, chromatic_session, game_data, game_save_settings, self._cc_animation_thread, self._cc_detection_thread, **('chromatic_session', 'game_data', 'game_save_settings', 'animation_thread', 'detection_thread'))
         self._cc_write_thread.finished.connect(self.write_homebrew_callback)
@@ -279,28 +372,41 @@ class CartClinicHomebrewSubprocess(CartClinicSubprocess):
 
     
     def write_homebrew_callback(self = None, result = None):
-        time.sleep(0.5)
+        self._chromatic_session.wait_until_idle(SESSION_IDLE_TIMEOUT_S)
         self.finish(result)
 
     __classcell__ = None
 
 
 class ReadCartridgeSubprocess(ChromaticSubprocess):
-    '''Reads game data off the cartridge'''
+    '''Reads game data off the cartridge, appending each bank to rom_stream
+    as soon as it is read.'''
     finished = Signal(bytearray)
     error = Signal(str)
     
-    def __init__(self = None, chromatic = None, chromatic_session = None, animation_thread = None, detection_thread = None):
+    def __init__(self = None, chromatic = None, chromatic_session = None, animation_thread = None, detection_thread = None, rom_stream = None):
         super().__init__(chromatic)
         self.chromatic_session = chromatic_session
         self.animation_thread = animation_thread
         self.detection_thread = detection_thread
+        self.rom_stream = rom_stream
 
     
     def run(self):
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        on_bank = self.rom_stream.append if self.rom_stream is not None else None
+        try:
+            cart_bytes = read_cartridge_helper(self.chromatic_session, self.animation_thread, self.detection_thread, self.emit_progress, on_bank)
+        except Exception as e:
+            flashing_tool_logger.error(f'''Failed to read cartridge: {e}''')
+            if self.rom_stream is not None:
+                self.rom_stream.abort(e)
+            self.error.emit(str(e))
+            return None
+        if self.rom_stream is not None:
+            self.rom_stream.close()
+        self.finish(cart_bytes)
+
+    
     def parse_progress(self = None, data = None):
         pass
 
@@ -313,20 +419,64 @@ class ReadCartridgeSubprocess(ChromaticSubprocess):
 
 
 class RequestPatchSubprocess(ChromaticSubprocess):
-    '''Requests a patch from MRPatcher service'''
+    '''Requests a patch from MRPatcher service, either for game_bytes or for
+    the ROM being read into rom_stream'''
     finished = Signal(MRPatcherResponse)
     error = Signal(str)
     
-    def __init__(self = None, chromatic = None, endpoint = None, game_bytes = None):
+    def __init__(self = None, chromatic = None, endpoint = None, game_bytes = None, rom_stream = None):
         super().__init__(chromatic)
         self.endpoint = endpoint
         self.game_bytes = game_bytes
+        self.rom_stream = rom_stream
 
     
     def run(self):
+        try:
+            if self.rom_stream is not None:
+                mrpatcher_response = request_game_patch_stream(self.endpoint, self.rom_stream)
+            else:
+                mrpatcher_response = request_game_patch(self.endpoint, self.game_bytes)
+        except RomStreamAborted:
+            return None
+        except Exception as e:
+            flashing_tool_logger.error(f'''Failed to request game patch: {e}''')
+            self.error.emit('COULD NOT CHECK FOR GAME UPDATES')
+            return None
+        self.finish(mrpatcher_response)
+
+    
+    def parse_progress(self = None, data = None):
         pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+
+    __classcell__ = None
+
+
+class RequestGameInfoSubprocess(ChromaticSubprocess):
+    '''Identifies the game from its ID block as soon as the first
+    GAME_ID_SIZE bytes of rom_stream are read. Save flows on the same cart
+    then reuse the result.'''
+    finished = Signal(MRPatcherGameInfo)
+    error = Signal(str)
+    
+    def __init__(self = None, chromatic = None, endpoint = None, rom_stream = None):
+        super().__init__(chromatic)
+        self.endpoint = endpoint
+        self.rom_stream = rom_stream
+
+    
+    def run(self):
+        try:
+            game_info = get_game_info_lookup().get(self.endpoint, self.rom_stream.wait_for(GAME_ID_SIZE))
+        except RomStreamAborted:
+            return None
+        except Exception as e:
+            flashing_tool_logger.warning(f'''Failed to identify game: {e}''')
+            self.error.emit(str(e))
+            return None
+        self.finish(game_info)
+
+    
     def parse_progress(self = None, data = None):
         pass
 
@@ -334,20 +484,44 @@ class RequestPatchSubprocess(ChromaticSubprocess):
 
 
 class ApplyPatchSubprocess(ChromaticSubprocess):
-    '''Applies an IPS patch file to a game ROM'''
+    '''Applies an IPS patch file to a game ROM. The ranges the patch writes to
+    are announced once it has applied and the patched game is known to fit
+    the cartridge, so nothing is erased for a patch that cannot be written.
+    '''
+    patch_decoded = Signal(list)
     finished = Signal(bytearray)
     error = Signal(str)
     
-    def __init__(self = None, chromatic = None, game_data = None, ips_base64 = None):
+    def __init__(self = None, chromatic = None, game_data = None, ips_base64 = None, chromatic_session = None):
         super().__init__(chromatic)
         self.game_data = game_data
         self.ips_base64 = ips_base64
+        self.chromatic_session = chromatic_session
 
     
     def run(self):
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        try:
+            patch = decode_game_patch(self.ips_base64)
+            patch.check_source(self.game_data)
+            game_data = patch.apply(self.game_data)
+        except Exception as e:
+            flashing_tool_logger.error(f'''Failed to apply game patch: {e}''')
+            self.error.emit('COULD NOT APPLY GAME PATCH')
+            return None
+        flash_info = self.chromatic_session.get_flash_type()
+        if flash_info is None:
+            self.error.emit(str(InvalidCartridgeError()))
+            return None
+        cart_size = flash_info.total_size_kb * 1024
+        if len(game_data) > cart_size:
+            error = CartridgeTooSmallError(len(game_data) // BANK_SIZE, cart_size // BANK_SIZE)
+            flashing_tool_logger.error(f'''Patched game is {len(game_data)} bytes, the cartridge holds {cart_size}''')
+            self.error.emit(str(error))
+            return None
+        self.patch_decoded.emit(patch.touched_ranges())
+        self.finish(game_data)
+
+    
     def parse_progress(self = None, data = None):
         pass
 
@@ -355,23 +529,40 @@ class ApplyPatchSubprocess(ChromaticSubprocess):
 
 
 class WriteCartridgeSubprocess(ChromaticSubprocess):
-    '''Writes game data to the cartridge'''
+    '''Writes game data to the cartridge. When the data currently on the
+    cartridge is known, only the flash sectors that differ are rewritten.
+    game_save_settings is not needed for that: a save kept in flash lies past
+    the end of game_data, and only sectors covering game_data are erased. The
+    one exception is the chip erase allowed when the cartridge contents are
+    unknown, and then there is no save worth keeping.
+    '''
     finished = Signal(bool)
     error = Signal(str)
     
-    def __init__(self = None, chromatic = None, chromatic_session = None, game_data = None, game_save_settings = None, animation_thread = None, detection_thread = None):
+    def __init__(self = None, chromatic = None, chromatic_session = None, game_data = None, game_save_settings = None, animation_thread = None, detection_thread = None, current_cart_data = None, erased_sectors = ()):
         super().__init__(chromatic)
         self.chromatic_session = chromatic_session
         self.game_data = game_data
         self.game_save_settings = game_save_settings
         self.animation_thread = animation_thread
         self.detection_thread = detection_thread
+        self.current_cart_data = current_cart_data
+        self.erased_sectors = erased_sectors
 
     
     def run(self):
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        self.chromatic_session.wait_until_idle(SESSION_IDLE_TIMEOUT_S)
+        try:
+            # Without a known cart image the old contents are discarded anyway,
+            # so a chip erase is allowed when it is the faster option.
+            result = write_cartridge_diff_helper(self.chromatic_session, self.current_cart_data, self.game_data, self.animation_thread, self.detection_thread, self.emit_progress, self.current_cart_data is None, self.erased_sectors)
+        except (CartridgeUnpluggedError, InvalidCartridgeError, CartridgeTooSmallError, CartridgeWriteError) as e:
+            flashing_tool_logger.error(f'''Failed to write cartridge: {e}''')
+            self.error.emit(str(e))
+            return None
+        self.finish(result)
+
+    
     def emit_progress(self = None, progress = None):
         offset_progress = ((100 - PATCH_PROGRESS_OFFSET) / 100) * progress
         self.progress.emit(PATCH_PROGRESS_OFFSET + offset_progress)
@@ -379,6 +570,41 @@ class WriteCartridgeSubprocess(ChromaticSubprocess):
     __classcell__ = None
 
 
+class EraseSectorsSubprocess(ChromaticSubprocess):
+    '''Erases the flash sectors covering the given byte ranges ahead of a write'''
+    finished = Signal(list)
+    error = Signal(str)
+    
+    def __init__(self = None, chromatic = None, chromatic_session = None, byte_ranges = None):
+        super().__init__(chromatic)
+        self.chromatic_session = chromatic_session
+        self.byte_ranges = byte_ranges
+
+    
+    def run(self):
+        '''Emits the numbers of the sectors that were erased. Sectors that fail to
+        erase are left out and get erased again by the write that follows.
+        '''
+        if not self.chromatic_session.wait_until_idle(SESSION_IDLE_TIMEOUT_S):
+            # The write erases whatever is left, so skipping ahead is safe
+            flashing_tool_logger.warning('Session busy, leaving the patched sectors to the write')
+            self.finish([])
+            return None
+        flash_info = self.chromatic_session.get_flash_type()
+        if flash_info is None:
+            self.error.emit(str(InvalidCartridgeError()))
+            return None
+        sector_size = sector_size_bytes(flash_info)
+        erased_sectors = []
+        for sector_num in sectors_in_ranges(self.byte_ranges, sector_size):
+            if self.chromatic_session.erase_flash_sector(sector_num, sector_size):
+                erased_sectors.append(sector_num)
+        flashing_tool_logger.info(f'''Erased {len(erased_sectors)} sectors ahead of writing''')
+        self.finish(erased_sectors)
+
+    __classcell__ = None
+
+
 class CartClinicDetectFRAMSubprocess(CartClinicSubprocess):
     '''Check if FRAM exists on the cartridge'''
     finished = Signal(bool)
@@ -397,8 +623,12 @@ class CartClinicDetectFRAMSubprocess(CartClinicSubprocess):
 
 class CartClinicGetGameSettingsSubprocess(ChromaticSubprocess):
     '''Read the ID sector of the inserted cartridge and pass it to MRPatcher
-    to retrieve game save settings.
+    to retrieve game save settings. Carts already looked up, in this run or
+    a recent one, are answered without the network. id_block_read is emitted
+    once the session is no longer used, so other cartridge commands can
+    start while the lookup runs.
     '''
+    id_block_read = Signal()
     finished = Signal(MRPatcherGameInfo)
     error = Signal(str)
     
@@ -409,9 +639,24 @@ class CartClinicGetGameSettingsSubprocess(ChromaticSubprocess):
 
     
     def run(self):
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        try:
+            id_block = read_game_id_block(self.chromatic_session)
+        except Exception as e:
+            flashing_tool_logger.error(f'''Failed to read game ID block: {e}''')
+            self.error.emit('COULD NOT IDENTIFY GAME')
+            return None
+        self.id_block_read.emit()
+        try:
+            game_info = get_game_info_lookup().get(self.endpoint, id_block)
+        except Exception as e:
+            flashing_tool_logger.error(f'''Failed to get game save settings: {e}''')
+            self.error.emit('COULD NOT IDENTIFY GAME')
+            return None
+        if game_info.error:
+            flashing_tool_logger.error(f'''Patching service could not identify game: {game_info.error}''')
+            self.error.emit(game_info.user_error or 'COULD NOT IDENTIFY GAME')
+            return None
+        self.finish(game_info)
     __classcell__ = None
 
 
@@ -508,22 +753,32 @@ def request_game_info(service_endpoint = None, game_bytes = None):
 
 
 def request_game_patch(service_endpoint = None, game_bytes = None):
-    '''Requests a patch for the game at the given path'''
-    mrpatcher = MRPatcherAPI(service_endpoint)
+    '''Requests a patch for the game at the given path. Responses are cached
+    by ROM hash, so checking the same cartridge again skips the upload.'''
+    mrpatcher = MRPatcherAPI(service_endpoint, cache=get_patch_cache())
     mrpatcher_res = mrpatcher.request_patch(game_bytes)
     return mrpatcher_res
 
 
+def request_game_patch_stream(service_endpoint = None, rom_stream = None):
+    '''Requests a patch for the game being read into rom_stream'''
+    mrpatcher = MRPatcherAPI(service_endpoint, cache=get_patch_cache())
+    mrpatcher_res = mrpatcher.request_patch_stream(rom_stream)
+    return mrpatcher_res
+
+
+def decode_game_patch(ips_base64 = None):
+    '''Decodes a base64 IPS, BPS or UPS file into a patch. The records are
+    parsed straight from the decoded bytes, without going through a file.
+    BPS and UPS patches check the CRC32 of the ROM when they are applied.'''
+    return patch_from_bytes(base64.b64decode(ips_base64))
+
+
 def apply_game_patch(game_data = None, ips_base64 = None):
     '''Applies an IPS file to the given game ROM.'''
-    decoded_ips = base64.b64decode(ips_base64)
-    with tempfile.NamedTemporaryFile(False, 'wb', '.ips', **('delete', 'mode', 'suffix')) as patch_file:
-        patch_file.write(decoded_ips)
-        patch_file.flush()
-        patch_path = patch_file.name
-        None(None, None, None)
-        # Incomplete decompilation - manual review needed
-        pass
+    return decode_game_patch(ips_base64).apply(game_data)
+
+
 def require_mr_cartridge_inserted(session = None):
     '''Raises an error if a MR cartridge is not detected.'''
     (cart_detected, _) = session.detect_mr_cart()
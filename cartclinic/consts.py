@@ -4,9 +4,18 @@
 from dataclasses import dataclass
 from enum import Enum
 MRPATCHER_TIMEOUT_S = 30
+MRPATCHER_CACHE_TTL_S = 86400
+MRPATCHER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+MRPATCHER_RETRIES = 3
+MRPATCHER_RETRY_BACKOFF_S = 0.5
+MRPATCHER_POOL_SIZE = 4
+MRPATCHER_GZIP_LEVEL = 6
+MRPATCHER_ZSTD_LEVEL = 3
+CART_CLINIC_BUNDLED_FW_PATH = 'firmware/cart_clinic_io0_rev.bin'
 BANK_SIZE = 16384
 BITMAP_REFRESH_INTERVAL_S = 1
 NUM_WRITE_RETRIES = 3
+SESSION_IDLE_TIMEOUT_S = 2
 LOADING_TEXT_INTERVAL_S = 4
 LOADING_TEXT_DEFAULT = 'CHECKING YOUR GAME...'
 LOADING_TEXT_SNIPPETS = [
@@ -60,18 +69,23 @@ LOADING_TEXT_SNIPPETS = [
     'PLOTTING WORLD DOMINATION...',
     'LOOKING FOR WALDO...']
 
-class CartClinicConfigItem(Enum, str):
+class CartClinicConfigItem(str, Enum):
     PREVIOUS_HOMEBREW_DIR = 'previous_homebrew_dir'
     PREVIOUS_SAVE_DIR = 'previous_save_dir'
 
 
-class CartClinicFeature(Enum, str):
+class CartClinicFeature(str, Enum):
     DEVELOPER_MODE = 'mrupdater.cart-clinic:developer-mode'
 
-CartClinicSaveOperationValue = dataclass(<NODE:12>)
+@dataclass(frozen=True)
+class CartClinicSaveOperationValue:
+    value: int
+    status_message: str
+    warning_message: str
+    success_message: str
 
 class CartClinicSaveOperation(Enum):
-    BACKUP = CartClinicSaveOperationValue(1, 'BACKING UP SAVE...', 'Your save will be backed up to the file specified. The save file may not work if you restore it after updating a game using Cart Clinic.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save was successfully backed up!', **('value', 'status_message', 'warning_message', 'success_message'))
-    RESTORE = CartClinicSaveOperationValue(2, 'RESTORING SAVE...', 'You are about to overwrite the save file stored on your cartridge. The save file may not work if it came from an older version of the game.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save was successfully restored!', **('value', 'status_message', 'warning_message', 'success_message'))
-    ERASE = CartClinicSaveOperationValue(3, 'ERASING SAVE...', 'You are about to erase the save file stored on your cartridge.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save has been erased!', **('value', 'status_message', 'warning_message', 'success_message'))
+    BACKUP = CartClinicSaveOperationValue(1, 'BACKING UP SAVE...', 'Your save will be backed up to the file specified. The save file may not work if you restore it after updating a game using Cart Clinic.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save was successfully backed up!')
+    RESTORE = CartClinicSaveOperationValue(2, 'RESTORING SAVE...', 'You are about to overwrite the save file stored on your cartridge. The save file may not work if it came from an older version of the game.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save was successfully restored!')
+    ERASE = CartClinicSaveOperationValue(3, 'ERASING SAVE...', 'You are about to erase the save file stored on your cartridge.\nYour Chromatic display will turn off and reset.\nDo you want to continue?', 'Your game save has been erased!')
 
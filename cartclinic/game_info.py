@@ -0,0 +1,66 @@
+'''
+Background game info lookups shared by the check and save flows.
+
+The game info of a cartridge depends only on its ID block, so lookups are
+keyed by the cart fingerprint. A lookup is started as soon as the ID block
+is read. Any later flow on the same cart reuses that lookup instead of
+starting its own. The on-disk patch cache also lets lookups for a cart seen
+in an earlier run skip the network.
+'''
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cartclinic.mrpatcher import GAME_ID_SIZE, MRPatcherAPI, cart_fingerprint
+flashing_tool_logger = logging.getLogger('mrupdater')
+GAME_INFO_WORKERS = 2
+
+
+class GameInfoLookup:
+
+    def __init__(self, cache = None, workers = GAME_INFO_WORKERS):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='game-info')
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+
+    def prefetch(self, endpoint, id_block):
+        '''Starts looking up the game info of the cart with this ID block,
+        unless a lookup for it has already succeeded or is under way. Returns
+        a Future of its MRPatcherGameInfo.'''
+        key = (endpoint, cart_fingerprint(id_block))
+        with self._lock:
+            future = self._lookups.get(key)
+            if future is None or (future.done() and _failed(future)):
+                future = self._executor.submit(self._lookup, endpoint, bytes(id_block[:GAME_ID_SIZE]))
+                self._lookups[key] = future
+        return future
+
+
+    def get(self, endpoint, id_block):
+        '''Returns the game info of the cart with this ID block, waiting for
+        a lookup that is under way or starting one.'''
+        return self.prefetch(endpoint, id_block).result()
+
+
+    def _lookup(self, endpoint, id_block):
+        return MRPatcherAPI(endpoint, cache=self.cache).get_game_id(id_block)
+
+
+def _failed(future):
+    '''Whether a finished lookup failed, so the next request should retry it.'''
+    return future.exception() is not None or bool(future.result().error)
+
+
+_game_info_lookup = None
+_game_info_lookup_lock = threading.Lock()
+
+
+def get_game_info_lookup():
+    '''Returns the application's game info lookup, backed by the patch cache.'''
+    global _game_info_lookup
+    with _game_info_lookup_lock:
+        if _game_info_lookup is None:
+            from cartclinic.patch_cache import get_patch_cache
+            _game_info_lookup = GameInfoLookup(get_patch_cache())
+        return _game_info_lookup
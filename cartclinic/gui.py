@@ -8,10 +8,11 @@ from pathlib import Path
 import serial
 import random
 import time
-from cartclinic.consts import LOADING_TEXT_DEFAULT, LOADING_TEXT_SNIPPETS, CartClinicFeature, CartClinicConfigItem, CartClinicSaveOperation
+from cartclinic.consts import CART_CLINIC_BUNDLED_FW_PATH, LOADING_TEXT_DEFAULT, LOADING_TEXT_SNIPPETS, CartClinicFeature, CartClinicConfigItem, CartClinicSaveOperation
 from flashing_tool.chromatic import Chromatic
 from flashing_tool.config_parser import ConfigParser
 from flashing_tool.features.manager import IFeatureManager
+from flashing_tool.firmware_manager import FirmwareManager
 from flashing_tool.gui.changelog_dialog import ChangelogDialog
 from flashing_tool.gui.generated import Ui_CartClinicTab, Ui_CCStartScreen, Ui_CCCheckScreen, Ui_CCConnectScreen, Ui_CCErrorScreen, Ui_CCLoadingScreen, Ui_CCSaveScreen, Ui_CCSuccessScreen, Ui_CCUpdateScreen, Ui_CCUpdatingScreen, Ui_CCUpToDateScreen
 from flashing_tool.ui_flasher_form import Ui_FlasherForm
@@ -48,6 +49,7 @@ class CartClinic:
         self._cc_update_thread = None
         self._cc_save_op_thread = None
         self._cc_save_detect_thread = None
+        self._cc_save_id_thread = None
 
     
     def load_screens(self):
@@ -121,6 +123,18 @@ class CartClinic:
         self._main_gui.update_screens()
 
     
+    def find_cart_clinic_fw(self):
+        '''Returns the Cart Clinic bitstream the firmware cache holds,
+        or the one bundled with the app if none was downloaded yet.
+        '''
+        bundled_fw_path = resolve_path(CART_CLINIC_BUNDLED_FW_PATH)
+        try:
+            return FirmwareManager().get_cart_clinic_bitstream_path(bundled_fw_path)
+        except Exception as e:
+            logger.warning(f'''Could not check the firmware cache for Cart Clinic: {e}''')
+            return bundled_fw_path
+
+    
     def retry_cart_clinic(self):
         '''In a failure state, retry moves back to the checking state'''
         self._chromatic.cart_clinic_retry()
@@ -146,6 +160,8 @@ class CartClinic:
         '''This gets called when the user presses the Cart Clinic
         check button and kicks off the first part of the workflow.
         '''
+        if not self._cart_clinic_fw_path:
+            self._cart_clinic_fw_path = self.find_cart_clinic_fw()
         if not self._mrpatcher_endpoint or self._cart_clinic_fw_path:
             logger.warning('Cart Clinic not yet set up')
             return None
@@ -248,33 +264,78 @@ class CartClinic:
         # TODO: Implementation needed
         raise NotImplementedError("Method not implemented")
     def setup_save_operation_callback(self):
+        '''Detects FRAM while the game's save settings are looked up, so they
+        are ready as soon as it turns out the save is stored in flash. The ID
+        block is read first: both use the cartridge's mapper, so their
+        commands must not interleave on the session.
+        '''
         session = self._create_session()
         if not self._cc_save_detect_thread.check_mr_cart_inserted(session):
             return None
-        None((lambda fram_detected = None: self.cart_clinic_fram_detect_callback(session, fram_detected)))
+        self._cc_save_fram_detected = None
+        self._cc_save_game_info = None
+        self._cc_save_game_info_error = None
+        self._cc_save_continued = False
+        self._cc_save_fram_detect_started = False
+        self._cc_save_id_thread = CartClinicGetGameSettingsSubprocess(self._chromatic, session, self._mrpatcher_endpoint)
+        self._cc_save_id_thread.id_block_read.connect((lambda : self.start_fram_detection(session)))
+        self._cc_save_id_thread.finished.connect((lambda game_info = None: self.cart_clinic_get_game_settings_finished_callback(session, game_info)))
+        self._cc_save_id_thread.error.connect((lambda error = None: self.cart_clinic_get_game_settings_error_callback(session, error)))
+        self._cc_save_id_thread.start()
+
+    
+    def start_fram_detection(self = None, session = None):
+        '''Starts FRAM detection once the ID block read is done with the
+        session, whether or not the game could be identified.
+        '''
+        if self._cc_save_fram_detect_started:
+            return None
+        self._cc_save_fram_detect_started = True
+        self._cc_save_detect_thread.finished.connect((lambda fram_detected = None: self.cart_clinic_fram_detect_callback(session, fram_detected)))
         self._cc_save_detect_thread.detect_fram(session)
 
     
     def cart_clinic_fram_detect_callback(self = None, session = None, fram_detected = None):
         '''
         If FRAM is detected, continue with the save operation as usual
-        If not detected, we need to identify the game and get its save settings
-        from MRPatcher.
+        If not detected, we need the game's save settings from MRPatcher,
+        which were requested alongside FRAM detection.
         '''
         logger.info(f'''FRAM detected: {fram_detected}''')
-        if fram_detected:
-            self._cc_save_game_info = None
-            return self.continue_save_operation(session, fram_detected)
-        self._cc_save_id_thread = None(self._chromatic, session, self._mrpatcher_endpoint, **('chromatic', 'chromatic_session', 'endpoint'))
-        None((lambda game_info = None: self.cart_clinic_get_game_settings_finished_callback(session, game_info)))
-        self._cc_save_id_thread.error.connect(self.cart_clinic_error)
-        self._cc_save_id_thread.start()
+        self._cc_save_fram_detected = fram_detected
+        self.continue_save_operation_when_ready(session)
 
     
     def cart_clinic_get_game_settings_finished_callback(self = None, session = None, game_info = None):
         logger.info('Finished getting game settings')
         logger.info(game_info)
         self._cc_save_game_info = game_info
+        self.continue_save_operation_when_ready(session)
+
+    
+    def cart_clinic_get_game_settings_error_callback(self = None, session = None, error = None):
+        self._cc_save_game_info_error = error
+        self.start_fram_detection(session)
+        self.continue_save_operation_when_ready(session)
+
+    
+    def continue_save_operation_when_ready(self = None, session = None):
+        '''Continues the save operation once FRAM detection is done and, for
+        saves stored in flash, the game's save settings are known. Failing to
+        identify the game only matters when there is no FRAM.
+        '''
+        if self._cc_save_continued or self._cc_save_fram_detected is None:
+            return None
+        if self._cc_save_fram_detected:
+            self._cc_save_continued = True
+            self._cc_save_game_info = None
+            return self.continue_save_operation(session, True)
+        if self._cc_save_game_info_error is not None:
+            self._cc_save_continued = True
+            return self.cart_clinic_error(self._cc_save_game_info_error)
+        if self._cc_save_game_info is None:
+            return None
+        self._cc_save_continued = True
         self.continue_save_operation(session, False)
 
     
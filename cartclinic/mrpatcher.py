@@ -1,20 +1,191 @@
 # Source Generated with Decompyle++
 # File: mrpatcher.pyc (Python 3.10)
 
+import gzip
 import logging
 import requests
 import platform
 import hashlib
+import threading
 import uuid
+import zlib
 from dataclasses import dataclass, fields
-from cartclinic.consts import MRPATCHER_TIMEOUT_S
+from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cartclinic.consts import MRPATCHER_GZIP_LEVEL, MRPATCHER_POOL_SIZE, MRPATCHER_RETRIES, MRPATCHER_RETRY_BACKOFF_S, MRPATCHER_TIMEOUT_S, MRPATCHER_ZSTD_LEVEL
 from config import __version_sha__
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 flashing_tool_logger = logging.getLogger('mrupdater')
 MRPATCHER_RESPONSE_VERSION = '2.0'
 GAME_ID_SIZE = 512
-GameSaveSettings = dataclass(<NODE:12>)
-MRPatcherResponse = dataclass(<NODE:12>)
-MRPatcherGameInfo = dataclass(<NODE:12>)
+HTTP_NOT_MODIFIED = 304
+HTTP_NOT_FOUND = 404
+HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+# Hash lookups send the ROM's sha256 and size with its ID block. A service
+# that supports them marks every lookup reply with HASH_LOOKUP_HEADER, and
+# answers 404 when it has not seen the ROM yet. An error reply without the
+# marker means the service does not support lookups.
+ROM_SHA256_HEADER = 'X-MR-ROM-SHA256'
+ROM_SIZE_HEADER = 'X-MR-ROM-Size'
+HASH_LOOKUP_HEADER = 'X-MR-Hash-Lookup'
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+def _known_fields(cls, data):
+    '''Returns the entries of `data` that are fields of the dataclass `cls`,
+    so that newer service responses with extra keys still load.'''
+    names = {field.name for field in fields(cls)}
+    return {key: value for key, value in data.items() if key in names}
+
+
+@dataclass
+class GameSaveSettings:
+    '''Where the game keeps its save on the cartridge.'''
+    offset_kb: int = 0
+    save_compatible: bool = True
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**_known_fields(cls, data))
+
+
+@dataclass
+class MRPatcherResponse:
+    '''The patch service's answer for an uploaded ROM.'''
+    game_title: str = ''
+    needs_update: bool = False
+    save_compatible: bool = True
+    uploaded_version: str = ''
+    latest_version: str = ''
+    changes: str = ''
+    patch: str = ''
+    thumbnail: str = ''
+    save_settings: Optional[GameSaveSettings] = None
+    user_error: str = ''
+    error: str = ''
+    error_code: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        data = _known_fields(cls, data)
+        if data.get('save_settings') is not None:
+            data['save_settings'] = GameSaveSettings.from_dict(data['save_settings'])
+        return cls(**data)
+
+
+@dataclass
+class MRPatcherGameInfo:
+    '''The game and save settings identified from a ROM's ID block.'''
+    game_title: str = ''
+    save_settings: Optional[GameSaveSettings] = None
+    user_error: str = ''
+    error: str = ''
+    error_code: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        data = _known_fields(cls, data)
+        if data.get('save_settings') is not None:
+            data['save_settings'] = GameSaveSettings.from_dict(data['save_settings'])
+        return cls(**data)
+
+
+_session = None
+_session_lock = threading.Lock()
+# Request body encoding each service endpoint accepts, once known. None means
+# uploads are sent uncompressed.
+_endpoint_encodings = {}
+# Service endpoints found not to support hash lookups.
+_hash_lookup_unsupported = set()
+
+
+def get_session():
+    '''Returns the HTTP session shared by all MRPatcher requests, so
+    connections to the service are kept alive and reused. Failed connections
+    and overloaded replies are retried with exponential backoff; every
+    request to the service is a lookup, so POSTs are retried too.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=MRPATCHER_RETRIES, backoff_factor=MRPATCHER_RETRY_BACKOFF_S, status_forcelist=RETRY_STATUS_CODES, allowed_methods=None, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=MRPATCHER_POOL_SIZE, pool_maxsize=MRPATCHER_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def choose_encoding(accept_encoding):
+    '''Returns the best request body encoding in an Accept-Encoding header
+    from the service, or None to upload uncompressed.'''
+    offered = set()
+    for item in accept_encoding.split(','):
+        (name, _, params) = item.partition(';')
+        (key, _, quality) = params.partition('=')
+        try:
+            if key.strip().lower() == 'q' and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        offered.add(name.strip().lower())
+    if 'zstd' in offered and zstandard is not None:
+        return 'zstd'
+    if 'gzip' in offered:
+        return 'gzip'
+    return None
+
+
+def encode_body(data, encoding):
+    '''Compresses a request body. ROMs have long padding runs, so this
+    usually shrinks the upload a lot.'''
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=MRPATCHER_ZSTD_LEVEL).compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=MRPATCHER_GZIP_LEVEL, mtime=0)
+    return data
+
+
+def encode_chunks(chunks, encoding):
+    '''Compresses a request body that is sent as a sequence of chunks.'''
+    if encoding is None:
+        yield from chunks
+        return
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=MRPATCHER_ZSTD_LEVEL).compressobj()
+    else:
+        compressor = zlib.compressobj(MRPATCHER_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class StreamingBody:
+    '''A request body that sends a ROM with chunked transfer encoding while
+    it is still being read. Every iteration starts again from the beginning,
+    so the session can resend the whole body when it retries a request.'''
+
+    def __init__(self, rom_stream, encoding = None):
+        self.rom_stream = rom_stream
+        self.encoding = encoding
+
+
+    def __iter__(self):
+        return encode_chunks(self.rom_stream.chunks(), self.encoding)
+
+
+
+def cart_fingerprint(game_binary):
+    '''Returns the fingerprint of a cartridge: the sha256 of its ID block,
+    which is all the service needs to identify the game.'''
+    return hashlib.sha256(game_binary[:GAME_ID_SIZE]).hexdigest()
+
 
 def get_device_id():
     '''Returns a hashed unique device ID based on the MAC address'''
@@ -23,9 +194,11 @@ def get_device_id():
 
 
 class MRPatcherAPI:
-    
-    def __init__(self, endpoint):
+
+    def __init__(self, endpoint, cache = None, session = None):
         self.endpoint = endpoint
+        self.cache = cache
+        self.session = session if session is not None else get_session()
         self._headers = {
             'Content-Type': 'application/octet-stream',
             'X-MR-Client-Version': __version_sha__,
@@ -35,22 +208,162 @@ class MRPatcherAPI:
             'X-MR-Client-Platform-Version': platform.version(),
             'X-MR-Client-Expected-Response-Version': MRPATCHER_RESPONSE_VERSION }
 
-    
+
     def test_connection(self = None):
-        '''Check connection to patching service with a GET request'''
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        '''Check connection to patching service with a GET request. The
+        service's Accept-Encoding header tells which compressed uploads it takes.'''
+        try:
+            res = self.session.get(self.endpoint, headers=self._headers, timeout=MRPATCHER_TIMEOUT_S)
+        except requests.RequestException as e:
+            flashing_tool_logger.warning(f'''Could not reach patching service: {e}''')
+            return False
+        _endpoint_encodings[self.endpoint] = choose_encoding(res.headers.get('Accept-Encoding', ''))
+        return res.ok
+
+
+    def _upload_encoding(self = None):
+        '''Returns the encoding to upload ROMs with, asking the service the
+        first time this endpoint is used.'''
+        if self.endpoint not in _endpoint_encodings:
+            self.test_connection()
+        return _endpoint_encodings.get(self.endpoint)
+
+
+    def _post(self = None, url = None, body = None, headers = None, compress = False):
+        '''POSTs to the service over the shared session. With `compress`, the
+        body is compressed if the service accepts it, and sent again
+        uncompressed if the service refuses the encoding.'''
+        encoding = self._upload_encoding() if compress else None
+        if encoding is not None:
+            encoded_headers = dict(headers)
+            encoded_headers['Content-Encoding'] = encoding
+            res = self.session.post(url, headers=encoded_headers, data=encode_body(body, encoding), timeout=MRPATCHER_TIMEOUT_S)
+            if res.status_code != HTTP_UNSUPPORTED_MEDIA_TYPE:
+                return res
+            flashing_tool_logger.info(f'''Patching service refused {encoding} upload, sending it uncompressed''')
+            _endpoint_encodings[self.endpoint] = None
+        return self.session.post(url, headers=headers, data=body, timeout=MRPATCHER_TIMEOUT_S)
+
+
+    def _lookup_patch(self = None, game_binary = None, headers = None, rom_sha256 = None):
+        '''Asks the service for the patch by the ROM's sha256 and ID block.
+        Returns the reply, or None if the ROM has to be uploaded because the
+        service does not know it or does not support hash lookups.'''
+        if self.endpoint in _hash_lookup_unsupported:
+            return None
+        lookup_headers = dict(headers)
+        lookup_headers[ROM_SHA256_HEADER] = rom_sha256 or hashlib.sha256(game_binary).hexdigest()
+        lookup_headers[ROM_SIZE_HEADER] = str(len(game_binary))
+        res = self._post(f'''{self.endpoint}/lookup''', game_binary[:GAME_ID_SIZE], lookup_headers)
+        if res.headers.get(HASH_LOOKUP_HEADER) is None:
+            if not res.ok:
+                flashing_tool_logger.info(f'''Patching service answered hash lookup with {res.status_code}, uploading ROMs''')
+                _hash_lookup_unsupported.add(self.endpoint)
+            return None
+        if res.status_code == HTTP_NOT_FOUND:
+            flashing_tool_logger.info('Patching service does not know this ROM, uploading it')
+            return None
+        return res
+
+
+    def _cached_request(self = None, key = None, response_class = None, send = None):
+        '''Returns the fresh cached response for `key`, or calls
+        `send(headers)` to ask the service, passing the ETag of a stale
+        response so the service can answer 304. Responses without errors are
+        cached.'''
+        headers = dict(self._headers)
+        entry = self.cache.get(key, response_class)
+        if entry is not None and entry.is_fresh():
+            flashing_tool_logger.info('Using cached patch service response')
+            return entry.response
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        res = send(headers)
+        if res.status_code == HTTP_NOT_MODIFIED and entry is not None:
+            flashing_tool_logger.info('Cached patch service response is still valid')
+            self.cache.refresh(key)
+            return entry.response
+        response = response_class.from_dict(res.json())
+        if not response.error:
+            self.cache.put(key, response, res.headers.get('ETag'))
+        return response
+
+
+    def _send_patch_request(self = None, game_binary = None, headers = None):
+        res = self._lookup_patch(game_binary, headers)
+        if res is None:
+            res = self._post(self.endpoint, game_binary, headers, compress=True)
+        return res
+
+
     def request_patch(self = None, game_binary = None):
-        '''Requests a game patch from the service on the given ROM.'''
-        res = requests.post(self.endpoint, self._headers, game_binary, MRPATCHER_TIMEOUT_S, **('headers', 'data', 'timeout'))
-        return MRPatcherResponse.from_dict(res.json())
+        '''Requests a game patch from the service on the given ROM. The ROM
+        is looked up by hash first and only uploaded if the service does not
+        know it. With a cache, a fresh cached response is returned without
+        any request, and a stale one is revalidated with its ETag.'''
+        if self.cache is None:
+            res = self._send_patch_request(game_binary, self._headers)
+            return MRPatcherResponse.from_dict(res.json())
+        return self._cached_request(self.cache.key_for(game_binary), MRPatcherResponse, lambda headers: self._send_patch_request(game_binary, headers))
 
-    
-    def get_game_id(self = None, game_binary = None):
-        '''Requests game id and save settings using just the ID portion of a given ROM.'''
-        game_id_block = game_binary[:GAME_ID_SIZE]
-        res = requests.post(f'''{self.endpoint}/game_id''', self._headers, game_id_block, MRPATCHER_TIMEOUT_S, **('headers', 'data', 'timeout'))
-        return MRPatcherGameInfo.from_dict(res.json())
 
+    def request_patch_stream(self = None, rom_stream = None):
+        '''Requests a game patch for a ROM that is still being read into
+        `rom_stream`. The ROM is hashed as it is read, so the hash lookup
+        goes out as soon as the read ends, and a lookup miss is answered by
+        streaming the ROM straight from `rom_stream`. If the service is known
+        not to support hash lookups, the ROM is uploaded while it is read, so
+        the check takes about as long as the slower of the read and the upload.'''
+        if self.endpoint in _hash_lookup_unsupported:
+            res = self._send_patch_stream(rom_stream, self._headers)
+            response = MRPatcherResponse.from_dict(res.json())
+            if self.cache is not None and not response.error:
+                self.cache.put(self.cache.key_for(rom_stream.result()), response, res.headers.get('ETag'))
+            return response
+        hasher = hashlib.sha256()
+        for chunk in rom_stream.chunks():
+            hasher.update(chunk)
+        rom_sha256 = hasher.hexdigest()
+        game_binary = rom_stream.result()
+
+        def send(headers):
+            res = self._lookup_patch(game_binary, headers, rom_sha256)
+            if res is None:
+                res = self._send_patch_stream(rom_stream, headers)
+            return res
+
+        if self.cache is None:
+            return MRPatcherResponse.from_dict(send(self._headers).json())
+        return self._cached_request(self.cache.key_for(game_binary, rom_sha256), MRPatcherResponse, send)
+
+
+    def _send_patch_stream(self = None, rom_stream = None, headers = None):
+        '''Uploads the ROM in `rom_stream` as it is read, compressed if the
+        service accepts it, and again uncompressed if it refuses the encoding.'''
+        encoding = self._upload_encoding()
+        res = self._post_stream(rom_stream, headers, encoding)
+        if res.status_code == HTTP_UNSUPPORTED_MEDIA_TYPE and encoding is not None:
+            flashing_tool_logger.info(f'''Patching service refused {encoding} upload, sending it uncompressed''')
+            _endpoint_encodings[self.endpoint] = None
+            res = self._post_stream(rom_stream, headers, None)
+        return res
+
+
+    def _post_stream(self = None, rom_stream = None, headers = None, encoding = None):
+        headers = dict(headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return self.session.post(self.endpoint, headers=headers, data=StreamingBody(rom_stream, encoding), timeout=MRPATCHER_TIMEOUT_S)
+
+
+    def get_game_id(self = None, game_binary = None):
+        '''Requests game id and save settings using just the ID portion of a given ROM.
+        With a cache, carts with the same fingerprint reuse the game info.'''
+        game_id_block = bytes(game_binary[:GAME_ID_SIZE])
+        url = f'''{self.endpoint}/game_id'''
+        if self.cache is None:
+            res = self._post(url, game_id_block, self._headers)
+            return MRPatcherGameInfo.from_dict(res.json())
+        key = self.cache.key_for_game_id(cart_fingerprint(game_id_block))
+        return self._cached_request(key, MRPatcherGameInfo, lambda headers: self._post(url, game_id_block, headers))
 
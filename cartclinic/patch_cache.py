@@ -0,0 +1,162 @@
+'''
+On-disk cache of patch service responses.
+
+A response depends only on the ROM, the response format and the client
+version, so it is stored under a key made of the ROM's sha256,
+MRPATCHER_RESPONSE_VERSION and the client version. Within the TTL a cached
+response is used without contacting the service; after it, the stored ETag
+lets the service answer 304 instead of sending the patch again. The cache is
+bounded in size and evicts the least recently used responses first.
+
+Game info is cached the same way, under the fingerprint of the cartridge's
+ID block.
+'''
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Union
+from cartclinic.consts import MRPATCHER_CACHE_MAX_BYTES, MRPATCHER_CACHE_TTL_S
+from cartclinic.mrpatcher import MRPATCHER_RESPONSE_VERSION, MRPatcherGameInfo, MRPatcherResponse
+from config import __version_sha__
+flashing_tool_logger = logging.getLogger('mrupdater')
+CACHE_DIR_NAME = 'mrpatcher_cache'
+CACHE_FILE_SUFFIX = '.json'
+
+
+@dataclass
+class PatchCacheEntry:
+    '''A cached response or game info, the ETag the service sent with it and when it was
+    last confirmed to be current.'''
+    response: Union[MRPatcherResponse, MRPatcherGameInfo]
+    etag: Optional[str]
+    stored_at: float
+    ttl_s: float
+
+    def is_fresh(self):
+        return time.time() - self.stored_at < self.ttl_s
+
+
+class PatchCache:
+
+    def __init__(self, cache_dir, ttl_s = MRPATCHER_CACHE_TTL_S, max_bytes = MRPATCHER_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+
+    def key_for(self, game_binary, rom_sha256 = None):
+        '''Returns the cache key of a ROM for this client and response version.
+        Pass `rom_sha256` if the ROM's sha256 is already known.'''
+        rom_sha256 = rom_sha256 or hashlib.sha256(game_binary).hexdigest()
+        return hashlib.sha256(f'''{rom_sha256}:{MRPATCHER_RESPONSE_VERSION}:{__version_sha__}'''.encode()).hexdigest()
+
+
+    def key_for_game_id(self, fingerprint):
+        '''Returns the cache key of the game info for a cart fingerprint.'''
+        return hashlib.sha256(f'''game_id:{fingerprint}:{MRPATCHER_RESPONSE_VERSION}:{__version_sha__}'''.encode()).hexdigest()
+
+
+    def _path(self, key):
+        return self.cache_dir / f'''{key}{CACHE_FILE_SUFFIX}'''
+
+
+    def get(self, key, response_class = MRPatcherResponse):
+        '''Returns the cached entry for `key`, fresh or stale, or None. A hit
+        marks the entry as recently used. The response is loaded as
+        `response_class`, such as MRPatcherGameInfo for game info.'''
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as cache_file:
+                    data = json.load(cache_file)
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError) as e:
+                flashing_tool_logger.warning(f'''Discarding unreadable patch cache entry {path.name}: {e}''')
+                path.unlink(missing_ok=True)
+                return None
+        return PatchCacheEntry(response_class.from_dict(data['response']), data.get('etag'), data.get('stored_at', 0), self.ttl_s)
+
+
+    def put(self, key, response, etag = None):
+        '''Stores a response and evicts the least recently used entries until
+        the cache fits in max_bytes.'''
+        data = {
+            'response': asdict(response),
+            'etag': etag,
+            'stored_at': time.time() }
+        self._write(key, data)
+        self._evict()
+
+
+    def refresh(self, key):
+        '''Marks a stale entry as current again after the service confirmed it.'''
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as cache_file:
+                    data = json.load(cache_file)
+            except (OSError, ValueError):
+                return None
+        data['stored_at'] = time.time()
+        self._write(key, data)
+
+
+    def _write(self, key, data):
+        path = self._path(key)
+        temp_path = path.with_suffix('.tmp')
+        with self._lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                    json.dump(data, cache_file)
+                os.replace(temp_path, path)
+            except OSError as e:
+                flashing_tool_logger.warning(f'''Failed to write patch cache entry: {e}''')
+                temp_path.unlink(missing_ok=True)
+
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    os.remove(entry.path)
+
+
+_patch_cache = None
+_patch_cache_lock = threading.Lock()
+
+
+def get_patch_cache():
+    '''Returns the application's patch cache in the user data directory.'''
+    global _patch_cache
+    with _patch_cache_lock:
+        if _patch_cache is None:
+            from flashing_tool.constants import APP_DATA_DIR
+            _patch_cache = PatchCache(Path(APP_DATA_DIR) / CACHE_DIR_NAME)
+        return _patch_cache
@@ -0,0 +1,81 @@
+'''
+ROM data shared between the thread reading a cartridge and the threads that
+send it to the patch service while the read is still going.
+'''
+import threading
+
+
+class RomStreamAborted(Exception):
+    '''Exception raised to consumers of a RomStream whose cartridge read failed.'''
+    pass
+
+
+class RomStream:
+    '''A ROM that grows as banks are read off the cartridge. The reader
+    appends each bank and closes the stream at the end; consumers on other
+    threads block until the data they need is there. Everything appended is
+    kept, so the stream can be read from the start any number of times.
+    '''
+
+    def __init__(self):
+        self._data = bytearray()
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+
+
+    def append(self, chunk):
+        with self._condition:
+            self._data += chunk
+            self._condition.notify_all()
+
+
+    def close(self):
+        '''Marks the ROM as completely read.'''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+    def abort(self, error = None):
+        '''Marks the read as failed; waiting consumers raise RomStreamAborted.'''
+        with self._condition:
+            self._error = error or RomStreamAborted('Cartridge read failed')
+            self._closed = True
+            self._condition.notify_all()
+
+
+    def _wait(self, predicate):
+        with self._condition:
+            self._condition.wait_for(lambda: predicate() or self._closed)
+            if self._error is not None:
+                raise RomStreamAborted(str(self._error)) from self._error
+
+
+    def wait_for(self, size):
+        '''Returns the first `size` bytes of the ROM once they are read, or
+        the whole ROM if it is shorter.'''
+        self._wait(lambda: len(self._data) >= size)
+        with self._condition:
+            return bytes(self._data[:size])
+
+
+    def result(self):
+        '''Returns the whole ROM once it is read.'''
+        self._wait(lambda: False)
+        return self._data
+
+
+    def chunks(self):
+        '''Yields the ROM from the start in the pieces it was read in, waiting
+        for each one to arrive.'''
+        offset = 0
+        while True:
+            self._wait(lambda: len(self._data) > offset)
+            with self._condition:
+                end = len(self._data)
+                if offset == end:
+                    return
+                chunk = bytes(self._data[offset:end])
+            offset = end
+            yield chunk
@@ -0,0 +1,111 @@
+# Content-addressed store of cached firmware files
+# Keeps each MCU binary and FPGA bitstream once, under its SHA-256
+
+import os
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger('mrupdater.blob_store')
+
+class BlobStore:
+    """
+    Firmware files stored once under their SHA-256.
+
+    A blob lives at ``<root>/<first two hex digits>/<sha256>``. Firmware
+    versions whose MCU binary or FPGA bitstream did not change share the
+    same blob, and the package metadata of each version points at the
+    blobs it uses. Blobs no version points at any more are removed by
+    collect_garbage().
+    """
+
+    def __init__(self, root: Path, digest_index=None):
+        self.root = Path(root)
+        self.digest_index = digest_index
+        self.logger = logging.getLogger('mrupdater.blob_store')
+        self._lock = threading.Lock()
+
+    def path(self, sha256: str) -> Path:
+        """
+        Get the path of a blob, whether or not it is stored yet.
+
+        Args:
+            sha256: SHA256 checksum in hexadecimal
+
+        Returns:
+            Path: Path to the blob
+        """
+        sha256 = sha256.lower()
+        return self.root / sha256[:2] / sha256
+
+    def prepare(self, sha256: str) -> Path:
+        """Get the path of a blob about to be written, creating its directory"""
+        blob_path = self.path(sha256)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        return blob_path
+
+    def has(self, sha256: str, size: Optional[int] = None) -> bool:
+        """
+        Check whether a blob is stored and intact.
+
+        The blob's digest is checked through the digest index when there is
+        one, so an unchanged blob is not hashed again.
+
+        Args:
+            sha256: SHA256 checksum in hexadecimal
+            size: Expected size in bytes, if known
+
+        Returns:
+            bool: True if the blob can be used without downloading it
+        """
+        blob_path = self.path(sha256)
+        try:
+            if size is not None and os.path.getsize(blob_path) != size:
+                return False
+            if self.digest_index is not None:
+                return self.digest_index.sha256(blob_path) == sha256.lower()
+            return blob_path.exists()
+        except OSError:
+            return False
+
+    def size(self, file_path) -> int:
+        """Get the size of a stored file, or 0 if it is missing"""
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+
+    def collect_garbage(self, referenced: Iterable) -> List[Path]:
+        """
+        Remove every blob that is not referenced.
+
+        Args:
+            referenced: Paths of the blobs still in use
+
+        Returns:
+            List[Path]: Removed blobs
+        """
+        keep = {os.path.abspath(file_path) for file_path in referenced}
+        removed = []
+        with self._lock:
+            if not self.root.exists():
+                return removed
+            for blob_dir in self.root.iterdir():
+                if not blob_dir.is_dir():
+                    continue
+                for blob_path in blob_dir.iterdir():
+                    # Blob names are bare digests; leave partial and temporary
+                    # files to the downloader
+                    if '.' in blob_path.name:
+                        continue
+                    if os.path.abspath(blob_path) in keep:
+                        continue
+                    try:
+                        blob_path.unlink()
+                        removed.append(blob_path)
+                        if self.digest_index is not None:
+                            self.digest_index.forget(blob_path)
+                    except OSError as e:
+                        self.logger.warning(f"Failed to remove firmware blob {blob_path.name}: {e}")
+        return removed
@@ -0,0 +1,174 @@
+# Size and last-use index of the cached firmware packages
+# Keeps the firmware cache within a byte budget without walking it
+
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterable
+
+logger = logging.getLogger('mrupdater.cache_index')
+
+# Bytes of firmware packages kept before the least recently used are evicted
+FIRMWARE_CACHE_BUDGET_BYTES = 256 * 1024 * 1024
+
+CACHE_INDEX_SCHEMA_VERSION = 1
+
+class FirmwareCacheIndex:
+    """
+    Index of the cached firmware versions, their sizes and last use.
+
+    The total size is kept up to date as versions are added and removed,
+    so reading it never touches the disk. The index also remembers which
+    version is installed on the device, since that version is never
+    evicted.
+    """
+
+    def __init__(self, path: Path, budget_bytes: int = FIRMWARE_CACHE_BUDGET_BYTES):
+        self.path = Path(path)
+        self.budget_bytes = budget_bytes
+        self.logger = logging.getLogger('mrupdater.cache_index')
+        self.installed_version: Optional[str] = None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._total_size = 0
+        self._lock = threading.Lock()
+        self.loaded = self._read()
+
+    @property
+    def total_size(self) -> int:
+        """Total bytes of all cached versions"""
+        return self._total_size
+
+    def versions(self) -> List[str]:
+        """Cached versions, least recently used first"""
+        with self._lock:
+            return sorted(self._entries, key=lambda v: self._entries[v]['last_used'])
+
+    def add(self, version_str: str, size: int):
+        """
+        Record a version stored in the cache, or its new size.
+
+        Args:
+            version_str: Firmware version
+            size: Bytes the version takes up on disk
+        """
+        with self._lock:
+            previous = self._entries.get(version_str)
+            if previous:
+                self._total_size -= previous['size']
+            self._entries[version_str] = {'size': size, 'last_used': time.time()}
+            self._total_size += size
+            self._save()
+
+    def touch(self, version_str: str):
+        """Record that a cached version was used"""
+        with self._lock:
+            entry = self._entries.get(version_str)
+            if entry:
+                entry['last_used'] = time.time()
+                self._save()
+
+    def remove(self, version_str: str):
+        """Drop a version removed from the cache"""
+        with self._lock:
+            entry = self._entries.pop(version_str, None)
+            if entry:
+                self._total_size -= entry['size']
+                self._save()
+
+    def set_installed(self, version_str: str):
+        """Record the version installed on the device"""
+        with self._lock:
+            self.installed_version = version_str
+            self._save()
+
+    def update_sizes(self, sizes: Dict[str, int]):
+        """
+        Update the sizes of cached versions, keeping their last use.
+
+        Args:
+            sizes: Bytes each cached version takes up
+        """
+        with self._lock:
+            for version_str, size in sizes.items():
+                entry = self._entries.get(version_str)
+                if entry:
+                    self._total_size += size - entry['size']
+                    entry['size'] = size
+            self._save()
+
+    def rebuild(self, sizes: Dict[str, int]):
+        """
+        Replace the index with the versions found on disk.
+
+        Args:
+            sizes: Bytes each cached version takes up
+        """
+        with self._lock:
+            now = time.time()
+            self._entries = {v: {'size': size, 'last_used': now} for v, size in sizes.items()}
+            self._total_size = sum(sizes.values())
+            self._save()
+
+    def clear(self):
+        """Drop every version, keeping the installed version on record"""
+        self.rebuild({})
+
+    def select_evictions(self, protected: Iterable[Optional[str]] = ()) -> List[str]:
+        """
+        Choose versions to evict to bring the cache within its budget.
+
+        Args:
+            protected: Versions that must be kept, such as the installed,
+                latest and rollback versions
+
+        Returns:
+            List[str]: Versions to evict, least recently used first
+        """
+        keep = {v for v in protected if v} | {self.installed_version}
+        evictions = []
+        with self._lock:
+            excess = self._total_size - self.budget_bytes
+            for version_str in sorted(self._entries, key=lambda v: self._entries[v]['last_used']):
+                if excess <= 0:
+                    break
+                if version_str in keep:
+                    continue
+                evictions.append(version_str)
+                excess -= self._entries[version_str]['size']
+        return evictions
+
+    def _read(self) -> bool:
+        try:
+            with open(self.path, 'r') as f:
+                index = json.load(f)
+            if index.get('schema_version') != CACHE_INDEX_SCHEMA_VERSION:
+                return False
+            self._entries = {v: {'size': int(e['size']), 'last_used': float(e['last_used'])}
+                             for v, e in index['versions'].items()}
+            self._total_size = sum(e['size'] for e in self._entries.values())
+            self.installed_version = index.get('installed_version')
+            return True
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.logger.warning(f"Ignoring unreadable firmware cache index: {e}")
+            self._entries = {}
+            self._total_size = 0
+            return False
+
+    def _save(self):
+        index = {
+            'schema_version': CACHE_INDEX_SCHEMA_VERSION,
+            'installed_version': self.installed_version,
+            'versions': self._entries,
+        }
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"Failed to save firmware cache index: {e}")
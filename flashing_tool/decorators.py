@@ -27,7 +27,7 @@ def trace(debug = None, sample_rate = None):
     filter_level = logging.DEBUG if debug else logging.INFO
     logger.setLevel(filter_level)
     if sample_rate is not None:
-        logger.addFilter(UniformSamplingFilter(sample_rate, filter_level, **('p', 'level')))
+        logger.addFilter(UniformSamplingFilter(p=sample_rate, level=filter_level))
     
     def decorator(func = None):
         
@@ -35,13 +35,17 @@ def trace(debug = None, sample_rate = None):
             inner.call_count += 1
             logger.info(f'''Call no. {inner.call_count} of {func.__name__}''')
             if debug:
-                args_repr = (lambda .0: [ repr(a) for a in .0 ])(args)
-                args_repr.extend((lambda .0: [ f'''{k}={repr(v)}''' for k, v in .0 ])(kwargs.items()))
+                args_repr = [ repr(a) for a in args ]
+                args_repr.extend([ f'''{k}={repr(v)}''' for k, v in kwargs.items() ])
                 signature = ', '.join(args_repr)
                 logger.debug(f'''Calling {func.__name__}({signature})''')
             started_at = time.perf_counter()
-        # Assignment completed
-        inner = None(inner)
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - started_at
+            logger.info(f'''Finished {func.__name__} in {elapsed:.4f} secs''')
+            return result
+
+        inner = wraps(func)(inner)
         inner.call_count = 0
         return inner
 
@@ -54,10 +58,15 @@ def handle_exceptions(exceptions = None, raise_as = None):
     def decorator(func = None):
         
         def inner(*args, **kwargs):
-            pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
-        inner = None(inner)
+            try:
+                return func(*args, **kwargs)
+            except exceptions as e:
+                logger.error(f'''{func.__name__} failed: {e}''')
+                if raise_as is None:
+                    return None
+                raise raise_as(str(e)) from e
+
+        inner = wraps(func)(inner)
         return inner
 
     return decorator
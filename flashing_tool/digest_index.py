@@ -0,0 +1,150 @@
+# Remembered SHA-256 digests of cached firmware files
+# Lets repeated validation of an unchanged file cost a stat instead of a hash
+
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from .hashing import hash_files
+
+logger = logging.getLogger('mrupdater.digest_index')
+
+# How long a remembered digest is trusted before the file is hashed again
+# anyway, to catch corruption that leaves size and mtime alone
+DIGEST_AUDIT_INTERVAL_S = 24 * 60 * 60
+
+DIGEST_INDEX_SCHEMA_VERSION = 1
+
+class DigestIndex:
+    """
+    Sidecar index of verified SHA-256 digests.
+
+    Each entry is keyed by the file's path and holds the size, mtime_ns and
+    inode the file had when it was hashed. A digest is returned from the
+    index only while all three still match and the entry is younger than
+    the audit interval; otherwise the file is hashed again.
+    """
+
+    def __init__(self, path: Path, audit_interval_s: float = DIGEST_AUDIT_INTERVAL_S):
+        self.path = Path(path)
+        self.audit_interval_s = audit_interval_s
+        self.logger = logging.getLogger('mrupdater.digest_index')
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+
+    def sha256(self, file_path) -> str:
+        """
+        Get the SHA-256 of a file, hashing it only if it may have changed.
+
+        Args:
+            file_path: Path to file
+
+        Returns:
+            str: SHA256 checksum in hexadecimal
+        """
+        return self.sha256_many([file_path])[0]
+
+    def sha256_many(self, file_paths: List) -> List[str]:
+        """
+        Get the SHA-256 of several files, hashing the ones that may have
+        changed concurrently.
+
+        Args:
+            file_paths: Paths to files
+
+        Returns:
+            List[str]: SHA256 checksums in hexadecimal, in the order given
+        """
+        keys = [self._key(file_path) for file_path in file_paths]
+        stats = [os.stat(key) for key in keys]
+        digests: List[Optional[str]] = []
+        with self._lock:
+            entries = self._load()
+            for key, stat in zip(keys, stats):
+                entry = entries.get(key)
+                fresh = entry and self._matches(entry, stat) and self._is_recent(entry)
+                digests.append(entry['sha256'] if fresh else None)
+
+        stale = [i for i, digest in enumerate(digests) if digest is None]
+        if not stale:
+            return digests
+        for i, digest in zip(stale, _hash_files([keys[i] for i in stale])):
+            digests[i] = digest
+            # Only trust the digest if the file did not change while it was read
+            if _stat_key(os.stat(keys[i])) == _stat_key(stats[i]):
+                self._store(keys[i], stats[i], digest)
+        return digests
+
+    def record(self, file_path, digest: str):
+        """
+        Remember the digest of a file that was hashed as it was written.
+
+        Args:
+            file_path: Path to file
+            digest: SHA256 checksum in hexadecimal
+        """
+        key = self._key(file_path)
+        self._store(key, os.stat(key), digest)
+
+    def forget(self, file_path):
+        """Drop the entry of a file that was removed or replaced"""
+        key = self._key(file_path)
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+    def _key(self, file_path) -> str:
+        return os.path.abspath(file_path)
+
+    def _matches(self, entry: Dict[str, Any], stat: os.stat_result) -> bool:
+        return (entry.get('size'), entry.get('mtime_ns'), entry.get('inode')) == _stat_key(stat)
+
+    def _is_recent(self, entry: Dict[str, Any]) -> bool:
+        age = time.time() - entry.get('verified_at', 0)
+        return 0 <= age < self.audit_interval_s
+
+    def _store(self, key: str, stat: os.stat_result, digest: str):
+        size, mtime_ns, inode = _stat_key(stat)
+        with self._lock:
+            self._load()[key] = {
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'inode': inode,
+                'sha256': digest,
+                'verified_at': time.time(),
+            }
+            self._save()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path, 'r') as f:
+                    index = json.load(f)
+                if index.get('schema_version') == DIGEST_INDEX_SCHEMA_VERSION:
+                    self._entries = dict(index['entries'])
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self.logger.warning(f"Ignoring unreadable digest index: {e}")
+        return self._entries
+
+    def _save(self):
+        index = {'schema_version': DIGEST_INDEX_SCHEMA_VERSION, 'entries': self._entries}
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"Failed to save digest index: {e}")
+
+def _stat_key(stat: os.stat_result):
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def _hash_files(file_paths: List[str]) -> List[str]:
+    return [digests['sha256'] for digests in hash_files(file_paths)]
@@ -0,0 +1,580 @@
+# Concurrent download of the files that make up a Chromatic firmware package
+# All files of a package are fetched at once over one shared S3 client
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable
+
+from libpyretro.ips_util import patch_from_bytes
+
+logger = logging.getLogger('mrupdater.firmware_download')
+
+# Number of files of a package downloaded at the same time
+FIRMWARE_DOWNLOAD_WORKERS = 4
+
+# Bytes read from the network at a time while streaming a file to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Files are split into at most this many ranges downloaded at the same time,
+# each at least RANGED_DOWNLOAD_MIN_SEGMENT_SIZE bytes long
+RANGED_DOWNLOAD_SEGMENTS = 4
+RANGED_DOWNLOAD_MIN_SEGMENT_SIZE = 2 * 1024 * 1024
+
+# Retries of a dropped transfer before a download attempt gives up
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_RETRY_DELAY_S = 0.5
+
+class FirmwareValidationError(Exception):
+    """Raised when firmware validation fails"""
+    pass
+
+class FirmwareDownloadError(Exception):
+    """Raised when firmware download fails"""
+    pass
+
+class FirmwareDownloadCancelled(FirmwareDownloadError):
+    """Raised when a download is cancelled before it completes"""
+    pass
+
+@dataclass
+class DeltaSource:
+    """A binary delta that turns a cached file into the one being downloaded"""
+    s3_key: str
+    # Cached file the delta applies to
+    base_path: Path
+    expected_size: Optional[int] = None
+
+@dataclass
+class DownloadJob:
+    """A file to fetch as part of a firmware package"""
+    name: str
+    s3_key: str
+    # Where to store the file, or None to read it as text
+    local_path: Optional[Path] = None
+    expected_checksum: Optional[str] = None
+    expected_size: Optional[int] = None
+    # Whether the package is unusable without this file
+    required: bool = True
+    # Delta tried before downloading the whole file; needs expected_checksum
+    delta: Optional[DeltaSource] = None
+
+class BandwidthLimiter:
+    """
+    Paces the bytes received by several downloads to a combined rate.
+
+    Every chunk is given the next free slot of bytes_per_s, and the thread
+    that received it waits until that slot has passed.
+    """
+
+    def __init__(self, bytes_per_s: int):
+        self.bytes_per_s = bytes_per_s
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def delay(self, byte_count: int) -> float:
+        """
+        Reserve the time to receive a chunk.
+
+        Args:
+            byte_count: Bytes in the chunk
+
+        Returns:
+            float: Seconds to wait before receiving more
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._next_time = max(now, self._next_time) + byte_count / self.bytes_per_s
+            return self._next_time - now
+
+class ByteProgress:
+    """
+    Combined byte count of several downloads running at once.
+
+    Each download reports the bytes it received from its own thread; the
+    callback always sees the total received so far across all of them.
+    Bytes received over the network also pass through the optional
+    bandwidth limit and cancel event shared by the downloads.
+    """
+
+    def __init__(self, total_bytes: int,
+                 callback: Optional[Callable[[int, int], None]] = None,
+                 limiter: Optional[BandwidthLimiter] = None,
+                 cancel_event: Optional[threading.Event] = None):
+        self.total_bytes = total_bytes
+        self.bytes_downloaded = 0
+        self._callback = callback
+        self._limiter = limiter
+        self._cancel_event = cancel_event
+        self._lock = threading.Lock()
+
+    def add(self, byte_count: int):
+        """Record bytes received by one of the downloads"""
+        with self._lock:
+            self.bytes_downloaded += byte_count
+            if self._callback:
+                self._callback(self.bytes_downloaded, self.total_bytes)
+
+    def received(self, byte_count: int):
+        """
+        Record bytes just received over the network, waiting as long as
+        the bandwidth limit requires.
+
+        Raises:
+            FirmwareDownloadCancelled: If the download was cancelled
+        """
+        self.add(byte_count)
+        self.check_cancelled()
+        if self._limiter is not None:
+            delay = self._limiter.delay(byte_count)
+            if delay > 0:
+                if self._cancel_event is not None:
+                    self._cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+                self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise FirmwareDownloadCancelled if the download was cancelled"""
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise FirmwareDownloadCancelled("Download cancelled")
+
+class FirmwareDownloader:
+    """
+    Downloads the files of a firmware package concurrently.
+
+    Files are fetched on a bounded thread pool through one S3Wrapper, so
+    they share its client and connection pool. A failure is handled per
+    file: optional files are logged and skipped, while any required file
+    failing stops the download and removes every file it completed. The
+    .part files of unfinished files are kept for the next attempt, and a
+    cancelled download also keeps the files it completed.
+    """
+
+    def __init__(self, s3_wrapper, workers: int = FIRMWARE_DOWNLOAD_WORKERS,
+                 segments: int = RANGED_DOWNLOAD_SEGMENTS,
+                 min_segment_size: int = RANGED_DOWNLOAD_MIN_SEGMENT_SIZE,
+                 digest_index=None):
+        self.s3_wrapper = s3_wrapper
+        # Optional DigestIndex told the digest of every file stored
+        self.digest_index = digest_index
+        self.workers = workers
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+        self.logger = logging.getLogger('mrupdater.firmware_download')
+
+    def download(self, jobs: List[DownloadJob],
+                 progress_callback: Optional[Callable[[str], None]] = None,
+                 byte_progress_callback: Optional[Callable[[int, int], None]] = None,
+                 cancel_event: Optional[threading.Event] = None,
+                 bandwidth_limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Download all files of a package.
+
+        Args:
+            jobs: Files to download
+            progress_callback: Optional callback for status messages
+            byte_progress_callback: Optional callback receiving the bytes
+                downloaded so far and the total expected, across all files
+            cancel_event: Optional event that stops the download when set
+            bandwidth_limit: Optional limit in bytes per second on all
+                files together
+
+        Returns:
+            Dict[str, Any]: For each job name, the stored file's path, the
+            text read, or None for an optional file that failed
+
+        Raises:
+            FirmwareDownloadCancelled: If cancel_event was set
+            FirmwareDownloadError: If a required file failed
+        """
+        # Total is only known when the manifest gives every file's size
+        file_jobs = [job for job in jobs if job.local_path is not None]
+        total_bytes = 0
+        if all(job.expected_size is not None for job in file_jobs):
+            total_bytes = sum(job.expected_size for job in file_jobs)
+        limiter = BandwidthLimiter(bandwidth_limit) if bandwidth_limit else None
+        progress = ByteProgress(total_bytes, byte_progress_callback, limiter, cancel_event)
+
+        results: Dict[str, Any] = {}
+        errors: List[str] = []
+        cancelled = False
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(jobs))),
+                                thread_name_prefix='firmware-download') as executor:
+            futures = {executor.submit(self._run_job, job, progress): job for job in jobs}
+
+            for future in as_completed(futures):
+                job = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    results[job.name] = future.result()
+                    if progress_callback:
+                        progress_callback(f"Downloaded {job.name}")
+                except FirmwareDownloadCancelled:
+                    cancelled = True
+                    for pending in futures:
+                        pending.cancel()
+                except Exception as e:
+                    if not job.required:
+                        self.logger.warning(f"Failed to download {job.name}: {e}")
+                        results[job.name] = None
+                        continue
+                    self.logger.error(f"Failed to download {job.name}: {e}")
+                    errors.append(f"{job.name}: {e}")
+                    # No point fetching the rest of a package we cannot use
+                    for pending in futures:
+                        pending.cancel()
+
+        if cancelled and not errors:
+            self.logger.info("Firmware download cancelled")
+            raise FirmwareDownloadCancelled("Download cancelled")
+        if errors:
+            self._cleanup(jobs)
+            raise FirmwareDownloadError("; ".join(errors))
+
+        return results
+
+    def _run_job(self, job: DownloadJob, progress: ByteProgress) -> Any:
+        """Fetch one file of the package"""
+        progress.check_cancelled()
+        if job.local_path is None:
+            return self.s3_wrapper.read_file(job.s3_key)
+
+        if job.delta is not None and job.expected_checksum:
+            try:
+                self._apply_delta(job)
+                progress.add(job.expected_size or 0)
+                return str(job.local_path)
+            except Exception as e:
+                self.logger.warning(f"Could not update {job.name} from a delta, downloading it in full: {e}")
+
+        self._download_file_with_validation(job, progress)
+        return str(job.local_path)
+
+    def _apply_delta(self, job: DownloadJob):
+        """
+        Build a file by applying a delta to the cached file it was made from.
+
+        The delta may be in any patch format libpyretro.ips_util reads. The
+        result must match the job's size and checksum before it is stored.
+
+        Args:
+            job: File to build, with the delta to build it from
+        """
+        delta = bytearray()
+        body = self.s3_wrapper.open_file(job.delta.s3_key)
+        try:
+            for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                delta += chunk
+                if job.delta.expected_size is not None and len(delta) > job.delta.expected_size:
+                    raise FirmwareValidationError("Delta is bigger than the manifest says")
+        finally:
+            body.close()
+
+        with open(job.delta.base_path, 'rb') as f:
+            base = f.read()
+        target = patch_from_bytes(delta).apply(base)
+
+        # Validate file size
+        if job.expected_size is not None and len(target) != job.expected_size:
+            raise FirmwareValidationError(
+                f"File size mismatch: expected {job.expected_size}, got {len(target)}"
+            )
+
+        # Validate checksum
+        actual_checksum = hashlib.sha256(target).hexdigest()
+        if actual_checksum != job.expected_checksum:
+            raise FirmwareValidationError(
+                f"Checksum mismatch: expected {job.expected_checksum}, got {actual_checksum}"
+            )
+
+        _write_file_atomically(Path(job.local_path), target)
+        self._record_digest(job.local_path, actual_checksum)
+
+    def _record_digest(self, local_path: Path, digest: str):
+        """Remember the digest of a file that was hashed while it was written"""
+        if self.digest_index is not None:
+            self.digest_index.record(local_path, digest)
+
+    def _segment_count(self, size: int) -> int:
+        """Number of ranges a file of this size is downloaded in at once"""
+        return max(1, min(self.segments, size // self.min_segment_size))
+
+    def _download_file_with_validation(self, job: DownloadJob, progress: ByteProgress):
+        """
+        Download file from S3 with validation.
+
+        The file is downloaded into a .part file next to its final path,
+        which survives failures so a later attempt resumes where this one
+        stopped, as long as the object's ETag is unchanged. Large files are
+        fetched as several ranges at once. The first range is hashed as its
+        bytes arrive; only bytes from earlier attempts or other ranges are
+        read back to finish the hash. Only a complete, valid file is synced
+        and renamed into place.
+
+        Args:
+            job: File to download
+            progress: Combined progress to report received bytes to
+        """
+        local_path = Path(job.local_path)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+
+        metadata = self.s3_wrapper.get_file_metadata(job.s3_key)
+        size = metadata['ContentLength']
+        etag = metadata.get('ETag')
+
+        # Validate file size
+        if job.expected_size is not None and size != job.expected_size:
+            raise FirmwareValidationError(
+                f"File size mismatch: expected {job.expected_size}, got {size}"
+            )
+
+        partial = PartialDownload(local_path)
+        if partial.resume(etag, size):
+            self.logger.info(f"Resuming download of {job.name} at {partial.bytes_done} of {size} bytes")
+        else:
+            partial.start(etag, size, self._segment_count(size))
+        progress.add(partial.bytes_done)
+
+        try:
+            sha256_hash = hashlib.sha256()
+            first, *others = partial.segments
+            _hash_file_range(partial.part_path, first.start, first.offset, sha256_hash)
+
+            errors = []
+            with ThreadPoolExecutor(max_workers=max(1, len(others)),
+                                    thread_name_prefix='firmware-segment') as executor:
+                futures = [executor.submit(self._download_segment, job, partial, segment, progress)
+                           for segment in others]
+                try:
+                    self._download_segment(job, partial, first, progress, sha256_hash)
+                except Exception as e:
+                    errors.append(e)
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+            if errors:
+                raise errors[0]
+
+            for segment in others:
+                _hash_file_range(partial.part_path, segment.start, segment.end, sha256_hash)
+
+            # Validate checksum
+            actual_checksum = sha256_hash.hexdigest()
+            if job.expected_checksum and actual_checksum != job.expected_checksum:
+                raise FirmwareValidationError(
+                    f"Checksum mismatch: expected {job.expected_checksum}, got {actual_checksum}"
+                )
+
+            # Move to final location
+            partial.finish(local_path)
+            self._record_digest(local_path, actual_checksum)
+
+        except FirmwareValidationError:
+            # Bad data cannot be resumed from
+            partial.discard()
+            raise
+
+    def _download_segment(self, job: DownloadJob, partial: 'PartialDownload', segment: 'Segment',
+                          progress: ByteProgress, sha256_hash=None):
+        """
+        Download the missing part of one range of a file into its .part file.
+
+        A dropped transfer is retried from the last byte received, up to
+        DOWNLOAD_RETRIES times.
+
+        Args:
+            job: File being downloaded
+            partial: The file's partial download
+            segment: Range to download
+            progress: Combined progress to report received bytes to
+            sha256_hash: Optional hash to feed the received bytes to
+        """
+        attempt = 0
+        with open(partial.part_path, 'r+b') as f:
+            while not segment.complete:
+                f.seek(segment.offset)
+                try:
+                    body = self.s3_wrapper.open_file(job.s3_key, start=segment.offset,
+                                                     end=segment.end, etag=partial.etag)
+                    try:
+                        for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                            if len(chunk) > segment.end - segment.offset:
+                                raise FirmwareValidationError(
+                                    f"Received more than the requested range of {job.name}"
+                                )
+                            f.write(chunk)
+                            # Only record bytes once they have left our buffers
+                            f.flush()
+                            if sha256_hash is not None:
+                                sha256_hash.update(chunk)
+                            partial.record(segment, len(chunk))
+                            progress.received(len(chunk))
+                    finally:
+                        body.close()
+                    if not segment.complete:
+                        raise IOError("Connection closed before the range was complete")
+                except (FirmwareValidationError, FirmwareDownloadCancelled):
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    if attempt > DOWNLOAD_RETRIES:
+                        raise
+                    self.logger.warning(
+                        f"Download of {job.name} dropped at byte {segment.offset} ({e}), retrying"
+                    )
+                    time.sleep(DOWNLOAD_RETRY_DELAY_S * attempt)
+            os.fsync(f.fileno())
+
+    def _cleanup(self, jobs: List[DownloadJob]):
+        """Remove every file completed by a download that failed"""
+        for job in jobs:
+            if job.local_path is None:
+                continue
+            try:
+                os.remove(job.local_path)
+                if self.digest_index is not None:
+                    self.digest_index.forget(job.local_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"Failed to remove {job.local_path}: {e}")
+
+@dataclass
+class Segment:
+    """A byte range of a file downloaded by one transfer"""
+    start: int
+    # Exclusive
+    end: int
+    # Bytes of the range already in the .part file
+    done: int = 0
+
+    @property
+    def offset(self) -> int:
+        return self.start + self.done
+
+    @property
+    def complete(self) -> bool:
+        return self.offset >= self.end
+
+class PartialDownload:
+    """
+    A download kept on disk between attempts.
+
+    The data goes to `<file>.part`, created at its full size so ranges can
+    be written in any order. `<file>.part.json` records the object's ETag
+    and how much of each range has been written, so a later attempt can
+    resume only if the object is still the same.
+    """
+
+    def __init__(self, local_path: Path):
+        self.part_path = local_path.with_name(local_path.name + '.part')
+        self.state_path = local_path.with_name(local_path.name + '.part.json')
+        self.etag: Optional[str] = None
+        self.size = 0
+        self.segments: List[Segment] = []
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_done(self) -> int:
+        return sum(segment.done for segment in self.segments)
+
+    def resume(self, etag: Optional[str], size: int) -> bool:
+        """
+        Load an earlier attempt at downloading this object.
+
+        Returns:
+            bool: True if the earlier attempt can be continued
+        """
+        if not etag:
+            return False
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if state['etag'] != etag or state['size'] != size:
+                return False
+            if os.path.getsize(self.part_path) != size:
+                return False
+            self.etag = etag
+            self.size = size
+            self.segments = [Segment(**segment) for segment in state['segments']]
+            return True
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    def start(self, etag: Optional[str], size: int, segment_count: int):
+        """Start a new download, dropping any earlier attempt"""
+        self.etag = etag
+        self.size = size
+        bounds = [size * i // segment_count for i in range(segment_count + 1)]
+        self.segments = [Segment(start, end) for (start, end) in zip(bounds, bounds[1:])]
+        with open(self.part_path, 'wb') as f:
+            f.truncate(size)
+        self.save()
+
+    def record(self, segment: Segment, byte_count: int):
+        """Record bytes written to a range"""
+        with self._lock:
+            segment.done += byte_count
+            self.save()
+
+    def save(self):
+        state = {'etag': self.etag, 'size': self.size, 'segments': [asdict(s) for s in self.segments]}
+        temp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def finish(self, local_path: Path):
+        """Move the completed download to its final path"""
+        os.replace(self.part_path, local_path)
+        self._remove(self.state_path)
+
+    def discard(self):
+        self._remove(self.part_path)
+        self._remove(self.state_path)
+
+    def _remove(self, path: Path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _write_file_atomically(local_path: Path, data: bytes):
+    """Write a file through a synced temporary file next to it"""
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = local_path.with_name(local_path.name + '.tmp')
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, local_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _hash_file_range(file_path: Path, start: int, end: int, hash_object):
+    """Feed bytes [start, end) of a file to a hash object"""
+    if end <= start:
+        return
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise FirmwareValidationError(f"{file_path} is shorter than expected")
+            hash_object.update(chunk)
+            remaining -= len(chunk)
@@ -8,6 +8,7 @@ from typing import Optional, Callable, Dict, Any, List
 from enum import Enum
 
 from .firmware_manager import FirmwareManager, ChromaticFirmwarePackage, FirmwareManifest
+from .firmware_prefetch import FirmwarePrefetcher, PREFETCH_CANCEL_TIMEOUT_S
 from .fpga_flasher import FPGAFlasher, FPGAFlashProgress
 from .mcu_flasher import MCUFlasher, MCUFlashProgress
 from .device_communication import DeviceCommunicationManager
@@ -66,6 +67,7 @@ class FirmwareFlasher:
         
         # Initialize component managers
         self.firmware_manager = FirmwareManager()
+        self.prefetcher = FirmwarePrefetcher(self.firmware_manager)
         self.fpga_flasher = FPGAFlasher(device_communicator)
         self.mcu_flasher = MCUFlasher(device_communicator)
         
@@ -74,6 +76,17 @@ class FirmwareFlasher:
         else:
             self.version_detector = None
     
+    def start_prefetch(self) -> bool:
+        """
+        Start downloading the latest firmware and the Cart Clinic bitstream
+        in the background, so an update can flash as soon as the device is
+        ready. Call this while the device is still being detected.
+        
+        Returns:
+            bool: True if a prefetch was started
+        """
+        return self.prefetcher.start()
+    
     def flash_firmware(self, version: str, 
                       operation: FlashOperation = FlashOperation.BOTH,
                       progress_callback: Optional[Callable[[FirmwareFlashProgress], None]] = None) -> bool:
@@ -170,6 +183,8 @@ class FirmwareFlasher:
                 ))
             
             verification_success = self._verify_firmware_flash(firmware_package, operation)
+            if verification_success and operation == FlashOperation.BOTH:
+                self.firmware_manager.mark_installed(firmware_package.version)
             
             # Complete
             elapsed_time = time.time() - start_time
@@ -212,6 +227,9 @@ class FirmwareFlasher:
             ChromaticFirmwarePackage: Downloaded firmware, or None if failed
         """
         try:
+            # Take over from the prefetch, resuming what it downloaded
+            self.prefetcher.cancel(timeout=PREFETCH_CANCEL_TIMEOUT_S)
+            
             # Get firmware manifest
             manifest = self.firmware_manager.get_firmware_manifest()
             if not manifest:
@@ -382,6 +400,10 @@ class FirmwareFlasher:
         Returns:
             VersionComparison: Update comparison, or None if failed
         """
+        # Fetch the latest firmware while the device is queried, so an
+        # update can start flashing right away
+        self.start_prefetch()
+        
         try:
             if not self.version_detector:
                 self.logger.warning("No version detector available for update check")
@@ -668,7 +690,9 @@ class FirmwareFlasher:
                 details="Checking firmware installation"
             )
             
-            self._verify_firmware_with_progress(reporter, 95, 100)
+            verification_success = self._verify_firmware_with_progress(reporter, 95, 100)
+            if verification_success and operation == FlashOperation.BOTH:
+                self.firmware_manager.mark_installed(firmware_package.version)
             
             # Complete successfully
             reporter.complete(success=True, message="Firmware flashed successfully!")
@@ -711,10 +735,21 @@ class FirmwareFlasher:
                     bytes_total=total_bytes
                 )
         
+        # Take over from the prefetch, resuming what it downloaded
+        self.prefetcher.cancel(timeout=PREFETCH_CANCEL_TIMEOUT_S)
+        
+        manifest = self.firmware_manager.get_firmware_manifest()
+        if not manifest:
+            raise FirmwareFlashError("Could not load firmware manifest")
+        
+        firmware_info = self.firmware_manager.get_firmware_info(version, manifest)
+        if not firmware_info:
+            raise FirmwareFlashError(f"Firmware version '{version}' not found")
+        
         # Download firmware with progress callback
         firmware_package = self.firmware_manager.download_firmware(
-            version, 
-            progress_callback=download_progress_callback
+            firmware_info,
+            byte_progress_callback=download_progress_callback
         )
         
         reporter.update_progress(
@@ -812,7 +847,7 @@ class FirmwareFlasher:
         reporter: ProgressReporter, 
         start_progress: int, 
         end_progress: int
-    ):
+    ) -> bool:
         """Verify firmware installation with progress reporting"""
         
         reporter.update_progress(
@@ -831,6 +866,7 @@ class FirmwareFlasher:
         )
         
         # Verify firmware version if version detector is available
+        verified = True
         if self.version_detector:
             try:
                 new_version = self.version_detector.get_current_version()
@@ -842,11 +878,15 @@ class FirmwareFlasher:
                     )
                 else:
                     self.logger.warning("Could not verify firmware version after flash")
+                    verified = False
             except Exception as e:
                 self.logger.warning(f"Firmware verification failed: {e}")
+                verified = False
         
         reporter.update_progress(
             current=end_progress,
             message="Firmware verification completed",
             details="Firmware installation verified"
-        )
\ No newline at end of file
+        )
+        
+        return verified
\ No newline at end of file
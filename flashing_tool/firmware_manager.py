@@ -4,21 +4,38 @@
 import os
 import json
 import yaml
-import hashlib
-import tempfile
 import logging
-from dataclasses import dataclass, asdict
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict, field
 from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 import requests
 from packaging import version
 
 from .s3_wrapper import S3Wrapper, S3WrapperError
+from .firmware_download import (
+    FirmwareDownloader, DownloadJob, DeltaSource, FirmwareDownloadError, FirmwareDownloadCancelled,
+    FirmwareValidationError
+)
+from .digest_index import DigestIndex, DIGEST_AUDIT_INTERVAL_S
+from .manifest_cache import ManifestCache, MANIFEST_TTL_S
+from .cache_index import FirmwareCacheIndex, FIRMWARE_CACHE_BUDGET_BYTES
+from .blob_store import BlobStore
 from .constants import APP_DATA_DIR
 from .version_detector import FirmwareVersion
 
 logger = logging.getLogger('mrupdater.firmware_manager')
 
+@dataclass
+class FirmwareDelta:
+    """Binary deltas from an earlier version's firmware files"""
+    from_version: str
+    mcu_delta_key: Optional[str] = None
+    fpga_delta_key: Optional[str] = None
+    file_size_mcu_delta: Optional[int] = None
+    file_size_fpga_delta: Optional[int] = None
+
 @dataclass
 class S3FirmwareInfo:
     """S3 firmware information from manifest"""
@@ -35,6 +52,13 @@ class S3FirmwareInfo:
     is_preview: bool = False
     is_rollback: bool = False
     minimum_bootloader_version: Optional[str] = None
+    deltas: List[FirmwareDelta] = field(default_factory=list)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'S3FirmwareInfo':
+        """Create from dictionary"""
+        deltas = [FirmwareDelta(**delta) for delta in data.get('deltas', [])]
+        return cls(**{**data, 'deltas': deltas})
 
 @dataclass
 class ChromaticFirmwarePackage:
@@ -62,6 +86,13 @@ class ChromaticFirmwarePackage:
         """Create from dictionary"""
         return cls(**data)
 
+@dataclass
+class CartClinicBitstreamInfo:
+    """S3 information of the FPGA bitstream Cart Clinic runs on"""
+    fpga_bitstream_key: str
+    checksum_fpga: Optional[str] = None
+    file_size_fpga: Optional[int] = None
+
 @dataclass
 class FirmwareManifest:
     """Firmware manifest containing all available versions"""
@@ -71,18 +102,24 @@ class FirmwareManifest:
     firmware_list: List[S3FirmwareInfo] = None
     manifest_version: str = "1.0"
     last_updated: Optional[str] = None
+    cart_clinic: Optional[CartClinicBitstreamInfo] = None
     
     def __post_init__(self):
         if self.firmware_list is None:
             self.firmware_list = []
-
-class FirmwareValidationError(Exception):
-    """Raised when firmware validation fails"""
-    pass
-
-class FirmwareDownloadError(Exception):
-    """Raised when firmware download fails"""
-    pass
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return asdict(self)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FirmwareManifest':
+        """Create from dictionary"""
+        firmware_list = [S3FirmwareInfo.from_dict(fw) for fw in data.get('firmware_list') or []]
+        cart_clinic = data.get('cart_clinic')
+        if cart_clinic:
+            cart_clinic = CartClinicBitstreamInfo(**cart_clinic)
+        return cls(**{**data, 'firmware_list': firmware_list, 'cart_clinic': cart_clinic})
 
 class FirmwareManager:
     """
@@ -92,7 +129,10 @@ class FirmwareManager:
     and local caching with version management.
     """
     
-    def __init__(self, s3_wrapper: Optional[S3Wrapper] = None):
+    def __init__(self, s3_wrapper: Optional[S3Wrapper] = None,
+                 manifest_ttl_s: float = MANIFEST_TTL_S,
+                 digest_audit_interval_s: float = DIGEST_AUDIT_INTERVAL_S,
+                 cache_budget_bytes: int = FIRMWARE_CACHE_BUDGET_BYTES):
         self.s3_wrapper = s3_wrapper or S3Wrapper(bucket='updates.modretro.com')
         self.logger = logging.getLogger('mrupdater.firmware_manager')
         
@@ -100,10 +140,26 @@ class FirmwareManager:
         self.cache_dir = Path(APP_DATA_DIR) / 'firmware_cache'
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         
+        # Digests of verified files, so unchanged files are not re-hashed
+        self.digest_index = DigestIndex(self.cache_dir / 'digests.json',
+                                        audit_interval_s=digest_audit_interval_s)
+        self.downloader = FirmwareDownloader(self.s3_wrapper, digest_index=self.digest_index)
+        
         # Cache file paths
-        self.manifest_cache_path = self.cache_dir / 'manifest.yaml'
+        self.manifest_cache_path = self.cache_dir / 'manifest.json'
+        self.manifest_cache = ManifestCache(self.manifest_cache_path, ttl_s=manifest_ttl_s)
         self.firmware_cache_dir = self.cache_dir / 'packages'
         self.firmware_cache_dir.mkdir(exist_ok=True)
+        self.cart_clinic_cache_dir = self.cache_dir / 'cart_clinic'
+        
+        # MCU binaries and FPGA bitstreams, stored once under their SHA-256
+        self.blob_store = BlobStore(self.cache_dir / 'blobs', digest_index=self.digest_index)
+        
+        # Size and last use of each cached version, for the cache budget
+        self.cache_index = FirmwareCacheIndex(self.cache_dir / 'cache_index.json',
+                                              budget_bytes=cache_budget_bytes)
+        if not self.cache_index.loaded:
+            self._rebuild_cache_index()
         
         self.logger.info(f"Firmware cache directory: {self.cache_dir}")
     
@@ -111,42 +167,44 @@ class FirmwareManager:
         """
         Get firmware manifest from S3 or local cache.
         
+        The parsed manifest is cached with its ETag. Within the cache TTL it
+        is used as-is; after that, or when forced, S3 is asked whether it
+        changed and the manifest is only downloaded and parsed again if it
+        did. If S3 cannot be reached, the cached manifest is used.
+        
         Args:
-            force_refresh: Force download from S3 even if cached version exists
+            force_refresh: Check with S3 even if the cached manifest is fresh
             
         Returns:
             FirmwareManifest: Parsed manifest, or None if failed
         """
         try:
-            manifest_data = None
-            
-            # Try to use cached manifest if not forcing refresh
-            if not force_refresh and self.manifest_cache_path.exists():
-                try:
-                    with open(self.manifest_cache_path, 'r') as f:
-                        manifest_data = yaml.safe_load(f)
-                    self.logger.debug("Using cached firmware manifest")
-                except Exception as e:
-                    self.logger.warning(f"Failed to load cached manifest: {e}")
-            
-            # Download fresh manifest if needed
-            if manifest_data is None:
-                self.logger.info("Downloading firmware manifest from S3")
-                manifest_content = self.s3_wrapper.read_manifest()
-                manifest_data = yaml.safe_load(manifest_content)
-                
-                # Cache the manifest
-                try:
-                    with open(self.manifest_cache_path, 'w') as f:
-                        yaml.dump(manifest_data, f)
-                    self.logger.debug("Cached firmware manifest")
-                except Exception as e:
-                    self.logger.warning(f"Failed to cache manifest: {e}")
+            cached = self.manifest_cache.load()
+            
+            # Use cached manifest if it is recent enough
+            if cached and not force_refresh and self.manifest_cache.is_fresh(cached):
+                self.logger.debug("Using cached firmware manifest")
+                return FirmwareManifest.from_dict(cached.data)
+            
+            try:
+                self.logger.info("Checking firmware manifest on S3")
+                manifest_content, etag = self.s3_wrapper.read_manifest(etag=cached.etag if cached else None)
+            except S3WrapperError as e:
+                if not cached:
+                    raise
+                self.logger.warning(f"Could not check firmware manifest, using cached copy: {e}")
+                return FirmwareManifest.from_dict(cached.data)
+            
+            if manifest_content is None:
+                self.logger.debug("Firmware manifest unchanged")
+                self.manifest_cache.refresh(cached)
+                return FirmwareManifest.from_dict(cached.data)
             
             # Parse manifest data
-            manifest = self._parse_manifest(manifest_data)
+            manifest = self._parse_manifest(yaml.safe_load(manifest_content))
             
             if manifest:
+                self.manifest_cache.store(manifest.to_dict(), etag)
                 self.logger.info(f"Loaded firmware manifest: {len(manifest.firmware_list)} versions available")
                 self.logger.info(f"Latest version: {manifest.latest_version}")
                 if manifest.preview_version:
@@ -198,20 +256,32 @@ class FirmwareManager:
                         release_date=fw_data.get('release_date'),
                         is_preview=fw_data.get('is_preview', False),
                         is_rollback=fw_data.get('is_rollback', False),
-                        minimum_bootloader_version=fw_data.get('minimum_bootloader_version')
+                        minimum_bootloader_version=fw_data.get('minimum_bootloader_version'),
+                        deltas=self._parse_deltas(fw_data.get('deltas', []))
                     )
                     firmware_list.append(firmware_info)
                 except KeyError as e:
                     self.logger.warning(f"Skipping invalid firmware entry: missing {e}")
                     continue
             
+            # Parse the optional Cart Clinic bitstream
+            cart_clinic = None
+            cart_clinic_data = manifest_data.get('cart_clinic')
+            if cart_clinic_data and cart_clinic_data.get('fpga_bitstream'):
+                cart_clinic = CartClinicBitstreamInfo(
+                    fpga_bitstream_key=cart_clinic_data['fpga_bitstream'],
+                    checksum_fpga=cart_clinic_data.get('checksum_fpga'),
+                    file_size_fpga=cart_clinic_data.get('file_size_fpga')
+                )
+            
             manifest = FirmwareManifest(
                 latest_version=latest_version,
                 preview_version=preview_version,
                 rollback_version=rollback_version,
                 firmware_list=firmware_list,
                 manifest_version=manifest_version,
-                last_updated=last_updated
+                last_updated=last_updated,
+                cart_clinic=cart_clinic
             )
             
             return manifest
@@ -220,6 +290,30 @@ class FirmwareManager:
             self.logger.error(f"Error parsing firmware manifest: {e}")
             return None
     
+    def _parse_deltas(self, deltas_data: List[Dict[str, Any]]) -> List[FirmwareDelta]:
+        """
+        Parse the optional deltas of a manifest firmware entry.
+        
+        Args:
+            deltas_data: Raw delta entries from YAML
+            
+        Returns:
+            List[FirmwareDelta]: Valid delta entries
+        """
+        deltas = []
+        for delta_data in deltas_data or []:
+            try:
+                deltas.append(FirmwareDelta(
+                    from_version=str(delta_data['from_version']),
+                    mcu_delta_key=delta_data.get('mcu_delta'),
+                    fpga_delta_key=delta_data.get('fpga_delta'),
+                    file_size_mcu_delta=delta_data.get('file_size_mcu_delta'),
+                    file_size_fpga_delta=delta_data.get('file_size_fpga_delta')
+                ))
+            except (KeyError, TypeError) as e:
+                self.logger.warning(f"Skipping invalid firmware delta: {e}")
+        return deltas
+    
     def get_firmware_info(self, version_str: str, 
                          manifest: Optional[FirmwareManifest] = None) -> Optional[S3FirmwareInfo]:
         """
@@ -254,13 +348,24 @@ class FirmwareManager:
         return None
     
     def download_firmware(self, firmware_info: S3FirmwareInfo, 
-                         progress_callback: Optional[callable] = None) -> Optional[ChromaticFirmwarePackage]:
+                         progress_callback: Optional[callable] = None,
+                         byte_progress_callback: Optional[callable] = None,
+                         cancel_event: Optional[threading.Event] = None,
+                         bandwidth_limit: Optional[int] = None) -> Optional[ChromaticFirmwarePackage]:
         """
         Download firmware package from S3.
         
+        The MCU binary, FPGA bitstream, changelog and release notes are
+        downloaded concurrently.
+        
         Args:
             firmware_info: Firmware information from manifest
             progress_callback: Optional callback for progress updates
+            byte_progress_callback: Optional callback receiving the bytes
+                downloaded so far and the total, across all files
+            cancel_event: Optional event that stops the download when set;
+                a later download resumes where it stopped
+            bandwidth_limit: Optional limit in bytes per second
             
         Returns:
             ChromaticFirmwarePackage: Downloaded firmware package, or None if failed
@@ -272,62 +377,58 @@ class FirmwareManager:
             cached_package = self._get_cached_firmware(firmware_info.version)
             if cached_package and self._validate_cached_firmware(cached_package, firmware_info):
                 self.logger.info(f"Using cached firmware version {firmware_info.version}")
+                self.cache_index.touch(firmware_info.version)
                 return cached_package
             
             # Create version-specific cache directory
             version_cache_dir = self.firmware_cache_dir / firmware_info.version
             version_cache_dir.mkdir(exist_ok=True)
             
-            # Download MCU binary
-            if progress_callback:
-                progress_callback("Downloading MCU firmware...")
-            
-            mcu_path = version_cache_dir / 'mcu_firmware.bin'
-            self._download_file_with_validation(
-                firmware_info.mcu_binary_key,
-                mcu_path,
-                firmware_info.checksum_mcu,
-                firmware_info.file_size_mcu
-            )
-            
-            # Download FPGA bitstream
-            if progress_callback:
-                progress_callback("Downloading FPGA bitstream...")
-            
-            fpga_path = version_cache_dir / 'fpga_bitstream.fs'
-            self._download_file_with_validation(
-                firmware_info.fpga_bitstream_key,
-                fpga_path,
-                firmware_info.checksum_fpga,
-                firmware_info.file_size_fpga
-            )
+            # Files with a checksum go in the blob store, and are not
+            # downloaded again if an earlier version already stored them
+            mcu_path = self._get_component_path(version_cache_dir, 'mcu_firmware.bin',
+                                                firmware_info.checksum_mcu)
+            fpga_path = self._get_component_path(version_cache_dir, 'fpga_bitstream.fs',
+                                                 firmware_info.checksum_fpga)
+            mcu_delta, fpga_delta = self._find_deltas(firmware_info)
+            jobs = []
+            if self._has_blob(firmware_info.checksum_mcu, firmware_info.file_size_mcu):
+                self.logger.info("MCU firmware unchanged from a cached version, skipping download")
+            else:
+                jobs.append(DownloadJob('MCU firmware', firmware_info.mcu_binary_key, mcu_path,
+                                        firmware_info.checksum_mcu, firmware_info.file_size_mcu,
+                                        delta=mcu_delta))
+            if self._has_blob(firmware_info.checksum_fpga, firmware_info.file_size_fpga):
+                self.logger.info("FPGA bitstream unchanged from a cached version, skipping download")
+            else:
+                jobs.append(DownloadJob('FPGA bitstream', firmware_info.fpga_bitstream_key, fpga_path,
+                                        firmware_info.checksum_fpga, firmware_info.file_size_fpga,
+                                        delta=fpga_delta))
             
             # Download optional files
-            changelog = None
             if firmware_info.changelog_key:
-                try:
-                    if progress_callback:
-                        progress_callback("Downloading changelog...")
-                    changelog = self.s3_wrapper.read_file(firmware_info.changelog_key)
-                except Exception as e:
-                    self.logger.warning(f"Failed to download changelog: {e}")
-            
-            release_notes = None
+                jobs.append(DownloadJob('changelog', firmware_info.changelog_key, required=False))
             if firmware_info.release_notes_key:
-                try:
-                    if progress_callback:
-                        progress_callback("Downloading release notes...")
-                    release_notes = self.s3_wrapper.read_file(firmware_info.release_notes_key)
-                except Exception as e:
-                    self.logger.warning(f"Failed to download release notes: {e}")
+                jobs.append(DownloadJob('release notes', firmware_info.release_notes_key, required=False))
+            
+            if progress_callback:
+                progress_callback("Downloading firmware package...")
+            
+            results = self.downloader.download(
+                jobs,
+                progress_callback=progress_callback,
+                byte_progress_callback=byte_progress_callback,
+                cancel_event=cancel_event,
+                bandwidth_limit=bandwidth_limit
+            )
             
             # Create firmware package
             firmware_package = ChromaticFirmwarePackage(
                 version=firmware_info.version,
                 mcu_binary_path=str(mcu_path),
                 fpga_bitstream_path=str(fpga_path),
-                changelog=changelog,
-                release_notes=release_notes,
+                changelog=results.get('changelog'),
+                release_notes=results.get('release notes'),
                 checksum_mcu=firmware_info.checksum_mcu,
                 checksum_fpga=firmware_info.checksum_fpga,
                 file_size_mcu=firmware_info.file_size_mcu,
@@ -340,6 +441,9 @@ class FirmwareManager:
             
             # Cache package metadata
             self._cache_firmware_metadata(firmware_package)
+            self.cache_index.add(firmware_info.version, 0)
+            self._update_cache_sizes()
+            self.enforce_cache_budget(keep=[firmware_info.version])
             
             if progress_callback:
                 progress_callback("Download complete")
@@ -347,66 +451,167 @@ class FirmwareManager:
             self.logger.info(f"Successfully downloaded firmware version {firmware_info.version}")
             return firmware_package
             
+        except FirmwareDownloadCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"Error downloading firmware: {e}")
             raise FirmwareDownloadError(f"Failed to download firmware: {e}")
     
-    def _download_file_with_validation(self, s3_key: str, local_path: Path, 
-                                     expected_checksum: Optional[str] = None,
-                                     expected_size: Optional[int] = None):
+    def download_cart_clinic_bitstream(self, bitstream_info: CartClinicBitstreamInfo,
+                                       progress_callback: Optional[callable] = None,
+                                       cancel_event: Optional[threading.Event] = None,
+                                       bandwidth_limit: Optional[int] = None) -> str:
         """
-        Download file from S3 with validation.
+        Download the FPGA bitstream Cart Clinic runs on, unless the cached
+        copy still matches the manifest.
         
         Args:
-            s3_key: S3 object key
-            local_path: Local file path
-            expected_checksum: Expected SHA256 checksum
-            expected_size: Expected file size in bytes
+            bitstream_info: Cart Clinic bitstream information from manifest
+            progress_callback: Optional callback for progress updates
+            cancel_event: Optional event that stops the download when set
+            bandwidth_limit: Optional limit in bytes per second
+            
+        Returns:
+            str: Path to the cached bitstream
         """
+        bitstream_path = self.cart_clinic_cache_dir / 'io0_rev.bin'
+        if self._is_cached_file_valid(bitstream_path, bitstream_info.checksum_fpga,
+                                      bitstream_info.file_size_fpga):
+            self.logger.info("Using cached Cart Clinic bitstream")
+            return str(bitstream_path)
+        
         try:
-            # Download file
-            downloaded_path = self.s3_wrapper.download_file(s3_key)
-            
-            # Validate file size
-            if expected_size is not None:
-                actual_size = os.path.getsize(downloaded_path)
-                if actual_size != expected_size:
-                    raise FirmwareValidationError(
-                        f"File size mismatch: expected {expected_size}, got {actual_size}"
-                    )
-            
-            # Validate checksum
-            if expected_checksum:
-                actual_checksum = self._calculate_file_checksum(downloaded_path)
-                if actual_checksum != expected_checksum:
-                    raise FirmwareValidationError(
-                        f"Checksum mismatch: expected {expected_checksum}, got {actual_checksum}"
-                    )
+            self.downloader.download(
+                [DownloadJob('Cart Clinic bitstream', bitstream_info.fpga_bitstream_key, bitstream_path,
+                             bitstream_info.checksum_fpga, bitstream_info.file_size_fpga)],
+                progress_callback=progress_callback,
+                cancel_event=cancel_event,
+                bandwidth_limit=bandwidth_limit
+            )
+        except FirmwareDownloadCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error downloading Cart Clinic bitstream: {e}")
+            raise FirmwareDownloadError(f"Failed to download Cart Clinic bitstream: {e}")
+        
+        self.logger.info("Successfully downloaded Cart Clinic bitstream")
+        return str(bitstream_path)
+    
+    def get_cart_clinic_bitstream_path(self, bundled_path: str) -> str:
+        """
+        Get the FPGA bitstream Cart Clinic should run on.
+        
+        The cached bitstream is used if it matches the cached manifest,
+        otherwise the one bundled with the app.
+        
+        Args:
+            bundled_path: Path to the bitstream bundled with the app
             
-            # Move to final location
-            os.rename(downloaded_path, local_path)
+        Returns:
+            str: Path to the bitstream
+        """
+        cached_manifest = self.manifest_cache.load()
+        bitstream_info = cached_manifest.data.get('cart_clinic') if cached_manifest else None
+        if bitstream_info:
+            bitstream_path = self.cart_clinic_cache_dir / 'io0_rev.bin'
+            if self._is_cached_file_valid(bitstream_path, bitstream_info.get('checksum_fpga'),
+                                          bitstream_info.get('file_size_fpga')):
+                return str(bitstream_path)
+        return bundled_path
+    
+    def _is_cached_file_valid(self, file_path: Path, checksum: Optional[str],
+                              file_size: Optional[int]) -> bool:
+        """Check a cached file against the size and checksum from the manifest"""
+        try:
+            if not file_path.exists():
+                return False
+            if file_size is not None and file_path.stat().st_size != file_size:
+                return False
+            return not checksum or self._calculate_file_checksum(str(file_path)) == checksum
+        except OSError:
+            return False
+    
+    def _get_component_path(self, version_cache_dir: Path, file_name: str,
+                            checksum: Optional[str]) -> Path:
+        """Get where a package file is stored: its blob if it has a checksum"""
+        if checksum:
+            return self.blob_store.prepare(checksum)
+        return version_cache_dir / file_name
+    
+    def _has_blob(self, checksum: Optional[str], file_size: Optional[int]) -> bool:
+        """Check whether a package file is already in the blob store"""
+        return bool(checksum) and self.blob_store.has(checksum, file_size or None)
+    
+    def _find_deltas(self, firmware_info: S3FirmwareInfo) -> Tuple[Optional[DeltaSource], Optional[DeltaSource]]:
+        """
+        Find deltas to the MCU binary and FPGA bitstream from cached versions.
+        
+        Deltas are only used for files with a checksum to verify the
+        result against; the downloader falls back to the full file when a
+        delta fails.
+        
+        Args:
+            firmware_info: Firmware information from manifest
             
-        except Exception as e:
-            # Clean up on failure
-            if os.path.exists(downloaded_path):
-                os.remove(downloaded_path)
-            raise
+        Returns:
+            Tuple of the MCU and FPGA deltas, each None if there is none
+        """
+        mcu_delta = None
+        fpga_delta = None
+        
+        for delta in firmware_info.deltas:
+            base_package = self._get_cached_firmware(delta.from_version)
+            if not base_package:
+                continue
+            
+            if mcu_delta is None and delta.mcu_delta_key and firmware_info.checksum_mcu:
+                mcu_delta = DeltaSource(delta.mcu_delta_key, Path(base_package.mcu_binary_path),
+                                        delta.file_size_mcu_delta)
+            if fpga_delta is None and delta.fpga_delta_key and firmware_info.checksum_fpga:
+                fpga_delta = DeltaSource(delta.fpga_delta_key, Path(base_package.fpga_bitstream_path),
+                                         delta.file_size_fpga_delta)
+        
+        if mcu_delta or fpga_delta:
+            self.logger.info(f"Updating to firmware version {firmware_info.version} from cached deltas")
+        
+        return mcu_delta, fpga_delta
     
     def _calculate_file_checksum(self, file_path: str) -> str:
         """
         Calculate SHA256 checksum of file.
         
+        The file is only hashed if its size, mtime or inode changed since it
+        was last verified, or the digest index's audit interval has passed.
+        
         Args:
             file_path: Path to file
             
         Returns:
             str: SHA256 checksum in hexadecimal
         """
-        sha256_hash = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
+        return self.digest_index.sha256(file_path)
+    
+    def _calculate_package_checksums(self, package: ChromaticFirmwarePackage,
+                                     mcu: bool = True, fpga: bool = True) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Calculate SHA256 checksums of a package's files concurrently.
+        
+        Args:
+            package: Firmware package
+            mcu: Whether to calculate the MCU binary checksum
+            fpga: Whether to calculate the FPGA bitstream checksum
+            
+        Returns:
+            Tuple of the MCU and FPGA checksums, each None if not requested
+        """
+        paths = []
+        if mcu:
+            paths.append(package.mcu_binary_path)
+        if fpga:
+            paths.append(package.fpga_bitstream_path)
+        
+        checksums = iter(self.digest_index.sha256_many(paths))
+        return (next(checksums) if mcu else None, next(checksums) if fpga else None)
     
     def _get_cached_firmware(self, version_str: str) -> Optional[ChromaticFirmwarePackage]:
         """
@@ -459,17 +664,19 @@ class FirmwareManager:
             if package.version != firmware_info.version:
                 return False
             
+            mcu_checksum, fpga_checksum = self._calculate_package_checksums(
+                package, bool(firmware_info.checksum_mcu), bool(firmware_info.checksum_fpga)
+            )
+            
             # Validate MCU binary checksum if available
             if firmware_info.checksum_mcu:
-                actual_checksum = self._calculate_file_checksum(package.mcu_binary_path)
-                if actual_checksum != firmware_info.checksum_mcu:
+                if mcu_checksum != firmware_info.checksum_mcu:
                     self.logger.warning(f"MCU binary checksum mismatch for cached version {package.version}")
                     return False
             
             # Validate FPGA bitstream checksum if available
             if firmware_info.checksum_fpga:
-                actual_checksum = self._calculate_file_checksum(package.fpga_bitstream_path)
-                if actual_checksum != firmware_info.checksum_fpga:
+                if fpga_checksum != firmware_info.checksum_fpga:
                     self.logger.warning(f"FPGA bitstream checksum mismatch for cached version {package.version}")
                     return False
             
@@ -539,16 +746,22 @@ class FirmwareManager:
                     import shutil
                     shutil.rmtree(version_cache_dir)
                     self.logger.info(f"Cleared cache for firmware version {version_str}")
+                self.cache_index.remove(version_str)
+                self._collect_blobs()
             else:
                 # Clear all cached firmware
                 import shutil
                 if self.firmware_cache_dir.exists():
                     shutil.rmtree(self.firmware_cache_dir)
                     self.firmware_cache_dir.mkdir(exist_ok=True)
+                if self.blob_store.root.exists():
+                    shutil.rmtree(self.blob_store.root)
+                if self.cart_clinic_cache_dir.exists():
+                    shutil.rmtree(self.cart_clinic_cache_dir)
+                self.cache_index.clear()
                 
                 # Clear manifest cache
-                if self.manifest_cache_path.exists():
-                    self.manifest_cache_path.unlink()
+                self.manifest_cache.clear()
                 
                 self.logger.info("Cleared all firmware cache")
                 
@@ -557,23 +770,125 @@ class FirmwareManager:
     
     def get_cache_size(self) -> int:
         """
-        Get total size of firmware cache in bytes.
+        Get total size of the cached firmware packages in bytes.
+        
+        The size comes from the cache index, so the cache is not walked.
         
         Returns:
             int: Cache size in bytes
         """
-        total_size = 0
+        return self.cache_index.total_size
+    
+    def mark_installed(self, version_str: str):
+        """
+        Record the firmware version flashed to the device, which is never
+        evicted from the cache.
+        
+        Args:
+            version_str: Firmware version
+        """
+        self.cache_index.set_installed(version_str)
+        self.cache_index.touch(version_str)
+    
+    def enforce_cache_budget(self, keep: Optional[List[str]] = None) -> List[str]:
+        """
+        Evict the least recently used versions until the cache is within
+        its budget.
+        
+        The installed version and the latest and rollback versions of the
+        cached manifest are always kept.
+        
+        Args:
+            keep: Other versions to keep
+            
+        Returns:
+            List[str]: Evicted versions
+        """
+        protected = list(keep or [])
+        cached_manifest = self.manifest_cache.load()
+        if cached_manifest:
+            protected.append(cached_manifest.data.get('latest_version'))
+            protected.append(cached_manifest.data.get('rollback_version'))
+        
+        # Evicting a version that shares blobs frees less than its share,
+        # so keep going until the cache fits or nothing more can go
+        evicted = []
+        while True:
+            candidates = self.cache_index.select_evictions(protected)
+            if not candidates:
+                break
+            for version_str in candidates:
+                version_cache_dir = self.firmware_cache_dir / version_str
+                for file_path in self._get_package_files(version_cache_dir):
+                    self.digest_index.forget(file_path)
+                self.clear_cache(version_str)
+            evicted.extend(candidates)
+            protected.extend(candidates)
         
+        if evicted:
+            self.logger.info(f"Evicted firmware versions {', '.join(evicted)}; "
+                             f"cache size is now {self.cache_index.total_size} bytes")
+        return evicted
+    
+    def _get_package_files(self, version_cache_dir: Path) -> List[str]:
+        """List the files of a cached version"""
         try:
-            for root, dirs, files in os.walk(self.cache_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if os.path.exists(file_path):
-                        total_size += os.path.getsize(file_path)
-        except Exception as e:
-            self.logger.error(f"Error calculating cache size: {e}")
+            with os.scandir(version_cache_dir) as entries:
+                return [entry.path for entry in entries if entry.is_file()]
+        except FileNotFoundError:
+            return []
+    
+    def _get_package_blobs(self, version_str: str) -> List[str]:
+        """List the blobs the package metadata of a cached version points at"""
+        package = self._get_cached_firmware(version_str)
+        if not package:
+            return []
+        version_cache_dir = os.path.abspath(self.firmware_cache_dir / version_str)
+        return [os.path.abspath(file_path)
+                for file_path in (package.mcu_binary_path, package.fpga_bitstream_path)
+                if os.path.dirname(os.path.abspath(file_path)) != version_cache_dir]
+    
+    def _calculate_version_sizes(self) -> Dict[str, int]:
+        """
+        Calculate the bytes each cached version takes up on disk.
+        
+        A blob shared by several versions is split evenly between them, so
+        the sizes add up to the size of the cache.
+        
+        Returns:
+            Dict[str, int]: Size of each cached version
+        """
+        blobs = {version_str: set(self._get_package_blobs(version_str))
+                 for version_str in self.list_cached_versions()}
+        users = Counter(blob_path for version_blobs in blobs.values() for blob_path in version_blobs)
         
-        return total_size
+        sizes = {}
+        for version_str, version_blobs in blobs.items():
+            version_cache_dir = self.firmware_cache_dir / version_str
+            size = sum(os.path.getsize(file_path) for file_path in self._get_package_files(version_cache_dir))
+            size += sum(self.blob_store.size(blob_path) // users[blob_path] for blob_path in version_blobs)
+            sizes[version_str] = size
+        return sizes
+    
+    def _update_cache_sizes(self):
+        """Update the cache index after versions sharing blobs changed"""
+        self.cache_index.update_sizes(self._calculate_version_sizes())
+    
+    def _collect_blobs(self):
+        """Remove blobs no cached version points at any more"""
+        referenced = [blob_path for version_str in self.list_cached_versions()
+                      for blob_path in self._get_package_blobs(version_str)]
+        removed = self.blob_store.collect_garbage(referenced)
+        if removed:
+            self.logger.info(f"Removed {len(removed)} unused firmware blobs")
+        self._update_cache_sizes()
+    
+    def _rebuild_cache_index(self):
+        """Rebuild the cache index from the cached versions on disk"""
+        sizes = self._calculate_version_sizes()
+        self.cache_index.rebuild(sizes)
+        self.logger.info(f"Rebuilt firmware cache index: {len(sizes)} versions, "
+                         f"{self.cache_index.total_size} bytes")
     
     def validate_firmware_package(self, package: ChromaticFirmwarePackage) -> bool:
         """
@@ -596,15 +911,17 @@ class FirmwareManager:
                 return False
             
             # Validate checksums if available
+            mcu_checksum, fpga_checksum = self._calculate_package_checksums(
+                package, bool(package.checksum_mcu), bool(package.checksum_fpga)
+            )
+            
             if package.checksum_mcu:
-                actual_checksum = self._calculate_file_checksum(package.mcu_binary_path)
-                if actual_checksum != package.checksum_mcu:
+                if mcu_checksum != package.checksum_mcu:
                     self.logger.error(f"MCU binary checksum validation failed")
                     return False
             
             if package.checksum_fpga:
-                actual_checksum = self._calculate_file_checksum(package.fpga_bitstream_path)
-                if actual_checksum != package.checksum_fpga:
+                if fpga_checksum != package.checksum_fpga:
                     self.logger.error(f"FPGA bitstream checksum validation failed")
                     return False
             
@@ -0,0 +1,104 @@
+# Background prefetch of the latest firmware while the device is detected
+# Fills the firmware cache so an update can start flashing right away
+
+import logging
+import threading
+from typing import Optional
+
+from .firmware_download import FirmwareDownloadCancelled
+
+logger = logging.getLogger('mrupdater.firmware_prefetch')
+
+# Bandwidth the prefetch may use, in bytes per second, so it does not slow
+# down everything else on the connection
+PREFETCH_BANDWIDTH_LIMIT = 512 * 1024
+
+# How long a download waits for the prefetch it replaces to stop, in seconds
+PREFETCH_CANCEL_TIMEOUT_S = 5.0
+
+class FirmwarePrefetcher:
+    """
+    Prefetches the latest firmware package and the Cart Clinic bitstream
+    into the firmware cache on a background thread.
+
+    The prefetch is bandwidth-limited and can be cancelled at any time. A
+    cancelled prefetch keeps what it downloaded, including partial files,
+    so the download that replaces it resumes from there.
+    """
+
+    def __init__(self, firmware_manager, bandwidth_limit: Optional[int] = PREFETCH_BANDWIDTH_LIMIT):
+        self.firmware_manager = firmware_manager
+        self.bandwidth_limit = bandwidth_limit
+        self.logger = logging.getLogger('mrupdater.firmware_prefetch')
+        self._cancel_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        """Whether a prefetch is in progress"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Start prefetching in the background.
+
+        Returns:
+            bool: True if a prefetch was started, False if one is running
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._cancel_event.clear()
+            self._thread = threading.Thread(target=self._run, name='firmware_prefetch', daemon=True)
+            self._thread.start()
+            return True
+
+    def cancel(self, timeout: Optional[float] = None):
+        """
+        Cancel the prefetch and wait for it to stop.
+
+        Args:
+            timeout: Seconds to wait at most, or None to wait until it stops
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._cancel_event.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            self.logger.warning("Firmware prefetch did not stop in time")
+
+    def _run(self):
+        """Fetch the manifest and download what the cache is missing"""
+        try:
+            manifest = self.firmware_manager.get_firmware_manifest()
+            if not manifest or self._cancel_event.is_set():
+                return
+
+            firmware_info = self.firmware_manager.get_firmware_info('latest', manifest)
+            if firmware_info:
+                if firmware_info.version in self.firmware_manager.list_cached_versions():
+                    self.logger.info(f"Checking cached firmware version {firmware_info.version}")
+                else:
+                    self.logger.info(f"Prefetching firmware version {firmware_info.version}")
+                self.firmware_manager.download_firmware(
+                    firmware_info,
+                    cancel_event=self._cancel_event,
+                    bandwidth_limit=self.bandwidth_limit
+                )
+
+            if manifest.cart_clinic and not self._cancel_event.is_set():
+                self.firmware_manager.download_cart_clinic_bitstream(
+                    manifest.cart_clinic,
+                    cancel_event=self._cancel_event,
+                    bandwidth_limit=self.bandwidth_limit
+                )
+
+            self.logger.info("Firmware prefetch complete")
+        except FirmwareDownloadCancelled:
+            self.logger.info("Firmware prefetch cancelled")
+        except Exception as e:
+            # The update downloads anything still missing when it starts
+            self.logger.warning(f"Firmware prefetch failed: {e}")
@@ -0,0 +1,103 @@
+# Fast file hashing shared by firmware validation and other file checks
+# Reads each file once with large buffers and can hash several files at once
+
+import os
+import mmap
+import zlib
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Sequence
+
+logger = logging.getLogger('mrupdater.hashing')
+
+# Bytes fed to the hashes at a time
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Files hashed at the same time; hashlib and zlib release the GIL while
+# hashing large buffers, so threads hash in parallel
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+
+class Crc32:
+    """CRC32 with the same update/hexdigest interface as hashlib objects"""
+    name = 'crc32'
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self) -> str:
+        return f"{self.value:08x}"
+
+def new_hash(algorithm: str):
+    """
+    Create a hash object.
+
+    Args:
+        algorithm: 'crc32' or any algorithm name hashlib knows, such as
+            'sha256' or 'md5'
+
+    Returns:
+        An object with update() and hexdigest()
+    """
+    if algorithm == 'crc32':
+        return Crc32()
+    return hashlib.new(algorithm)
+
+def hash_file(file_path, algorithms: Sequence[str] = ('sha256',)) -> Dict[str, str]:
+    """
+    Compute one or more digests of a file in a single read pass.
+
+    A single hashlib digest uses hashlib.file_digest where available. For
+    several digests the file is memory-mapped and every digest is fed the
+    same buffers, so the file is only read once.
+
+    Args:
+        file_path: Path to file
+        algorithms: Digests to compute, such as ('sha256', 'crc32', 'md5')
+
+    Returns:
+        Dict[str, str]: Each algorithm's digest in hexadecimal
+    """
+    with open(file_path, 'rb') as f:
+        if len(algorithms) == 1 and algorithms[0] != 'crc32' and hasattr(hashlib, 'file_digest'):
+            return {algorithms[0]: hashlib.file_digest(f, algorithms[0]).hexdigest()}
+
+        hashes = {algorithm: new_hash(algorithm) for algorithm in algorithms}
+        if os.fstat(f.fileno()).st_size == 0:
+            return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                for offset in range(0, len(view), HASH_BUFFER_SIZE):
+                    with view[offset:offset + HASH_BUFFER_SIZE] as chunk:
+                        for h in hashes.values():
+                            h.update(chunk)
+
+    return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+def hash_files(file_paths: Iterable, algorithms: Sequence[str] = ('sha256',),
+               workers: int = HASH_WORKERS) -> List[Dict[str, str]]:
+    """
+    Hash several files concurrently.
+
+    Args:
+        file_paths: Paths to files
+        algorithms: Digests to compute for every file
+        workers: Files hashed at the same time
+
+    Returns:
+        List[Dict[str, str]]: The digests of each file, in the order given
+    """
+    file_paths = list(file_paths)
+    if len(file_paths) <= 1 or workers <= 1:
+        return [hash_file(path, algorithms) for path in file_paths]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(file_paths)),
+                            thread_name_prefix='hash') as executor:
+        return list(executor.map(lambda path: hash_file(path, algorithms), file_paths))
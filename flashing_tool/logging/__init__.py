@@ -35,9 +35,9 @@ class IntervalSamplingFilter(logging.Filter):
     previous: float = 0
     
     def __init__(self = None, name = None, interval = None):
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
+        super().__init__(name)
+        self.interval = interval
+
     def __str__(self = None):
         return self.log_tag
 
@@ -49,14 +49,13 @@ class IntervalSamplingFilter(logging.Filter):
     def log_tag(self = None):
         return f'''tag:{self.name}'''
 
-    log_tag = None(log_tag)
+    log_tag = property(log_tag)
     
     def filter(self = None, record = None):
         message = record.getMessage()
-        if None((lambda .0 = None: for c in .0:
-c in message)((self.log_tag,))) is False:
+        if any(c in message for c in (self.log_tag,)) is False:
             return True
-        filter_name_re = None.compile(re.escape(self.log_tag) + '\\s+?')
+        filter_name_re = re.compile(re.escape(self.log_tag) + '\\s+?')
         sanitized_msg = filter_name_re.sub('', message, re.I)
         record.msg = sanitized_msg
         if self.previous == 0 or self.elapsed_time >= self.interval:
@@ -67,7 +66,7 @@ c in message)((self.log_tag,))) is False:
     def elapsed_time(self = None):
         return time.monotonic() - self.previous
 
-    elapsed_time = None(elapsed_time)
+    elapsed_time = property(elapsed_time)
 
 
 class UniformSamplingFilter(logging.Filter):
@@ -85,8 +84,9 @@ class UniformSamplingFilter(logging.Filter):
     
     def __init__(self = None, p = None, level = None):
         super().__init__()
-        # Incomplete decompilation - manual review needed
-        pass
+        self.sample_rate = p
+        self.level = level
+
     def filter(self = None, record = None):
         if record.levelno >= self.level:
             return random.random() < self.sample_rate
@@ -0,0 +1,119 @@
+# Local cache of the parsed firmware manifest
+# Lets update checks skip both the download and the YAML parse while the
+# manifest has not changed
+
+import os
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger('mrupdater.manifest_cache')
+
+# How long a cached manifest is used before asking S3 whether it changed
+MANIFEST_TTL_S = 15 * 60
+
+# Bumped whenever the layout of the cached manifest changes, so caches
+# written by another version of the app are ignored instead of misread
+MANIFEST_CACHE_SCHEMA_VERSION = 1
+
+@dataclass
+class CachedManifest:
+    """A parsed manifest with the ETag it was downloaded with"""
+    data: Dict[str, Any]
+    etag: Optional[str]
+    # time.time() when S3 last confirmed this manifest
+    fetched_at: float
+
+class ManifestCache:
+    """
+    Parsed firmware manifest kept as JSON, plus the ETag to revalidate it.
+
+    The last entry loaded or stored is also kept in memory, so repeated
+    lookups during one flow do not touch the disk.
+    """
+
+    def __init__(self, path: Path, ttl_s: float = MANIFEST_TTL_S):
+        self.path = Path(path)
+        self.ttl_s = ttl_s
+        self.logger = logging.getLogger('mrupdater.manifest_cache')
+        self._entry: Optional[CachedManifest] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[CachedManifest]:
+        """
+        Get the cached manifest.
+
+        Returns:
+            CachedManifest: Cached manifest, or None if there is no usable one
+        """
+        with self._lock:
+            if self._entry is None:
+                self._entry = self._read()
+            return self._entry
+
+    def is_fresh(self, entry: CachedManifest) -> bool:
+        """Check whether a cached manifest can be used without asking S3"""
+        age = time.time() - entry.fetched_at
+        return 0 <= age < self.ttl_s
+
+    def store(self, data: Dict[str, Any], etag: Optional[str]) -> CachedManifest:
+        """
+        Cache a newly downloaded manifest.
+
+        Args:
+            data: Parsed manifest
+            etag: ETag S3 returned with the manifest
+
+        Returns:
+            CachedManifest: The new cache entry
+        """
+        entry = CachedManifest(data, etag, time.time())
+        with self._lock:
+            self._entry = entry
+            self._write(entry)
+        return entry
+
+    def refresh(self, entry: CachedManifest) -> CachedManifest:
+        """Record that S3 confirmed the cached manifest is still current"""
+        return self.store(entry.data, entry.etag)
+
+    def clear(self):
+        """Remove the cached manifest"""
+        with self._lock:
+            self._entry = None
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _read(self) -> Optional[CachedManifest]:
+        try:
+            with open(self.path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('schema_version') != MANIFEST_CACHE_SCHEMA_VERSION:
+                return None
+            return CachedManifest(cached['manifest'], cached.get('etag'), float(cached['fetched_at']))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.logger.warning(f"Ignoring unreadable manifest cache: {e}")
+            return None
+
+    def _write(self, entry: CachedManifest):
+        cached = {
+            'schema_version': MANIFEST_CACHE_SCHEMA_VERSION,
+            'etag': entry.etag,
+            'fetched_at': entry.fetched_at,
+            'manifest': entry.data,
+        }
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(cached, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"Failed to cache manifest: {e}")
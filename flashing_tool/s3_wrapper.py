@@ -14,14 +14,18 @@ REGION_NAME = 'us-east-1'
 BUCKET_NAME = 'updates.modretro.com'
 MANIFEST_KEY = 'apps/manifest.yaml'
 DEFAULT_AUTHENTICATION = {
-    'config': boto3.session.Config(UNSIGNED, **('signature_version',)) }
+    'config': boto3.session.Config(signature_version=UNSIGNED) }
 flashing_tool_logger = logging.getLogger('mrupdater')
 
 class InvalidAwsCredentialsError(Exception):
     '''Raised when AWS credentials are invalid or missing.'''
     pass
 
-AwsCredentials = dataclass(<NODE:12>)
+@dataclass
+class AwsCredentials:
+    aws_access_key_id: str
+    aws_secret_access_key: str
+
 
 class S3WrapperError(Exception):
     '''Raise when the S3Wrapper encounters an error.'''
@@ -35,37 +39,68 @@ class S3Wrapper:
     def __init__(self = None, bucket = None, credentials = None):
         self.bucket = bucket
         config = asdict(credentials) if credentials else DEFAULT_AUTHENTICATION
-        # Assignment completed
-    def download_file(self = None, key = None):
+        # boto3 clients are thread-safe, so one client (and its connection
+        # pool) is shared by every download of a firmware package.
+        self.client = boto3.client('s3', region_name=REGION_NAME, **config)
+
+    def download_file(self = None, key = None, callback = None):
+        '''Downloads an object to the temp directory. `callback`, if given,
+        is called with the number of bytes received as the download goes.'''
         destination = os.path.join(tempfile.gettempdir(), key)
         dest_dir = os.path.dirname(destination)
-        if not os.path.isdir(dest_dir):
-            os.makedirs(dest_dir)
-        self.client.download_file(self.bucket, key, destination)
+        os.makedirs(dest_dir, exist_ok=True)
+        self.client.download_file(self.bucket, key, destination, Callback=callback)
         return destination
 
-    download_file = None(download_file)
+    download_file = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(download_file)
     
     def download_files(self = None, keys = None):
-        destinations = (lambda .0 = None: [ self.download_file(key) for key in .0 ])(keys)
+        destinations = [ self.download_file(key) for key in keys ]
         return dict(zip(keys, destinations))
 
-    download_files = None(download_files)
+    download_files = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(download_files)
     
-    def read_manifest(self):
-        response = self.client.get_object(BUCKET_NAME, MANIFEST_KEY, **('Bucket', 'Key'))
-        return response['Body'].read().decode('utf-8')
+    def read_manifest(self = None, etag = None):
+        '''Returns the manifest text and its ETag. When `etag` is given and
+        the manifest still has it, returns (None, etag) without downloading
+        the manifest again.'''
+        kwargs = { 'IfNoneMatch': etag } if etag else { }
+        try:
+            response = self.client.get_object(Bucket=BUCKET_NAME, Key=MANIFEST_KEY, **kwargs)
+        except S3ClientError as e:
+            if e.response.get('Error', { }).get('Code') in ('304', 'NotModified'):
+                return (None, etag)
+            raise
+        return (response['Body'].read().decode('utf-8'), response.get('ETag'))
 
-    read_manifest = handle_exceptions(S3ClientError, S3WrapperError, **('raise_as',))(read_manifest)
+    read_manifest = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(read_manifest)
     
     def read_file(self = None, key = None):
-        response = self.client.get_object(self.bucket, key, **('Bucket', 'Key'))
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
         return response['Body'].read().decode('utf-8')
 
-    read_file = None(read_file)
+    read_file = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(read_file)
+    
+    def open_file(self = None, key = None, start = None, end = None, etag = None):
+        '''Starts downloading an object and returns its body, a stream the
+        caller reads the content from and closes.
+
+        `start` and `end` (exclusive) select a byte range of the object. When
+        `etag` is given, the download fails unless the object still has that
+        ETag, so ranges of a changed object are never mixed.'''
+        kwargs = {}
+        if start is not None or end is not None:
+            last = '' if end is None else str(end - 1)
+            kwargs['Range'] = f'''bytes={start or 0}-{last}'''
+        if etag:
+            kwargs['IfMatch'] = etag
+        response = self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)
+        return response['Body']
+
+    open_file = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(open_file)
     
     def get_file_metadata(self = None, key = None):
-        return self.client.head_object(self.bucket, key, **('Bucket', 'Key'))
+        return self.client.head_object(Bucket=self.bucket, Key=key)
 
-    get_file_metadata = None(get_file_metadata)
+    get_file_metadata = handle_exceptions(S3ClientError, raise_as=S3WrapperError)(get_file_metadata)
 
@@ -13,11 +13,28 @@ updateFrameBuffer
 connection_test
 '''
 from libpyretro.cartclinic.protocol.common import SCREEN_PIXEL_WIDTH, PixelRGB555, PixelRGB888
+from .flash_plan import CartFlashTiming
 from .protocol import CartFlashChip, CartFlashInfo, CmdDetectCart, CmdReadCartByte, CmdSetFrameBufferPixel, CmdWriteCartByte, CmdWriteCartFlashByte, ReplyDetectCart, ReplyReadCartByte, ReplySetFrameBufferPixel, ReplyWriteCartByte, ReplyWriteCartFlashByte
 MAX_CART_SIZE_KB = 8388608
 MAX_BANK_SIZE_KB = 16384
 NUM_BANKS = MAX_CART_SIZE_KB // MAX_BANK_SIZE_KB
 NUM_FRAM_BANKS = 4
+# Known cartridge flash chips. Unlock bypass lets each programmed byte skip the
+# 0xAA/0x55 unlock cycles once the chip has been put into bypass mode. Chips
+# with a write buffer program a whole aligned page of write_buffer_size bytes
+# with one confirm command and a single busy wait.
+FLASH_CHIPS = {
+    CartFlashChip.ISSI_IS29GL032: CartFlashInfo(part_id=CartFlashChip.ISSI_IS29GL032, part_number='IS29GL032-70TLET-TR', vendor='ISSI', total_size_kb=4096, sector_size_kb=64, grouping='sector', recovery_offset_kb=64, unlock_bypass=True, write_buffer_size=32),
+    CartFlashChip.Infineon_S29JL032J70: CartFlashInfo(part_id=CartFlashChip.Infineon_S29JL032J70, part_number='S29JL032J70TFI320', vendor='Infineon', total_size_kb=4096, sector_size_kb=64, grouping='sector', recovery_offset_kb=8, unlock_bypass=True),
+    CartFlashChip.Microchip_SST39VF1682: CartFlashInfo(part_id=CartFlashChip.Microchip_SST39VF1682, part_number='SST39VF1682-70-4C-EKE', vendor='Microchip', total_size_kb=2048, sector_size_kb=64, grouping='sector', recovery_offset_kb=64),
+    CartFlashChip.Microchip_SST39VF1681: CartFlashInfo(part_id=CartFlashChip.Microchip_SST39VF1681, part_number='SST39VF1681-70-4C-EKE', vendor='Microchip', total_size_kb=2048, sector_size_kb=64, grouping='sector', recovery_offset_kb=64) }
+# Typical and maximum erase/program times from each chip's datasheet, used to
+# choose between chip and sector erase and to bound erase polling.
+FLASH_TIMINGS = {
+    CartFlashChip.ISSI_IS29GL032: CartFlashTiming(sector_erase_typ_s=0.1, sector_erase_max_s=2, chip_erase_typ_s=32, chip_erase_max_s=128, byte_program_typ_s=8e-06),
+    CartFlashChip.Infineon_S29JL032J70: CartFlashTiming(sector_erase_typ_s=0.5, sector_erase_max_s=5, chip_erase_typ_s=32, chip_erase_max_s=160, byte_program_typ_s=8e-06),
+    CartFlashChip.Microchip_SST39VF1682: CartFlashTiming(sector_erase_typ_s=0.018, sector_erase_max_s=0.025, chip_erase_typ_s=0.04, chip_erase_max_s=0.05, byte_program_typ_s=7e-06),
+    CartFlashChip.Microchip_SST39VF1681: CartFlashTiming(sector_erase_typ_s=0.018, sector_erase_max_s=0.025, chip_erase_typ_s=0.04, chip_erase_max_s=0.05, byte_program_typ_s=7e-06) }
 
 class CartAPI_Builder:
     
@@ -131,6 +148,70 @@ class CartAPI_Builder:
             block |= 64
         addr = offset | block << 8
         return CmdWriteCartFlashByte(addr, data_byte).encode()
+
+    @staticmethod
+    def program_flash_byte(block, offset, bank_index, data_byte):
+        '''
+        Constructs a message to program a single byte of flash. The JEDEC
+        program command is issued ahead of the data write, which the FPGA then
+        polls until the flash reports the byte as written. The byte must have
+        been erased beforehand.
+        '''
+        return CmdWriteCartByte(2730, 170).encode() + CmdWriteCartByte(1365, 85).encode() + CmdWriteCartByte(2730, 160).encode() + CartAPI_Builder.write_flash_byte(block, offset, bank_index, data_byte)
+    
+    def enter_unlock_bypass():
+        '''
+        Constructs a message to place the flash into unlock bypass mode. While
+        in this mode a byte is programmed with a two cycle command instead of
+        the full unlock sequence. Only valid for chips whose CartFlashInfo has
+        unlock_bypass set.
+        '''
+        return CmdWriteCartByte(2730, 170).encode() + CmdWriteCartByte(1365, 85).encode() + CmdWriteCartByte(2730, 32).encode()
+
+    enter_unlock_bypass = staticmethod(enter_unlock_bypass)
+    
+    def exit_unlock_bypass():
+        '''
+        Constructs a message to return the flash from unlock bypass mode to
+        normal read mode.
+        '''
+        return CmdWriteCartByte(0, 144).encode() + CmdWriteCartByte(0, 0).encode()
+
+    exit_unlock_bypass = staticmethod(exit_unlock_bypass)
+
+    @staticmethod
+    def program_flash_byte_bypass(block, offset, bank_index, data_byte):
+        '''
+        Constructs a message to program a single byte of flash while the chip
+        is in unlock bypass mode. The unlock cycles are left out, leaving the
+        program command followed by the polled data write.
+        '''
+        return CmdWriteCartByte(2730, 160).encode() + CartAPI_Builder.write_flash_byte(block, offset, bank_index, data_byte)
+    
+    @staticmethod
+    def write_to_buffer(block, offset, bank_index, data):
+        '''
+        Constructs a message to program up to one write buffer page of flash
+        with a single confirm command. The data must not cross a write buffer
+        page boundary, and its first address doubles as the sector address the
+        buffer commands are issued to. Completion has to be polled on the last
+        address written.
+        '''
+        if len(data) == 0:
+            raise ValueError('The write buffer must hold at least one byte')
+        message = CmdWriteCartByte(2730, 170).encode() + CmdWriteCartByte(1365, 85).encode() + CartAPI_Builder.write_byte(block, offset, bank_index, 37) + CartAPI_Builder.write_byte(block, offset, bank_index, len(data) - 1)
+        for index, data_byte in enumerate(data):
+            message += CartAPI_Builder.write_byte(block, offset + index, bank_index, data_byte)
+        return message + CartAPI_Builder.write_byte(block, offset, bank_index, 41)
+    
+    def abort_write_to_buffer():
+        '''
+        Constructs a message to return the flash to read mode after a write
+        to buffer operation was aborted or failed.
+        '''
+        return CmdWriteCartByte(2730, 170).encode() + CmdWriteCartByte(1365, 85).encode() + CmdWriteCartByte(2730, 240).encode()
+
+    abort_write_to_buffer = staticmethod(abort_write_to_buffer)
     
     def detect_cart():
         return CmdDetectCart().encode()
@@ -246,11 +327,7 @@ class CartAPI_Parser:
             A CartFlashInfo object describing the flash chip if identified;
             otherwise, None.
         """
-        flash_chips = {
-            CartFlashChip.ISSI_IS29GL032: CartFlashInfo(CartFlashChip.ISSI_IS29GL032, 'IS29GL032-70TLET-TR', 'ISSI', 4096, 64, 'sector', 64, **('part_id', 'part_number', 'vendor', 'total_size_kb', 'sector_size_kb', 'grouping', 'recovery_offset_kb')),
-            CartFlashChip.Infineon_S29JL032J70: CartFlashInfo(CartFlashChip.Infineon_S29JL032J70, 'S29JL032J70TFI320', 'Infineon', 4096, 64, 'sector', 8, **('part_id', 'part_number', 'vendor', 'total_size_kb', 'sector_size_kb', 'grouping', 'recovery_offset_kb')),
-            CartFlashChip.Microchip_SST39VF1682: CartFlashInfo(CartFlashChip.Microchip_SST39VF1682, 'SST39VF1682-70-4C-EKE', 'Microchip', 2048, 64, 'sector', 64, **('part_id', 'part_number', 'vendor', 'total_size_kb', 'sector_size_kb', 'grouping', 'recovery_offset_kb')),
-            CartFlashChip.Microchip_SST39VF1681: CartFlashInfo(CartFlashChip.Microchip_SST39VF1681, 'SST39VF1681-70-4C-EKE', 'Microchip', 2048, 64, 'sector', 64, **('part_id', 'part_number', 'vendor', 'total_size_kb', 'sector_size_kb', 'grouping', 'recovery_offset_kb')) }
+        flash_chips = FLASH_CHIPS
         if flash_info_data[0] == 157 and flash_info_data[2] == 126 and flash_info_data[28] == 29 and flash_info_data[30] == 1:
             return flash_chips[CartFlashChip.ISSI_IS29GL032]
         if flash_info_data[0] == 1 and flash_info_data[2] == 83 and flash_info_data[4] == 0 and flash_info_data[6] == 2:
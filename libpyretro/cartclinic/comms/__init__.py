@@ -1,8 +1,7 @@
 # Source Generated with Decompyle++
 # File: __init__.pyc (Python 3.10)
 
-from transport import CommandProperty
-from transport import Transport
-from transport import Transporter
-from transport import TransportKind
-from session import Session
+from .transport import CommandProperty
+from .transport import TransportKind
+from .session import Session
+from .session import Transport
@@ -2,11 +2,35 @@
 # File: exceptions.pyc (Python 3.10)
 
 from dataclasses import dataclass
-ComparisonError = dataclass(<NODE:12>)
-WriteBlockAddressError = dataclass(<NODE:12>)
-WriteBlockDataError = dataclass(<NODE:12>)
-InvalidWriteBankSize = dataclass(<NODE:12>)
+
+@dataclass
+class CommsError(Exception):
+    '''Base class of the errors raised while talking to a cartridge.'''
+    message: str = ''
+    
+    def __post_init__(self):
+        super().__init__(self.message)
+
+
+@dataclass
+class ComparisonError(CommsError):
+    '''Data read back from the cartridge differs from the data written.'''
+
+
+@dataclass
+class WriteBlockAddressError(CommsError):
+    '''A block write was addressed outside the cartridge.'''
+
+
+@dataclass
+class WriteBlockDataError(CommsError):
+    '''A block of data could not be written to the cartridge.'''
+
+
+@dataclass
+class InvalidWriteBankSize(CommsError):
+    '''A bank write did not have the size of a bank.'''
+
 
 class BankSwitchTimeOut(Exception):
     pass
-
@@ -2,6 +2,7 @@
 # Source: libpyretro/cartclinic/comms/session.pyc
 
 import logging
+import threading
 import time
 import serial
 from typing import Optional, List, Any, Dict
@@ -39,10 +40,36 @@ class Transport:
         
         # Use the improved serial transport
         return self.serial_transport.send_command(command)
-from ..cart_api import CartAPI_Builder, CartAPI_Parser
+from ..cart_api import CartAPI_Builder, CartAPI_Parser, FLASH_TIMINGS, MAX_BANK_SIZE_KB
 
 logger = logging.getLogger(__name__)
 
+# Every FPGA reply is a command ID followed by a 3 byte payload
+REPLY_SIZE = 4
+# Number of manufacturer/device ID bytes read back in identification mode
+FLASH_ID_SIZE = 32
+# Bytes programmed per transfer; each byte is several commands on the wire
+FLASH_PROGRAM_BATCH_SIZE = 64
+# Fallback erase timeouts for chips without an entry in FLASH_TIMINGS
+FLASH_SECTOR_ERASE_TIMEOUT_S = 10.0
+FLASH_CHIP_ERASE_TIMEOUT_S = 240.0
+# Margin applied on top of the datasheet maximum erase time
+FLASH_ERASE_TIMEOUT_MARGIN = 1.5
+# An erase is polled about this many times over its typical duration, with
+# the interval capped so a finished erase is noticed promptly
+FLASH_ERASE_POLLS_PER_TYPICAL = 20
+FLASH_ERASE_POLL_MAX_S = 0.25
+# Poll interval for chips without an entry in FLASH_TIMINGS
+FLASH_ERASE_POLL_DEFAULT_S = 0.01
+FLASH_BUFFER_PROGRAM_TIMEOUT_S = 1.0
+# Status reads appended to every write buffer transfer, so that a completed
+# page is usually confirmed without another round trip
+FLASH_BUFFER_STATUS_READS = 2
+# JEDEC status bits driven on the data bus while an embedded algorithm runs
+FLASH_STATUS_DQ7 = 0x80
+FLASH_STATUS_DQ6 = 0x40
+FLASH_STATUS_DQ5 = 0x20
+
 class Session:
     """Cart Clinic communication session"""
     
@@ -50,6 +77,10 @@ class Session:
         self.transport = transport
         self._connected = False
         self._cartridge_info = None
+        self._flash_info = None
+        # Serialises command/response exchanges between the threads sharing
+        # the session, e.g. screen animation, cartridge detection and writes
+        self._command_lock = threading.RLock()
         
     def connect(self, port: str, baudrate: int = 115200, timeout: float = 1.0) -> bool:
         """Connect to the device"""
@@ -78,7 +109,18 @@ class Session:
         if not self.is_connected():
             raise RuntimeError("Not connected")
         
-        return self.transport.send_command(command)
+        with self._command_lock:
+            return self.transport.send_command(command)
+    
+    def wait_until_idle(self, timeout: float = -1) -> bool:
+        """Wait until no other thread is in the middle of a command exchange
+        
+        Returns False if the session was still busy after `timeout` seconds.
+        """
+        if not self._command_lock.acquire(timeout=timeout):
+            return False
+        self._command_lock.release()
+        return True
     
     def get_cartridge_info(self) -> Optional[Dict]:
         """Get cartridge information"""
@@ -212,11 +254,11 @@ class Session:
             logger.error(f"Failed to read header: {e}")
             return None
     
-    def read_bank(self, bank_num: int) -> Optional[bytes]:
-        """Read a single 16KB bank from cartridge"""
+    def read_bank(self, bank_num: int, length: int = 16384) -> Optional[bytes]:
+        """Read a single 16KB bank from cartridge, or only its first length bytes"""
         try:
             bank_data = bytearray()
-            bank_size = 16384  # 16KB per bank
+            bank_size = min(length, 16384)  # 16KB per bank
             
             # Set the bank if needed (for banks > 1)
             if bank_num > 1:
@@ -281,6 +323,283 @@ class Session:
             logger.error(f"Failed to read save data: {e}")
             return None
     
+    @staticmethod
+    def _flash_location(address: int):
+        """Split a ROM offset into (bank, block, offset, bank_index) bus coordinates"""
+        bank_num = address // MAX_BANK_SIZE_KB
+        bank_offset = address % MAX_BANK_SIZE_KB
+        return (bank_num, bank_offset >> 8, bank_offset & 0xFF, 1 if bank_num > 0 else 0)
+    
+    def _select_bank(self, bank_num: int):
+        """Map the given bank into the switchable ROM window"""
+        if bank_num > 0:
+            for cmd in CartAPI_Builder.set_bank(bank_num):
+                self.send_command(cmd)
+    
+    def _read_flash_byte(self, address: int) -> int:
+        """Read a single byte at a ROM offset whose bank is already selected"""
+        _, block, offset, bank_index = self._flash_location(address)
+        response = self.send_command(CartAPI_Builder.read_byte(block, offset, bank_index))
+        _, data_byte = CartAPI_Parser.byte_read(response)
+        return data_byte
+    
+    def get_flash_type(self):
+        """Identify the flash chip on the cartridge, returning its CartFlashInfo"""
+        if self._flash_info:
+            return self._flash_info
+        
+        try:
+            self.send_command(CartAPI_Builder.get_flash_type())
+            id_data = bytearray()
+            for offset in range(FLASH_ID_SIZE):
+                response = self.send_command(CartAPI_Builder.read_byte(0, offset, 0))
+                _, data_byte = CartAPI_Parser.byte_read(response)
+                id_data.append(data_byte)
+        except Exception as e:
+            logger.error(f"Failed to identify flash chip: {e}")
+            return None
+        finally:
+            self.send_command(CartAPI_Builder.reset_flash_controller())
+        
+        self._flash_info = CartAPI_Parser.flash_type(id_data)
+        if self._flash_info is None:
+            logger.warning(f"Unknown flash chip: {bytes(id_data).hex()}")
+        return self._flash_info
+    
+    def get_flash_timing(self):
+        """Return the CartFlashTiming of the cartridge flash chip, if known"""
+        flash_info = self.get_flash_type()
+        if flash_info is None:
+            return None
+        return FLASH_TIMINGS.get(flash_info.part_id)
+    
+    @staticmethod
+    def _erase_poll_interval(typical_s: Optional[float]) -> float:
+        """Time to sleep between status polls of an erase with the given typical duration"""
+        if typical_s is None:
+            return FLASH_ERASE_POLL_DEFAULT_S
+        return min(typical_s / FLASH_ERASE_POLLS_PER_TYPICAL, FLASH_ERASE_POLL_MAX_S)
+    
+    def wait_flash_ready(self, address: int, timeout_s: float, expected: int = 0xFF, poll_interval_s: float = 0.0) -> bool:
+        """Poll the toggle bit until the chip finishes an embedded program or erase
+        
+        While busy, DQ6 toggles on every read; once it stops, DQ7 must match the
+        expected data. DQ5 set while still toggling means the chip exceeded its
+        internal time limit and the operation failed. Between polls the thread
+        sleeps for poll_interval_s, leaving the session free for other commands.
+        """
+        deadline = time.monotonic() + timeout_s
+        while True:
+            first = self._read_flash_byte(address)
+            second = self._read_flash_byte(address)
+            if not (first ^ second) & FLASH_STATUS_DQ6:
+                if (second ^ expected) & FLASH_STATUS_DQ7 == 0:
+                    return True
+            elif second & FLASH_STATUS_DQ5:
+                first = self._read_flash_byte(address)
+                second = self._read_flash_byte(address)
+                if not (first ^ second) & FLASH_STATUS_DQ6:
+                    return True
+                logger.error(f"Flash reported an internal timeout at 0x{address:06X}")
+                break
+            
+            if time.monotonic() > deadline:
+                logger.error(f"Timed out waiting for flash at 0x{address:06X}")
+                break
+            if poll_interval_s:
+                time.sleep(poll_interval_s)
+        
+        self.send_command(CartAPI_Builder.reset_flash_controller())
+        return False
+    
+    def erase_flash_sector(self, sector_num: int, sector_size: int) -> bool:
+        """Erase a single flash sector and wait until the chip reports it erased"""
+        try:
+            timing = self.get_flash_timing()
+            timeout_s = timing.sector_erase_max_s * FLASH_ERASE_TIMEOUT_MARGIN if timing else FLASH_SECTOR_ERASE_TIMEOUT_S
+            poll_interval_s = self._erase_poll_interval(timing.sector_erase_typ_s if timing else None)
+            sector_start = sector_num * sector_size
+            self._select_bank(sector_start // MAX_BANK_SIZE_KB)
+            self.send_command(CartAPI_Builder.erase_sector(sector_num, sector_size))
+            return self.wait_flash_ready(sector_start, timeout_s, poll_interval_s=poll_interval_s)
+            
+        except Exception as e:
+            logger.error(f"Failed to erase sector {sector_num}: {e}")
+            return False
+    
+    def erase_flash_chip(self) -> bool:
+        """Erase the whole flash chip and wait until the chip reports it erased"""
+        try:
+            timing = self.get_flash_timing()
+            timeout_s = timing.chip_erase_max_s * FLASH_ERASE_TIMEOUT_MARGIN if timing else FLASH_CHIP_ERASE_TIMEOUT_S
+            poll_interval_s = self._erase_poll_interval(timing.chip_erase_typ_s if timing else None)
+            self.send_command(CartAPI_Builder.erase_flash_all())
+            return self.wait_flash_ready(0, timeout_s, poll_interval_s=poll_interval_s)
+            
+        except Exception as e:
+            logger.error(f"Failed to erase flash chip: {e}")
+            return False
+    
+    def program_flash(self, address: int, data: bytes) -> bool:
+        """Program erased flash starting at a ROM offset
+        
+        Chips with a write buffer are programmed a page at a time, the rest one
+        byte at a time.
+        """
+        flash_info = self.get_flash_type()
+        if flash_info is not None and flash_info.write_buffer_size:
+            return self._program_flash_buffered(address, data, flash_info.write_buffer_size)
+        return self._program_flash_bytes(address, data, flash_info is not None and flash_info.unlock_bypass)
+    
+    def _program_flash_buffered(self, address: int, data: bytes, buffer_size: int) -> bool:
+        """Program flash one aligned write buffer page per transfer, verifying every page
+        
+        Each page is followed by status reads of its last byte and a read back of
+        the whole page. The page is done once both status reads return the
+        programmed data; otherwise the toggle bit is polled and the page read
+        back again. A page that does not read back as programmed aborts the write
+        to buffer operation.
+        """
+        success = False
+        try:
+            position = 0
+            current_bank = None
+            while position < len(data):
+                bank_num, block, offset, bank_index = self._flash_location(address + position)
+                if bank_num != current_bank:
+                    self._select_bank(bank_num)
+                    current_bank = bank_num
+                
+                page_end = ((address + position) // buffer_size + 1) * buffer_size - address
+                chunk_end = min(page_end, len(data))
+                chunk = data[position:chunk_end]
+                last_address = address + chunk_end - 1
+                _, last_block, last_offset, _ = self._flash_location(last_address)
+                
+                status_read = CartAPI_Builder.read_byte(last_block, last_offset, bank_index)
+                page_read = self._build_page_read(address + position, len(chunk))
+                response = self.send_command(CartAPI_Builder.write_to_buffer(block, offset, bank_index, chunk) + status_read * FLASH_BUFFER_STATUS_READS + page_read)
+                page_size = len(chunk) * REPLY_SIZE
+                if self._buffer_programmed(response[:len(response) - page_size], chunk[-1]):
+                    read_back = response[len(response) - page_size:]
+                elif self.wait_flash_ready(last_address, FLASH_BUFFER_PROGRAM_TIMEOUT_S, chunk[-1]):
+                    read_back = self.send_command(page_read)
+                else:
+                    logger.error(f"Write buffer program failed at 0x{address + position:06X}")
+                    return False
+                
+                if not self._read_back_matches(read_back, chunk):
+                    logger.error(f"Write buffer verification failed at 0x{address + position:06X}")
+                    return False
+                position = chunk_end
+            success = True
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to program flash at 0x{address:06X}: {e}")
+            return False
+        finally:
+            if not success:
+                try:
+                    self.send_command(CartAPI_Builder.abort_write_to_buffer())
+                except Exception as e:
+                    logger.error(f"Failed to return flash to read mode: {e}")
+    
+    def _build_page_read(self, address: int, length: int) -> bytes:
+        """Build the reads of `length` bytes from a ROM offset whose bank is selected"""
+        commands = bytearray()
+        for i in range(length):
+            _, block, offset, bank_index = self._flash_location(address + i)
+            commands += CartAPI_Builder.read_byte(block, offset, bank_index)
+        return bytes(commands)
+    
+    def _buffer_programmed(self, response: bytes, expected: int) -> bool:
+        """Check whether the status reads trailing a write buffer transfer show the
+        page finished, i.e. every read returned the programmed data"""
+        status_size = FLASH_BUFFER_STATUS_READS * REPLY_SIZE
+        if len(response) < status_size:
+            return False
+        return self._read_back_matches(response[len(response) - status_size:], bytes([expected]) * FLASH_BUFFER_STATUS_READS)
+    
+    def _read_back_matches(self, response: bytes, expected: bytes) -> bool:
+        """Check that the ReadCartByte replies in response returned the expected bytes"""
+        if len(response) != len(expected) * REPLY_SIZE:
+            return False
+        
+        for i, expected_byte in enumerate(expected):
+            reply_start = i * REPLY_SIZE
+            _, data_byte = CartAPI_Parser.byte_read(bytes(response[reply_start:reply_start + REPLY_SIZE]))
+            if data_byte != expected_byte:
+                return False
+        return True
+    
+    def _program_flash_bytes(self, address: int, data: bytes, unlock_bypass: bool) -> bool:
+        """Program flash one byte at a time, verifying every byte
+        
+        Chips that support it are put into unlock bypass mode for the duration,
+        halving the commands sent per byte. Bypass mode is always exited, and
+        the flash controller is reset if programming fails.
+        """
+        program_byte = CartAPI_Builder.program_flash_byte_bypass if unlock_bypass else CartAPI_Builder.program_flash_byte
+        success = False
+        try:
+            if unlock_bypass:
+                self.send_command(CartAPI_Builder.enter_unlock_bypass())
+            
+            position = 0
+            current_bank = None
+            while position < len(data):
+                bank_num, _, _, _ = self._flash_location(address + position)
+                if bank_num != current_bank:
+                    self._select_bank(bank_num)
+                    current_bank = bank_num
+                
+                # Batch bytes up to the batch size without crossing a bank boundary
+                bank_end = (bank_num + 1) * MAX_BANK_SIZE_KB - address
+                batch_end = min(position + FLASH_PROGRAM_BATCH_SIZE, len(data), bank_end)
+                commands = bytearray()
+                for i in range(position, batch_end):
+                    _, block, offset, bank_index = self._flash_location(address + i)
+                    commands += program_byte(block, offset, bank_index, data[i])
+                
+                response = self.send_command(bytes(commands))
+                if not self._validate_program_response(response, data[position:batch_end], program_byte):
+                    logger.error(f"Flash program verification failed at 0x{address + position:06X}")
+                    return False
+                position = batch_end
+            success = True
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to program flash at 0x{address:06X}: {e}")
+            return False
+        finally:
+            self._finish_programming(unlock_bypass, success)
+    
+    def _finish_programming(self, unlock_bypass: bool, success: bool):
+        """Leave unlock bypass mode and, after a failure, reset the flash controller"""
+        try:
+            if unlock_bypass:
+                self.send_command(CartAPI_Builder.exit_unlock_bypass())
+            if not success:
+                self.send_command(CartAPI_Builder.reset_flash_controller())
+        except Exception as e:
+            logger.error(f"Failed to return flash to read mode: {e}")
+    
+    def _validate_program_response(self, response: bytes, expected: bytes, program_byte) -> bool:
+        """Check the WriteCartFlashByte replies of a batch of programmed bytes"""
+        commands_per_byte = len(program_byte(0, 0, 0, 0)) // REPLY_SIZE
+        stride = commands_per_byte * REPLY_SIZE
+        if len(response) < stride * len(expected):
+            return False
+        
+        for i, expected_byte in enumerate(expected):
+            reply_start = i * stride + stride - REPLY_SIZE
+            _, data_byte = CartAPI_Parser.byte_write_flash(bytes(response[reply_start:reply_start + REPLY_SIZE]))
+            if data_byte != expected_byte:
+                return False
+        return True
+    
     def write_block_data(self, address: int, data: bytes) -> bool:
         """Write block data to device"""
         try:
@@ -0,0 +1,172 @@
+'''
+Sector-level planning for differential cartridge flashing.
+
+Rewriting a whole game to update a few patched bytes erases and programs every
+sector on the cartridge. Given the image currently on the cartridge and the
+image that should end up there, the planner below works out which flash
+sectors actually differ, so that only those sectors are erased and only the
+non-0xFF bytes inside them are programmed again.
+
+Erasing can be done one sector at a time or with a single chip erase. Which
+one is cheaper depends on the chip and on how much of the image is dirty, so
+plan_erase weighs both against the chip's erase timings.
+'''
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import TYPE_CHECKING, Collection, List, Optional, Tuple
+if TYPE_CHECKING:
+    from .protocol import CartFlashInfo
+
+ERASED_BYTE = 255
+_PROGRAMMABLE_RUN = re.compile(b'[^\xff]+')
+# Rough host-side cost of programming one byte over the serial link. Each byte
+# is a round of FPGA commands, which dwarfs the chip's own program time.
+HOST_BYTE_PROGRAM_S = 0.0015
+
+
+class EraseStrategy(Enum):
+    '''How the dirty part of the cartridge gets erased before programming.'''
+    NONE = 'none'
+    SECTOR = 'sector'
+    CHIP = 'chip'
+
+
+@dataclass
+class CartFlashTiming:
+    '''Typical and maximum erase and program times of a flash chip, in seconds.'''
+    sector_erase_typ_s: float
+    sector_erase_max_s: float
+    chip_erase_typ_s: float
+    chip_erase_max_s: float
+    byte_program_typ_s: float
+
+
+@dataclass
+class SectorWrite:
+    '''A flash sector that has to be erased and reprogrammed.
+
+    Attributes:
+        sector_num: Index of the sector on the flash chip.
+        start: Offset of the first byte of the sector in the ROM image.
+        end: Offset one past the last byte of the sector that belongs to the
+            ROM image (the image may end part way through a sector).
+        program_ranges: (start, end) ROM offsets of the runs inside the sector
+            that are not 0xFF and therefore need programming after the erase.
+    '''
+    sector_num: int
+    start: int
+    end: int
+    program_ranges: List[Tuple[int, int]] = field(default_factory=list)
+
+    @property
+    def program_size(self) -> int:
+        '''Number of bytes that will be programmed in this sector.'''
+        return sum(end - start for start, end in self.program_ranges)
+
+
+def sector_size_bytes(flash_info: CartFlashInfo) -> int:
+    '''Returns the erase sector size of the flash chip in bytes.'''
+    return flash_info.sector_size_kb * 1024
+
+
+def find_programmable_runs(data, base: int = 0) -> List[Tuple[int, int]]:
+    '''Returns the (start, end) offsets of every run of bytes in `data` that
+    differs from the erased state. Bytes that are already 0xFF after an erase
+    never need to be programmed.
+    '''
+    return [(base + match.start(), base + match.end()) for match in _PROGRAMMABLE_RUN.finditer(data)]
+
+
+def sectors_in_ranges(ranges: List[Tuple[int, int]], sector_size: int) -> List[int]:
+    '''Returns the sorted numbers of every sector overlapping the given
+    (start, end) byte ranges.'''
+    if sector_size <= 0:
+        raise ValueError('The sector must have a non-zero size')
+    sectors = set()
+    for start, end in ranges:
+        if start < end:
+            sectors.update(range(start // sector_size, (end - 1) // sector_size + 1))
+    return sorted(sectors)
+
+
+def plan_sector_writes(current_data: Optional[bytes], new_data: bytes, sector_size: int, erased_sectors: Collection[int] = ()) -> List[SectorWrite]:
+    '''Compares the image on the cartridge with the image to write and returns
+    the sectors that need to be erased and reprogrammed.
+
+    Args:
+        current_data: The image currently on the cartridge, or None if it is
+            unknown. Any part of the new image that is not covered by
+            `current_data` is treated as dirty.
+        new_data: The image that should be on the cartridge afterwards.
+        sector_size: The erase sector size in bytes.
+        erased_sectors: Numbers of sectors that have already been erased.
+            They are always part of the plan, since everything they held has
+            to be programmed again.
+
+    Returns:
+        The dirty sectors in ascending order. An empty list means the
+        cartridge already holds `new_data`.
+    '''
+    if sector_size <= 0:
+        raise ValueError('The sector must have a non-zero size')
+    if current_data is None:
+        current_data = b''
+    plan = []
+    for start in range(0, len(new_data), sector_size):
+        end = min(start + sector_size, len(new_data))
+        sector_data = new_data[start:end]
+        if current_data[start:end] == sector_data and start // sector_size not in erased_sectors:
+            continue
+        plan.append(SectorWrite(start // sector_size, start, end, find_programmable_runs(sector_data, start)))
+    return plan
+
+
+def plan_full_write(new_data: bytes, sector_size: int) -> List[SectorWrite]:
+    '''Returns a plan that erases and programs every sector of `new_data`.'''
+    return plan_sector_writes(None, new_data, sector_size)
+
+
+@dataclass
+class ErasePlan:
+    '''The cheapest way found to get a new image onto the cartridge.
+
+    Attributes:
+        strategy: Whether to erase nothing, the dirty sectors, or the whole chip.
+        sectors: The sectors to program. With EraseStrategy.SECTOR each of them
+            is erased first; with EraseStrategy.CHIP they are programmed after
+            the single chip erase.
+        estimated_s: The estimated time to erase and program, in seconds.
+    '''
+    strategy: EraseStrategy
+    sectors: List[SectorWrite]
+    estimated_s: float
+
+
+def estimate_program_time(sectors: List[SectorWrite], timing: CartFlashTiming, host_byte_s: float = HOST_BYTE_PROGRAM_S) -> float:
+    '''Returns the estimated time to program every non-0xFF byte of `sectors`.'''
+    return sum(sector.program_size for sector in sectors) * (timing.byte_program_typ_s + host_byte_s)
+
+
+def plan_erase(current_data: Optional[bytes], new_data: bytes, sector_size: int, timing: CartFlashTiming, allow_chip_erase: bool = True, host_byte_s: float = HOST_BYTE_PROGRAM_S, erased_sectors: Collection[int] = ()) -> ErasePlan:
+    '''Chooses between erasing the dirty sectors one by one and a single chip
+    erase, whichever is estimated to finish first.
+
+    A chip erase wipes every sector, so the clean sectors have to be programmed
+    again too, and anything stored past the end of `new_data` is lost. Callers
+    must pass allow_chip_erase=False when that data has to survive. Sectors
+    in `erased_sectors` were erased ahead of time and cost nothing to erase.
+    '''
+    dirty_sectors = plan_sector_writes(current_data, new_data, sector_size, erased_sectors)
+    if not dirty_sectors:
+        return ErasePlan(EraseStrategy.NONE, [], 0)
+    sectors_to_erase = sum(1 for sector in dirty_sectors if sector.sector_num not in erased_sectors)
+    sector_cost = sectors_to_erase * timing.sector_erase_typ_s + estimate_program_time(dirty_sectors, timing, host_byte_s)
+    plan = ErasePlan(EraseStrategy.SECTOR, dirty_sectors, sector_cost)
+    if allow_chip_erase:
+        all_sectors = plan_full_write(new_data, sector_size)
+        chip_cost = timing.chip_erase_typ_s + estimate_program_time(all_sectors, timing, host_byte_s)
+        if chip_cost < sector_cost:
+            plan = ErasePlan(EraseStrategy.CHIP, all_sectors, chip_cost)
+    return plan
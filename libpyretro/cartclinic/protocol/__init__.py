@@ -1,9 +1,9 @@
 # Source Generated with Decompyle++
 # File: __init__.pyc (Python 3.10)
 
-from cmd import CmdDetectCart, CmdLoopback, CmdReadCartByte, CmdReadPSRAMData, CmdSetFrameBufferPixel, CmdSetPSRAMAddress, CmdStartAudioPlayback, CmdStopAudioPlayback, CmdWriteCartByte, CmdWriteCartFlashByte, CmdWritePSRAMData, InvalidCmdLengthException
-from common import CartFlashChip, CartFlashInfo, CmdId, ReplyLen, ReplyPayloadLen
-from reply import ReplyDetectCart, ReplyLoopback, ReplyReadCartByte, ReplyReadPSRAMData, ReplySetFrameBufferPixel, ReplySetPSRAMAddress, ReplyStartAudioPlayback, ReplyStopAudioPlayback, ReplyWriteCartByte, ReplyWriteCartFlashByte, ReplyWritePSRAMData
+from .cmd import CmdDetectCart, CmdLoopback, CmdReadCartByte, CmdReadPSRAMData, CmdSetFrameBufferPixel, CmdSetPSRAMAddress, CmdStartAudioPlayback, CmdStopAudioPlayback, CmdWriteCartByte, CmdWriteCartFlashByte, CmdWritePSRAMData, InvalidCmdLengthException
+from .common import CartFlashChip, CartFlashInfo, CmdId, ReplyLen, ReplyPayloadLen
+from .reply import ReplyDetectCart, ReplyLoopback, ReplyReadCartByte, ReplyReadPSRAMData, ReplySetFrameBufferPixel, ReplySetPSRAMAddress, ReplyStartAudioPlayback, ReplyStopAudioPlayback, ReplyWriteCartByte, ReplyWriteCartFlashByte, ReplyWritePSRAMData
 __all__ = [
     'CartFlashChip',
     'CartFlashInfo',
@@ -2,8 +2,8 @@
 # File: cmd.pyc (Python 3.10)
 
 import struct
-from common import AudioSampleCount, CartBusAddr, CmdId, FrameBufferAddr, PixelRGB555, PSRAMAddr, PSRAMData, UnsignedByte
-from proto import FPGACmd, InvalidCmdLengthException
+from .common import AudioSampleCount, CartBusAddr, CmdId, FrameBufferAddr, PixelRGB555, PSRAMAddr, PSRAMData, UnsignedByte
+from .proto import FPGACmd, InvalidCmdLengthException
 
 class CmdLoopback(FPGACmd):
     '''
@@ -37,8 +37,6 @@ class CmdLoopback(FPGACmd):
             raise AttributeError('Cannot modify CMD_LEN')
         super().__setattr__(name, value)
 
-    __classcell__ = None
-
 
 class CmdReadCartByte(FPGACmd):
     '''
@@ -124,7 +122,7 @@ class CmdSetFrameBufferPixel(FPGACmd):
     Useful to write bitmap images to the screen.
     '''
     
-    def __init__(self, addr = None, r = None, g = None, b = ('addr', int, 'r', int, 'g', int, 'b', int)):
+    def __init__(self, addr: int, r: int, g: int, b: int):
         '''
         addr (uint15):  The frame buffer address.
                         The address is 15 bits for 160x144 pixels.
@@ -5,6 +5,7 @@ from __future__ import annotations
 import struct
 from dataclasses import dataclass, field
 from enum import IntEnum
+from typing import ClassVar, Tuple
 
 class CmdId(IntEnum):
     Loopback = 1
@@ -50,12 +51,53 @@ class ReplyPayloadLen(IntEnum):
 SCREEN_PIXEL_WIDTH = 160
 SCREEN_PIXEL_HEIGHT = 144
 SCREEN_DRAW_TIMEOUT_S = 0.2
-LimitedInteger = dataclass(<NODE:12>)
-UnsignedByte = dataclass(<NODE:12>)
-UnsignedHalfWord = dataclass(<NODE:12>)
-VariableBitWidth = dataclass(<NODE:12>)
-CartBusAddr = dataclass(<NODE:12>)
-FrameBufferAddr = dataclass(<NODE:12>)
+
+@dataclass
+class LimitedInteger:
+    '''An integer field of a command that must lie within [MIN, MAX].'''
+    value: int
+    MIN: ClassVar[int] = 0
+    MAX: ClassVar[int] = 0
+    
+    def __post_init__(self):
+        if not isinstance(self.value, int):
+            raise TypeError(f'''{self.__class__.__name__} must be an integer, got {type(self.value).__name__}''')
+        if not self.MIN <= self.value <= self.MAX:
+            raise ValueError(f'''{self.__class__.__name__} must be between {self.MIN}-{self.MAX}, got {self.value}''')
+
+
+@dataclass
+class UnsignedByte(LimitedInteger):
+    '''An 8-bit unsigned integer.'''
+    MAX: ClassVar[int] = 255
+
+
+@dataclass
+class UnsignedHalfWord(LimitedInteger):
+    '''A 16-bit unsigned integer.'''
+    MAX: ClassVar[int] = 65535
+
+
+@dataclass
+class VariableBitWidth(LimitedInteger):
+    '''An unsigned integer of BIT_WIDTH bits.'''
+    BIT_WIDTH: ClassVar[int] = 0
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.MAX = (1 << cls.BIT_WIDTH) - 1
+
+
+@dataclass
+class CartBusAddr(UnsignedHalfWord):
+    '''An address on the 16-bit cartridge bus.'''
+
+
+@dataclass
+class FrameBufferAddr(VariableBitWidth):
+    '''A 15-bit frame buffer address, decoded as (y * 160) + x.'''
+    BIT_WIDTH: ClassVar[int] = 15
+
 
 class PixelRGB888:
     '''
@@ -71,20 +113,55 @@ class PixelRGB888:
         for ch_value, name in zip(value, self.idx2name):
             if not isinstance(ch_value, int):
                 raise TypeError(f'''Color channel {name} is not an integer''')
-            if not ch_value <= ch_value or ch_value <= 255:
-                pass
-            else:
-                0
-            raise ValueError(f'''Color channel {name} must be between 0-255''')
+            if not 0 <= ch_value <= 255:
+                raise ValueError(f'''Color channel {name} must be between 0-255''')
         self.red = value[0]
         self.green = value[1]
         self.blue = value[2]
 
 
-PixelRGB555 = dataclass(<NODE:12>)
-PSRAMAddr = dataclass(<NODE:12>)
-PSRAMData = dataclass(<NODE:12>)
-AudioSampleCount = dataclass(<NODE:12>)
+
+@dataclass
+class PixelRGB555:
+    '''
+    A pixel with 5 bits per color channel, as drawn by the Chromatic screen.
+    '''
+    value: Tuple[int, int, int]
+    
+    def __post_init__(self):
+        for ch_value, name in zip(self.value, ('red', 'green', 'blue')):
+            if not isinstance(ch_value, int):
+                raise TypeError(f'''Color channel {name} is not an integer''')
+            if not 0 <= ch_value <= 31:
+                raise ValueError(f'''Color channel {name} must be between 0-31''')
+    
+    @classmethod
+    def from_rgb888(cls, color):
+        '''Converts a PixelRGB888 by dropping the low 3 bits of each channel'''
+        return cls((color.red >> 3, color.green >> 3, color.blue >> 3))
+    
+    def value_as_uint15(self):
+        '''Packs the channels as red in bits 0-4, green in 5-9 and blue in 10-14'''
+        (r, g, b) = self.value
+        return b << 10 | g << 5 | r
+
+
+@dataclass
+class PSRAMAddr(VariableBitWidth):
+    '''A 24-bit PSRAM address.'''
+    BIT_WIDTH: ClassVar[int] = 24
+
+
+@dataclass
+class PSRAMData(UnsignedHalfWord):
+    '''A 16-bit PSRAM data word.'''
+
+
+@dataclass
+class AudioSampleCount(VariableBitWidth):
+    '''A 24-bit count of audio samples.'''
+    BIT_WIDTH: ClassVar[int] = 24
+
 
 class CartFlashChip(IntEnum):
     '''An enum of existing cartridge flash chips.'''
@@ -93,7 +170,20 @@ class CartFlashChip(IntEnum):
     ISSI_IS29GL032 = 3
     Microchip_SST39VF1682 = 4
 
-CartFlashInfo = dataclass(<NODE:12>)
+
+@dataclass
+class CartFlashInfo:
+    '''Describes a cartridge flash chip and the programming modes it supports.'''
+    part_id: CartFlashChip
+    part_number: str
+    vendor: str
+    total_size_kb: int
+    sector_size_kb: int
+    grouping: str
+    recovery_offset_kb: int
+    unlock_bypass: bool = False
+    write_buffer_size: int = 0
+
 
 class ChromaticBitmap:
     '''A class describing a 160x144 bitmap to be drawn to the Chromatic screen'''
@@ -117,27 +207,38 @@ class ChromaticBitmap:
             bitmap.append(row)
         return cls(bitmap)
 
-    from_solid_color = None(from_solid_color)
+    from_solid_color = classmethod(from_solid_color)
     
     def from_bmp(cls = None, bmp_path = None):
         '''Generates a bitmap from a 24-bit bmp file'''
-        pass
-        # TODO: Implementation needed
-        raise NotImplementedError("Method not implemented")
-    from_bmp = None(from_bmp)
+        with open(bmp_path, 'rb') as f:
+            data = f.read()
+        if data[0:2] != b'BM':
+            raise ValueError(f'''{bmp_path} is not a bmp file''')
+        (pixel_offset,) = struct.unpack_from('<I', data, 10)
+        (width, height, _, bits_per_pixel, compression) = struct.unpack_from('<iiHHI', data, 18)
+        if bits_per_pixel != 24 or compression != 0:
+            raise ValueError(f'''{bmp_path} must be an uncompressed 24-bit bmp file''')
+        # Rows are padded to 4 bytes and stored bottom-up unless the height is negative
+        row_size = (width * 3 + 3) & ~3
+        bitmap = []
+        for y in range(abs(height)):
+            row_start = pixel_offset + (y if height < 0 else height - 1 - y) * row_size
+            row = []
+            for x in range(width):
+                (b, g, r) = data[row_start + x * 3:row_start + x * 3 + 3]
+                row.append(PixelRGB888((r, g, b)))
+            bitmap.append(row)
+        return cls(bitmap)
+
+    from_bmp = classmethod(from_bmp)
     
     def get_pixel(self = None, x = None, y = None):
         '''Return the pixel at coordinates (x, y)'''
-        if not x <= x or x < SCREEN_PIXEL_WIDTH:
-            pass
-        else:
-            0
-        raise IndexError(f'''X coordinate out of range: {x}''')
-        if not y <= y or y < SCREEN_PIXEL_HEIGHT:
-            pass
-        else:
-            0
-        raise IndexError(f'''Y coordinate out of range: {y}''')
+        if not 0 <= x < SCREEN_PIXEL_WIDTH:
+            raise IndexError(f'''X coordinate out of range: {x}''')
+        if not 0 <= y < SCREEN_PIXEL_HEIGHT:
+            raise IndexError(f'''Y coordinate out of range: {y}''')
         return self.bitmap[y][x]
 
 
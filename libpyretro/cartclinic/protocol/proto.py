@@ -10,15 +10,15 @@ class FPGACmd(ABC):
     The request command sent to the Chromatic FPGA.
     '''
     
+    @abstractmethod
     def __init__(self = None):
         self.fmt = ''
 
-    __init__ = None(__init__)
     
+    @abstractmethod
     def encode(self = None):
         pass
 
-    encode = None(encode)
 
 
 class FPGAReply(ABC):
@@ -26,11 +26,11 @@ class FPGAReply(ABC):
     The reply from a Chromatic in response to a transmitted request.
     '''
     
+    @abstractmethod
     def __init__(self = None):
         self.expected_id = 0
         self.fmt = ''
 
-    __init__ = None(__init__)
     
     def decode(self = None, data = None):
         if not isinstance(data, bytes):
@@ -39,7 +39,6 @@ class FPGAReply(ABC):
             raise RuntimeError(f'''Unexpected CmdId {data[0]}. Expecting {self.expected_id}''')
         return struct.unpack(self.fmt, data)
 
-    decode = None(decode)
 
 
 class InvalidCmdLengthException(Exception):
@@ -2,8 +2,8 @@
 # File: reply.pyc (Python 3.10)
 
 import typing
-from common import CmdId
-from proto import FPGAReply
+from .common import CmdId
+from .proto import FPGAReply
 
 class ReplyLoopback(FPGAReply):
     '''
@@ -18,12 +18,10 @@ class ReplyLoopback(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, b0, b1, b2) = super().decode(data)
-        return dict(cmd_id, bytes([
+        return dict(cmd_id=cmd_id, payload=bytes([
             b0,
             b1,
-            b2]), **('cmd_id', 'payload'))
-
-    __classcell__ = None
+            b2]))
 
 
 class ReplyReadCartByte(FPGAReply):
@@ -38,9 +36,7 @@ class ReplyReadCartByte(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, addr, data) = super().decode(data)
-        return dict(cmd_id, addr, data, **('cmd_id', 'addr', 'data'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, addr=addr, data=data)
 
 
 class ReplyWriteCartByte(FPGAReply):
@@ -55,9 +51,7 @@ class ReplyWriteCartByte(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, addr, data) = super().decode(data)
-        return dict(cmd_id, addr, data, **('cmd_id', 'addr', 'data'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, addr=addr, data=data)
 
 
 class ReplyWriteCartFlashByte(FPGAReply):
@@ -72,9 +66,7 @@ class ReplyWriteCartFlashByte(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, addr, data) = super().decode(data)
-        return dict(cmd_id, addr, data, **('cmd_id', 'addr', 'data'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, addr=addr, data=data)
 
 
 class ReplyDetectCart(FPGAReply):
@@ -91,9 +83,7 @@ class ReplyDetectCart(FPGAReply):
         (cmd_id, status, _, _) = super().decode(data)
         flag_inserted = status & 1 == 1
         flag_removed = status & 2 == 2
-        return dict(cmd_id, flag_inserted, flag_removed, **('cmd_id', 'inserted', 'removed'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, inserted=flag_inserted, removed=flag_removed)
 
 
 class ReplySetFrameBufferPixel(FPGAReply):
@@ -108,9 +98,7 @@ class ReplySetFrameBufferPixel(FPGAReply):
     
     def decode(self = None, data = None):
         cmd_id = super().decode(data)
-        return dict(cmd_id, **('cmd_id',))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id)
 
 
 class ReplySetPSRAMAddress(FPGAReply):
@@ -126,9 +114,7 @@ class ReplySetPSRAMAddress(FPGAReply):
     def decode(self = None, data = None):
         (cmd_id, a0, a1, a2) = super().decode(data)
         addr = a2 << 16 | a1 << 8 | a0
-        return dict(cmd_id, addr, **('cmd_id', 'addr'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, addr=addr)
 
 
 class ReplyWritePSRAMData(FPGAReply):
@@ -143,9 +129,7 @@ class ReplyWritePSRAMData(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, data) = super().decode(data)
-        return dict(cmd_id, data, **('cmd_id', 'data'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, data=data)
 
 
 class ReplyReadPSRAMData(FPGAReply):
@@ -157,9 +141,7 @@ class ReplyReadPSRAMData(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, data) = super().decode(data)
-        return dict(cmd_id, data, **('cmd_id', 'data'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, data=data)
 
 
 class ReplyStartAudioPlayback(FPGAReply):
@@ -172,9 +154,7 @@ class ReplyStartAudioPlayback(FPGAReply):
     def decode(self = None, data = None):
         (cmd_id, sc0, sc1, sc2) = super().decode(data)
         count = sc2 << 16 | sc1 << 8 | sc0
-        return dict(cmd_id, count, **('cmd_id', 'sample_count'))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id, sample_count=count)
 
 
 class ReplyStopAudioPlayback(FPGAReply):
@@ -186,7 +166,5 @@ class ReplyStopAudioPlayback(FPGAReply):
     
     def decode(self = None, data = None):
         (cmd_id, _, _, _) = super().decode(data)
-        return dict(cmd_id, **('cmd_id',))
-
-    __classcell__ = None
+        return dict(cmd_id=cmd_id)
 
@@ -1,3 +1,17 @@
 # Source Generated with Decompyle++
 # File: __init__.pyc (Python 3.10)
 
+from .base import PatchChecksumError, PatchFormat, PatchFormatError
+from .bps import BPSPatch
+from .formats import load_patch, patch_from_bytes
+from .patch import Patch
+from .ups import UPSPatch
+__all__ = [
+    'BPSPatch',
+    'Patch',
+    'PatchChecksumError',
+    'PatchFormat',
+    'PatchFormatError',
+    'UPSPatch',
+    'load_patch',
+    'patch_from_bytes']
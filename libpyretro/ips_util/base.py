@@ -0,0 +1,147 @@
+'''
+Pieces shared by the IPS, BPS and UPS patch formats: the common interface,
+their errors, and the varint, range and stream helpers they are built on.
+'''
+from __future__ import annotations
+import zlib
+from abc import ABC, abstractmethod
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class PatchFormatError(Exception):
+    '''
+    The patch data is malformed or does not fit the data it is applied to.
+    '''
+
+
+class PatchChecksumError(PatchFormatError):
+    '''
+    A CRC32 stored in the patch does not match the patch, source or target.
+    '''
+
+
+class PatchFormat(ABC):
+    '''
+    The interface every patch format implements. Patches are created with
+    create(source, target), parsed with from_bytes/from_buffer and turned back
+    into bytes with encode().
+    '''
+
+    @abstractmethod
+    def encode(self):
+        '''Returns the patch in its file format.'''
+
+    @abstractmethod
+    def output_size(self, input_size):
+        '''Returns the size of the data produced from `input_size` bytes.'''
+
+    @abstractmethod
+    def touched_ranges(self):
+        '''Returns the sorted, merged (start, end) ranges of the output that
+        may differ from the input.'''
+
+    def check_source(self, in_data):
+        '''Raises PatchFormatError if the patch cannot be applied to `in_data`.
+        Formats that record the source they were made for check it here, so
+        the check can run before anything depends on the patch applying.'''
+
+    @abstractmethod
+    def apply(self, in_data):
+        '''Returns the patched copy of `in_data` as a bytearray.'''
+
+    @abstractmethod
+    def apply_stream(self, source, target):
+        '''Patches the binary file object `source` into `target` in chunks,
+        without holding either in memory. Both must be seekable, and target
+        must be opened for reading as well as writing.'''
+
+
+def merge_ranges(ranges):
+    '''Sorts (start, end) ranges and joins the ones that overlap or touch.'''
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+            continue
+        merged.append((start, end))
+    return merged
+
+
+def as_byte_view(buffer):
+    '''Returns a flat unsigned byte memoryview of `buffer`.'''
+    view = memoryview(buffer)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def encode_varint(value):
+    '''Encodes a number the way BPS and UPS do: seven bits per byte, low bits
+    first, with the top bit marking the last byte.'''
+    encoded = bytearray()
+    while True:
+        low_bits = value & 127
+        value >>= 7
+        if value == 0:
+            encoded.append(128 | low_bits)
+            return bytes(encoded)
+        encoded.append(low_bits)
+        value -= 1
+
+
+def decode_varint(view, offset, end):
+    '''Decodes a varint at view[offset], reading no further than `end`.
+    Returns the value and the offset just past it.'''
+    value = 0
+    shift = 1
+    while True:
+        if offset >= end:
+            raise PatchFormatError('Unexpected end of patch.')
+        byte = view[offset]
+        offset += 1
+        value += (byte & 127) * shift
+        if byte & 128:
+            return (value, offset)
+        shift <<= 7
+        value += shift
+
+
+def read_checksum(view, offset):
+    '''Reads a little endian CRC32 at view[offset].'''
+    return int.from_bytes(view[offset:offset + 4], byteorder='little')
+
+
+def verify_patch_checksum(view):
+    '''Checks the CRC32 that ends BPS and UPS patches, which covers every byte
+    of the patch before it.'''
+    if len(view) < 4 or zlib.crc32(view[:-4]) != read_checksum(view, len(view) - 4):
+        raise PatchChecksumError('The patch checksum does not match, the patch is damaged.')
+
+
+def crc32_stream(stream):
+    '''Reads `stream` from its current position to the end. Returns the CRC32
+    and the number of bytes read.'''
+    crc = 0
+    size = 0
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return (crc, size)
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+
+
+def copy_stream(source, target, count, crc = 0):
+    '''Copies `count` bytes from `source` to `target` in chunks, padding with
+    zeros once the source runs out. Returns the CRC32 of the written bytes,
+    continued from `crc`.'''
+    while count > 0:
+        chunk = source.read(min(count, STREAM_CHUNK_SIZE))
+        if not chunk:
+            chunk = bytes(min(count, STREAM_CHUNK_SIZE))
+        target.write(chunk)
+        crc = zlib.crc32(chunk, crc)
+        count -= len(chunk)
+    return crc
@@ -0,0 +1,337 @@
+'''
+BPS patches.
+
+A BPS patch builds the target from actions that read from the source at the
+same offset, copy from elsewhere in the source, copy an earlier part of the
+target, or insert new bytes. Moved data therefore costs a few bytes instead of
+a full record, sizes are varints with no 16 MB limit, and CRC32s of the source,
+the target and the patch itself are part of the format.
+'''
+from __future__ import annotations
+import zlib
+from .base import PatchChecksumError, PatchFormat, PatchFormatError, STREAM_CHUNK_SIZE, as_byte_view, copy_stream, crc32_stream, decode_varint, encode_varint, merge_ranges, read_checksum, verify_patch_checksum
+
+BPS_MAGIC = b'BPS1'
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+# Source offsets indexed by create() to find data that moved, and the
+# shortest match worth a SourceCopy action instead of inserting the bytes.
+COPY_INDEX_STEP = 16
+MIN_COPY_SIZE = 32
+# Matching bytes at the same offset shorter than this are inserted instead,
+# since an action header costs as much as a few literal bytes.
+MIN_SOURCE_READ_SIZE = 4
+
+
+def _match_length(a, a_offset, b, b_offset, limit):
+    '''Returns how many bytes of a[a_offset:] and b[b_offset:] are equal, up
+    to `limit`. Compares growing blocks so long matches stay in C.'''
+    limit = min(limit, len(a) - a_offset, len(b) - b_offset)
+    length = 0
+    step = 64
+    while length < limit:
+        count = min(step, limit - length)
+        if a[a_offset + length:a_offset + length + count] == b[b_offset + length:b_offset + length + count]:
+            length += count
+            step = min(step * 2, 1048576)
+            continue
+        if count > 16:
+            step = count // 4
+            continue
+        for index in range(count):
+            if a[a_offset + length + index] != b[b_offset + length + index]:
+                return length + index
+    return length
+
+
+def _copy_within(view, source, target, length):
+    '''Copies view[source:source + length] to `target` one byte at a time in
+    effect, so an overlapping copy repeats the bytes between source and target.
+    The repeated region is copied in doubling slices.'''
+    while length > 0:
+        count = min(length, target - source)
+        view[target:target + count] = view[source:source + count]
+        target += count
+        length -= count
+
+
+class BPSPatch(PatchFormat):
+
+    def __init__(self = None, source_size = 0, target_size = 0, source_crc32 = 0, target_crc32 = 0, metadata = b''):
+        self.source_size = source_size
+        self.target_size = target_size
+        self.source_crc32 = source_crc32
+        self.target_crc32 = target_crc32
+        self.metadata = metadata
+        self.actions = []
+
+
+    def add_source_read(self = None, length = None):
+        self.actions.append({
+            'action': SOURCE_READ,
+            'length': length })
+
+
+    def add_target_read(self = None, data = None):
+        self.actions.append({
+            'action': TARGET_READ,
+            'length': len(data),
+            'data': data })
+
+
+    def add_source_copy(self = None, offset = None, length = None):
+        self.actions.append({
+            'action': SOURCE_COPY,
+            'length': length,
+            'offset': offset })
+
+
+    def add_target_copy(self = None, offset = None, length = None):
+        self.actions.append({
+            'action': TARGET_COPY,
+            'length': length,
+            'offset': offset })
+
+
+    def load(filename = None):
+        with open(filename, 'rb') as file:
+            return BPSPatch.from_bytes(file.read())
+
+    load = staticmethod(load)
+
+    def from_bytes(data = None):
+        '''Parses a BPS patch held in memory.'''
+        return BPSPatch.from_buffer(data)
+
+    from_bytes = staticmethod(from_bytes)
+
+    def from_buffer(buffer = None):
+        '''Parses a BPS patch from any object supporting the buffer protocol.
+        Inserted bytes are memoryview slices of `buffer`, not copies.'''
+        view = as_byte_view(buffer)
+        if len(view) < 16 or view[:4] != BPS_MAGIC:
+            raise PatchFormatError('Not a BPS patch file.')
+        verify_patch_checksum(view)
+        end = len(view) - 12
+        (source_size, offset) = decode_varint(view, 4, end)
+        (target_size, offset) = decode_varint(view, offset, end)
+        (metadata_size, offset) = decode_varint(view, offset, end)
+        if offset + metadata_size > end:
+            raise PatchFormatError('Unexpected end of patch.')
+        patch = BPSPatch(source_size, target_size, read_checksum(view, end), read_checksum(view, end + 4), view[offset:offset + metadata_size])
+        offset += metadata_size
+        position = 0
+        source_offset = 0
+        target_offset = 0
+        while offset < end:
+            (value, offset) = decode_varint(view, offset, end)
+            action = value & 3
+            length = (value >> 2) + 1
+            if position + length > target_size:
+                raise PatchFormatError('BPS action writes past the end of the target.')
+            if action == SOURCE_READ:
+                if position + length > source_size:
+                    raise PatchFormatError('BPS action reads past the end of the source.')
+                patch.add_source_read(length)
+            elif action == TARGET_READ:
+                if offset + length > end:
+                    raise PatchFormatError('Unexpected end of patch.')
+                patch.add_target_read(view[offset:offset + length])
+                offset += length
+            else:
+                (value, offset) = decode_varint(view, offset, end)
+                delta = -(value >> 1) if value & 1 else value >> 1
+                if action == SOURCE_COPY:
+                    source_offset += delta
+                    if source_offset < 0 or source_offset + length > source_size:
+                        raise PatchFormatError('BPS action reads past the end of the source.')
+                    patch.add_source_copy(source_offset, length)
+                    source_offset += length
+                else:
+                    target_offset += delta
+                    if target_offset < 0 or target_offset >= position:
+                        raise PatchFormatError('BPS action copies target data that is not written yet.')
+                    patch.add_target_copy(target_offset, length)
+                    target_offset += length
+            position += length
+        if position != target_size:
+            raise PatchFormatError('BPS actions do not fill the target.')
+        return patch
+
+    from_buffer = staticmethod(from_buffer)
+
+    def create(source_data = None, target_data = None, metadata = b''):
+        '''Creates the patch that turns `source_data` into `target_data`.
+        Bytes that did not move are read from the source, blocks of at least
+        MIN_COPY_SIZE bytes found elsewhere in the source are copied, and
+        everything else is inserted.'''
+        source = bytes(source_data)
+        target = bytes(target_data)
+        patch = BPSPatch(len(source), len(target), zlib.crc32(source), zlib.crc32(target), metadata)
+        index = {}
+        for offset in range(0, len(source) - COPY_INDEX_STEP + 1, COPY_INDEX_STEP):
+            index.setdefault(source[offset:offset + COPY_INDEX_STEP], offset)
+        position = 0
+        literal_start = 0
+        while position < len(target):
+            if position < len(source) and source[position] == target[position]:
+                length = _match_length(source, position, target, position, len(target) - position)
+                if length >= MIN_SOURCE_READ_SIZE:
+                    if literal_start < position:
+                        patch.add_target_read(target[literal_start:position])
+                    patch.add_source_read(length)
+                    position += length
+                    literal_start = position
+                    continue
+            offset = index.get(target[position:position + COPY_INDEX_STEP])
+            if offset is not None:
+                length = _match_length(source, offset, target, position, len(target) - position)
+                back = 0
+                while back < position - literal_start and back < offset and source[offset - back - 1] == target[position - back - 1]:
+                    back += 1
+                if length + back >= MIN_COPY_SIZE:
+                    if literal_start < position - back:
+                        patch.add_target_read(target[literal_start:position - back])
+                    patch.add_source_copy(offset - back, length + back)
+                    position += length
+                    literal_start = position
+                    continue
+            position += 1
+        if literal_start < position:
+            patch.add_target_read(target[literal_start:position])
+        return patch
+
+    create = staticmethod(create)
+
+    def encode(self = None):
+        encoded_bytes = bytearray(BPS_MAGIC)
+        encoded_bytes += encode_varint(self.source_size)
+        encoded_bytes += encode_varint(self.target_size)
+        encoded_bytes += encode_varint(len(self.metadata))
+        encoded_bytes += self.metadata
+        source_offset = 0
+        target_offset = 0
+        for action in self.actions:
+            encoded_bytes += encode_varint(action['length'] - 1 << 2 | action['action'])
+            if action['action'] == TARGET_READ:
+                encoded_bytes += action['data']
+            elif action['action'] != SOURCE_READ:
+                if action['action'] == SOURCE_COPY:
+                    delta = action['offset'] - source_offset
+                    source_offset = action['offset'] + action['length']
+                else:
+                    delta = action['offset'] - target_offset
+                    target_offset = action['offset'] + action['length']
+                encoded_bytes += encode_varint(abs(delta) << 1 | (delta < 0))
+        encoded_bytes += self.source_crc32.to_bytes(4, byteorder='little')
+        encoded_bytes += self.target_crc32.to_bytes(4, byteorder='little')
+        encoded_bytes += zlib.crc32(encoded_bytes).to_bytes(4, byteorder='little')
+        return encoded_bytes
+
+
+    def output_size(self = None, input_size = None):
+        return self.target_size
+
+
+    def touched_ranges(self = None):
+        '''Returns the ranges of the target not read from the same offset of
+        the source, plus anything past the end of the source.'''
+        ranges = []
+        position = 0
+        for action in self.actions:
+            end = position + action['length']
+            if action['action'] != SOURCE_READ and not (action['action'] == SOURCE_COPY and action['offset'] == position):
+                ranges.append((position, end))
+            position = end
+        if self.target_size > self.source_size:
+            ranges.append((self.source_size, self.target_size))
+        return merge_ranges(ranges)
+
+
+    def _check_source(self = None, size = None, crc = None):
+        if size != self.source_size or crc != self.source_crc32:
+            raise PatchChecksumError('The source does not match the one the BPS patch was made for.')
+
+
+    def check_source(self = None, in_data = None):
+        source = as_byte_view(in_data)
+        self._check_source(len(source), zlib.crc32(source))
+
+
+    def _check_target(self = None, crc = None):
+        if crc != self.target_crc32:
+            raise PatchChecksumError('The patched data does not match the BPS target checksum.')
+
+
+    def apply(self = None, in_data = None):
+        '''Returns the target as a bytearray. The source is checked against the
+        patch before anything is written, and the result afterwards.'''
+        source = as_byte_view(in_data)
+        self._check_source(len(source), zlib.crc32(source))
+        out_data = bytearray(self.target_size)
+        with memoryview(out_data) as view:
+            position = 0
+            for action in self.actions:
+                length = action['length']
+                if action['action'] == SOURCE_READ:
+                    view[position:position + length] = source[position:position + length]
+                elif action['action'] == TARGET_READ:
+                    view[position:position + length] = action['data']
+                elif action['action'] == SOURCE_COPY:
+                    view[position:position + length] = source[action['offset']:action['offset'] + length]
+                else:
+                    _copy_within(view, action['offset'], position, length)
+                position += length
+        self._check_target(zlib.crc32(out_data))
+        return out_data
+
+
+    def apply_stream(self = None, source = None, target = None):
+        '''Writes the target to the `target` file, reading the source file in
+        chunks. Target copies read back what has already been written.'''
+        source.seek(0)
+        (source_crc, source_size) = crc32_stream(source)
+        self._check_source(source_size, source_crc)
+        crc = 0
+        position = 0
+        for action in self.actions:
+            length = action['length']
+            if action['action'] == SOURCE_READ or action['action'] == SOURCE_COPY:
+                source.seek(position if action['action'] == SOURCE_READ else action['offset'])
+                crc = copy_stream(source, target, length, crc)
+            elif action['action'] == TARGET_READ:
+                target.write(action['data'])
+                crc = zlib.crc32(action['data'], crc)
+            else:
+                crc = self._target_copy_stream(target, action['offset'], position, length, crc)
+            position += length
+        target.flush()
+        self._check_target(crc)
+
+
+    def _target_copy_stream(self = None, target = None, offset = None, position = None, length = None, crc = None):
+        distance = position - offset
+        if distance < length and distance < STREAM_CHUNK_SIZE:
+            target.seek(offset)
+            pattern = target.read(distance)
+            block = pattern * (STREAM_CHUNK_SIZE // distance)
+            target.seek(position)
+            while length > 0:
+                chunk = block[:length]
+                target.write(chunk)
+                crc = zlib.crc32(chunk, crc)
+                length -= len(chunk)
+            return crc
+        while length > 0:
+            target.seek(offset)
+            chunk = target.read(min(length, STREAM_CHUNK_SIZE))
+            target.seek(position)
+            target.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+            offset += len(chunk)
+            position += len(chunk)
+            length -= len(chunk)
+        return crc
+
@@ -0,0 +1,28 @@
+'''
+Picks the patch format from the magic bytes at the start of a patch.
+'''
+from __future__ import annotations
+from .base import PatchFormatError, as_byte_view
+from .bps import BPS_MAGIC, BPSPatch
+from .patch import Patch
+from .ups import UPS_MAGIC, UPSPatch
+
+PATCH_FORMATS = {
+    b'PATCH': Patch,
+    BPS_MAGIC: BPSPatch,
+    UPS_MAGIC: UPSPatch }
+
+
+def patch_from_bytes(data = None):
+    '''Parses an IPS, BPS or UPS patch held in memory.'''
+    view = as_byte_view(data)
+    for magic, patch_format in PATCH_FORMATS.items():
+        if view[:len(magic)] == magic:
+            return patch_format.from_buffer(view)
+    raise PatchFormatError('Not an IPS, BPS or UPS patch file.')
+
+
+def load_patch(filename = None):
+    '''Loads an IPS, BPS or UPS patch file.'''
+    with open(filename, 'rb') as file:
+        return patch_from_bytes(file.read())
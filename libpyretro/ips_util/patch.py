@@ -3,30 +3,158 @@
 
 from __future__ import annotations
 import itertools
+import mmap
+import os
+import re
+from .base import PatchFormat, STREAM_CHUNK_SIZE, as_byte_view, copy_stream, merge_ranges
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EOF_ADDRESS = int.from_bytes(b'EOF', byteorder='big')
+MAX_ADDRESS = 16777215
+MAX_RECORD_SIZE = 65535
+# Below this size the pure Python diff is as fast as setting up NumPy arrays.
+VECTORIZE_MIN_SIZE = 4096
+# Changed runs up to this long are grouped in Python by Patch._add_run.
+SHORT_RUN_SIZE = 64
+
+
+def _fill(view, start, end, value):
+    '''Fills view[start:end] with a single byte value without allocating a
+    run of that length. The first byte is written directly and then copied
+    onto the rest of the run in doubling memoryview slices.'''
+    if start >= end:
+        return None
+    view[start] = value
+    filled = 1
+    length = end - start
+    while filled < length:
+        count = min(filled, length - filled)
+        view[start + filled:start + filled + count] = view[start:start + count]
+        filled += count
+
+
+class _RunGroups:
+    '''The groups of equal bytes inside one changed run data[start:end].
+    Group i spans edge(i) to edge(i + 1). The edges between the run's groups
+    are edges[low:high] of the group edges of the whole data.'''
+
+    def __init__(self, edges, start, end, low, high):
+        self.edges = edges
+        self.start = start
+        self.end = end
+        self.low = low
+        self.count = high - low + 1
+
+    def edge(self, index):
+        if index == 0:
+            return self.start
+        if index == self.count:
+            return self.end
+        return int(self.edges[self.low + index - 1])
+
+    def find_edge(self, target, first, stop):
+        '''Returns the first edge index in first..stop whose offset is at
+        least `target`, or stop + 1 if there is none.'''
+        index = int(np.searchsorted(self.edges, target, side='left')) - self.low + 1
+        if index >= self.count:
+            index = self.count if self.end >= target else self.count + 1
+        index = max(index, first)
+        return min(index, stop + 1)
+
+
+class Patch(PatchFormat):
 
-class Patch:
-    
     def load(filename = None):
+        with open(filename, 'rb') as file:
+            return Patch.from_bytes(file.read())
+
+    load = staticmethod(load)
+
+    def from_bytes(data = None):
+        '''Parses an IPS patch held in memory.'''
+        return Patch.from_buffer(data)
+
+    from_bytes = staticmethod(from_bytes)
+
+    def from_buffer(buffer = None):
+        '''Parses an IPS patch from any object supporting the buffer protocol.
+        Record payloads are memoryview slices of `buffer` rather than copies,
+        so the buffer must not change while the patch is in use.'''
+        view = as_byte_view(buffer)
+        if view[:5] != b'PATCH':
+            raise Exception('Not an IPS patch file.')
         loaded_patch = Patch()
-        # Assignment completed
-    load = None(load)
-    
+        offset = 5
+        size = len(view)
+        while True:
+            if offset + 3 > size:
+                raise Exception('Unexpected end of file.')
+            address_bytes = view[offset:offset + 3]
+            offset += 3
+            if address_bytes == b'EOF':
+                break
+            if offset + 2 > size:
+                raise Exception('Unexpected end of file.')
+            address = int.from_bytes(address_bytes, byteorder='big')
+            length = int.from_bytes(view[offset:offset + 2], byteorder='big')
+            offset += 2
+            rle_count = 0
+            if length == 0:
+                if offset + 2 > size:
+                    raise Exception('Unexpected end of file.')
+                rle_count = int.from_bytes(view[offset:offset + 2], byteorder='big')
+                offset += 2
+                length = 1
+            if offset + length > size:
+                raise Exception('Unexpected end of file.')
+            data = view[offset:offset + length]
+            offset += length
+            if rle_count > 0:
+                loaded_patch.add_rle_record(address, data, rle_count)
+            else:
+                loaded_patch.add_record(address, data)
+        if offset + 3 <= size:
+            loaded_patch.set_truncate_length(int.from_bytes(view[offset:offset + 3], byteorder='big'))
+        return loaded_patch
+
+    from_buffer = staticmethod(from_buffer)
+
     def create(original_data = None, patched_data = None):
-        patch = Patch()
-        run_in_progress = False
-        current_run_start = 0
-        current_run_data = bytearray()
-        runs = []
+        '''Creates the patch that turns `original_data` into `patched_data`.
+        Uses the NumPy diff engine when NumPy is available and the data is
+        large enough to benefit; both paths produce identical patches.'''
+        if np is not None and len(patched_data) >= VECTORIZE_MIN_SIZE:
+            return Patch._create_vectorized(original_data, patched_data)
+        return Patch._create_python(original_data, patched_data)
+
+    create = staticmethod(create)
+
+    def _prepare_create(patch = None, original_data = None, patched_data = None):
+        '''Brings `original_data` to the length of `patched_data`, recording
+        the truncation or the trailing zero that the resize implies.'''
         if len(original_data) > len(patched_data):
             patch.set_truncate_length(len(patched_data))
             original_data = original_data[:len(patched_data)]
         elif len(original_data) < len(patched_data):
-            original_data += bytes([
-                0] * (len(patched_data) - len(original_data)))
+            original_data = bytes(original_data) + bytes(len(patched_data) - len(original_data))
             if original_data[-1] == 0 and patched_data[-1] == 0:
                 patch.add_record(len(patched_data) - 1, bytes([
                     0]))
-        for original, patched in enumerate(zip(original_data, patched_data)):
+        return original_data
+
+    _prepare_create = staticmethod(_prepare_create)
+
+    def _create_python(original_data = None, patched_data = None):
+        patch = Patch()
+        run_in_progress = False
+        current_run_start = 0
+        current_run_data = bytearray()
+        runs = []
+        original_data = Patch._prepare_create(patch, original_data, patched_data)
+        for index, (original, patched) in enumerate(zip(original_data, patched_data)):
             if not run_in_progress:
                 if original != patched:
                     run_in_progress = True
@@ -42,73 +170,268 @@ class Patch:
         if run_in_progress:
             runs.append((current_run_start, current_run_data))
         for start, data in runs:
-            if start == int.from_bytes(b'EOF', 'big', **('byteorder',)):
+            if start == EOF_ADDRESS:
                 start -= 1
                 databytes = bytes([
                     patched_data[start - 1]])
                 data = bytearray(databytes + data)
-            grouped_byte_data = (lambda .0: [ {
-'val': key,
-'count': sum((lambda .0: for _ in .0:
-1)(group)),
-                    'is_last': False } for key, group in .0 ]
-)(itertools.groupby(data))
-            grouped_byte_data[-1]['is_last'] = True
-            record_in_progress = bytearray()
-            pos = start
-            for group in grouped_byte_data:
-                if len(record_in_progress) > 0:
-                    if group['count'] > 13:
-                        patch.add_record(pos, record_in_progress)
-                        pos += len(record_in_progress)
-                        record_in_progress = bytearray()
-                        patch.add_rle_record(pos, bytes([
-                            group['val']]), group['count'])
-                        pos += group['count']
-                    else:
-                        record_in_progress += bytes([
-                            group['val']] * group['count'])
-                elif group['count'] > 3 or group['is_last'] or group['count'] > 8:
-                    remaining_length = group['count']
-                    if remaining_length > 65535:
-                        patch.add_rle_record(pos, bytes([
-                            group['val']]), 65535)
-                        remaining_length -= 65535
-                        pos += 65535
-                if len(record_in_progress) > 65535:
-                    patch.add_record(pos, record_in_progress[:65535])
-                    record_in_progress = record_in_progress[65535:]
-                    pos += 65535
+            Patch._add_run(patch, start, data)
+        return patch
+
+    _create_python = staticmethod(_create_python)
+
+    def _add_run(patch = None, start = None, data = None):
+        '''Adds the records for one run of changed bytes, using RLE records
+        for repeated bytes where that makes the patch smaller.'''
+        grouped_byte_data = [{
+            'val': key,
+            'count': sum(1 for _ in group),
+            'is_last': False } for key, group in itertools.groupby(data)]
+        grouped_byte_data[-1]['is_last'] = True
+        record_in_progress = bytearray()
+        pos = start
+        for group in grouped_byte_data:
             if len(record_in_progress) > 0:
-                patch.add_record(pos, record_in_progress)
+                if group['count'] > 13:
+                    patch.add_record(pos, record_in_progress)
+                    pos += len(record_in_progress)
+                    record_in_progress = bytearray()
+                    pos = Patch._add_rle_records(patch, pos, bytes([
+                        group['val']]), group['count'])
+                else:
+                    record_in_progress += bytes([
+                        group['val']] * group['count'])
+            elif (group['count'] > 3 and group['is_last']) or group['count'] > 8:
+                pos = Patch._add_rle_records(patch, pos, bytes([
+                    group['val']]), group['count'])
+            else:
+                record_in_progress += bytes([
+                    group['val']] * group['count'])
+            if len(record_in_progress) > 65535:
+                patch.add_record(pos, record_in_progress[:65535])
+                record_in_progress = record_in_progress[65535:]
+                pos += 65535
+        if len(record_in_progress) > 0:
+            patch.add_record(pos, record_in_progress)
+
+    _add_run = staticmethod(_add_run)
+
+    def _add_rle_records(patch = None, pos = None, value = None, count = None):
+        '''Adds RLE records for `count` repeats of `value` at `pos`, split into
+        records of at most 65535 bytes. Returns the address after the run.'''
+        while count > 65535:
+            patch.add_rle_record(pos, value, 65535)
+            count -= 65535
+            pos += 65535
+        patch.add_rle_record(pos, value, count)
+        return pos + count
+
+    _add_rle_records = staticmethod(_add_rle_records)
+
+    def _add_changed_run(patch = None, source = None, start = None, end = None):
+        '''Adds the records for source[start:end] with the same RLE heuristics
+        as create, using NumPy to find the groups of long runs if it can.'''
+        if np is None or end - start <= SHORT_RUN_SIZE:
+            Patch._add_run(patch, start, source[start:end])
+            return None
+        run = np.frombuffer(source, dtype=np.uint8, count=end - start, offset=start)
+        edges = np.flatnonzero(run[1:] != run[:-1]) + (start + 1)
+        groups = _RunGroups(edges, start, end, 0, len(edges))
+        Patch._add_run_groups(patch, source, groups, np.flatnonzero(np.diff(edges) > 3).tolist())
+
+    _add_changed_run = staticmethod(_add_changed_run)
+
+    def compose(*patches, input_size = None):
+        '''Merges patches that would be applied one after another into a
+        single normalised patch: its records are sorted, do not overlap,
+        adjacent writes are coalesced and repeated bytes are RLE encoded
+        again. Applying it costs one pass over the data, and its
+        touched_ranges() are exactly the bytes that end up written.
+
+        Some sequences, such as growing the data with a record that a later
+        patch truncates away, leave bytes whose value depends on the size of
+        the input. Pass `input_size` to resolve those; without it they raise
+        ValueError.
+        '''
+        values = bytearray()
+        written = bytearray()
+        # The output size is max(input size, low) capped at high.
+        low = 0
+        high = None
+        cut = None
+        for patch in patches:
+            for record in patch.records:
+                start = record['address']
+                if 'rle_count' in record:
+                    end = start + record['rle_count']
+                    data = bytes(record['data']) * record['rle_count']
+                else:
+                    end = start + len(record['data'])
+                    data = record['data']
+                if end > len(values):
+                    values.extend(bytes(end - len(values)))
+                    written.extend(bytes(end - len(written)))
+                values[start:end] = data
+                written[start:end] = b'\x01' * (end - start)
+            grown = patch._records_end()
+            low = max(low, grown)
+            if high is not None:
+                high = max(high, grown)
+            truncate_length = patch.truncate_length
+            if truncate_length is not None and (high is None or truncate_length < high):
+                low = min(low, truncate_length)
+                high = truncate_length
+                cut = truncate_length if cut is None else min(cut, truncate_length)
+                del values[truncate_length:]
+                del written[truncate_length:]
+        size = low
+        if input_size is not None:
+            size = max(size, input_size) if high is None else min(max(size, input_size), high)
+        if len(values) < size:
+            values.extend(bytes(size - len(values)))
+            written.extend(bytes(size - len(written)))
+        # Bytes that were truncated away and then grown back are zero whatever
+        # the input was, and so are bytes past the end of a known input.
+        zero_from = cut if input_size is None else min(input_size, cut if cut is not None else input_size)
+        if zero_from is not None and zero_from < size:
+            written[zero_from:size] = b'\x01' * (size - zero_from)
+        composed = Patch()
+        source = bytes(values)
+        end = 0
+        for run in re.finditer(b'\x01+', written):
+            Patch._add_changed_run(composed, source, run.start(), run.end())
+            end = run.end()
+        if input_size is None:
+            if end != low:
+                raise ValueError('The composed patch depends on the input size. Pass input_size to compose it.')
+            if high is not None:
+                composed.set_truncate_length(high)
+        elif size < max(input_size, end):
+            composed.set_truncate_length(size)
+        return composed
+
+    compose = staticmethod(compose)
+
+    def normalized(self = None, input_size = None):
+        '''Returns an equivalent patch with sorted, non-overlapping records
+        and repeated bytes RLE encoded.'''
+        return Patch.compose(self, input_size=input_size)
+
+    def _create_vectorized(original_data = None, patched_data = None):
+        '''NumPy version of _create_python. Changed runs and the groups of
+        equal bytes inside them are found with array comparisons over the
+        whole data, so Python only loops over runs and over the groups long
+        enough to become RLE records.'''
+        patch = Patch()
+        original_data = Patch._prepare_create(patch, original_data, patched_data)
+        source = bytes(patched_data)
+        original = np.frombuffer(original_data, dtype=np.uint8)
+        patched = np.frombuffer(source, dtype=np.uint8)
+        changed = np.flatnonzero(original != patched)
+        if changed.size == 0:
+            return patch
+        breaks = np.flatnonzero(np.diff(changed) != 1)
+        run_starts = changed[np.concatenate(([0], breaks + 1))]
+        run_ends = changed[np.concatenate((breaks, [changed.size - 1]))] + 1
+        group_edges = np.flatnonzero(patched[1:] != patched[:-1]) + 1
+        long_groups = np.flatnonzero(np.diff(group_edges) > 3)
+        lows = np.searchsorted(group_edges, run_starts, side='right')
+        highs = np.searchsorted(group_edges, run_ends, side='left')
+        long_lows = np.searchsorted(long_groups, lows)
+        long_highs = np.searchsorted(long_groups, highs - 1)
+        runs = zip(run_starts.tolist(), run_ends.tolist(), lows.tolist(), highs.tolist(), long_lows.tolist(), long_highs.tolist())
+        for start, end, low, high, long_low, long_high in runs:
+            if start == EOF_ADDRESS:
+                start -= 1
+                Patch._add_run(patch, start, bytes([
+                    source[start - 1]]) + source[start + 1:end])
+            elif end - start <= SHORT_RUN_SIZE:
+                Patch._add_run(patch, start, source[start:end])
+            else:
+                groups = _RunGroups(group_edges, start, end, low, high)
+                Patch._add_run_groups(patch, source, groups, long_groups[long_low:long_high].tolist())
         return patch
 
-    create = None(create)
-    
+    _create_vectorized = staticmethod(_create_vectorized)
+
+    def _add_run_groups(patch = None, source = None, groups = None, long_inner_groups = None):
+        '''Same records as _add_run for one run, given its groups of equal
+        bytes and the global indices of its inner groups longer than three
+        bytes. Shorter groups never become RLE records, so they are appended
+        to the record in progress in bulk.'''
+        last_group = groups.count - 1
+        big_groups = [group - groups.low + 1 for group in long_inner_groups]
+        if groups.edge(1) - groups.edge(0) > 3:
+            big_groups.insert(0, 0)
+        if last_group > 0 and groups.edge(last_group + 1) - groups.edge(last_group) > 3:
+            big_groups.append(last_group)
+        pos = groups.start
+        in_record = False
+        next_group = 0
+        for group in big_groups:
+            group_start = groups.edge(group)
+            count = groups.edge(group + 1) - group_start
+            if next_group < group:
+                pos = Patch._append_groups(patch, source, groups, pos, next_group, group)
+                in_record = True
+            if in_record and count > 13:
+                patch.add_record(pos, source[pos:group_start])
+                pos = Patch._add_rle_records(patch, group_start, source[group_start:group_start + 1], count)
+                in_record = False
+            elif not in_record and ((count > 3 and group == last_group) or count > 8):
+                pos = Patch._add_rle_records(patch, pos, source[pos:pos + 1], count)
+            else:
+                pos = Patch._append_groups(patch, source, groups, pos, group, group + 1)
+                in_record = True
+            next_group = group + 1
+        if next_group <= last_group:
+            pos = Patch._append_groups(patch, source, groups, pos, next_group, last_group + 1)
+            in_record = True
+        if in_record and groups.end > pos:
+            patch.add_record(pos, source[pos:groups.end])
+
+    _add_run_groups = staticmethod(_add_run_groups)
+
+    def _append_groups(patch = None, source = None, groups = None, pos = None, first = None, stop = None):
+        '''Appends groups first..stop-1 to the record in progress starting at
+        `pos`. Like _add_run, a full 65535 byte record is split off at the end
+        of the first group that takes the record past that size. Returns the
+        new start of the record in progress.'''
+        edge = first + 1
+        while True:
+            edge = groups.find_edge(pos + 65536, edge, stop)
+            if edge > stop:
+                return pos
+            patch.add_record(pos, source[pos:pos + 65535])
+            pos += 65535
+            edge += 1
+
+    _append_groups = staticmethod(_append_groups)
+
     def __init__(self = None):
         self.records = []
         self.truncate_length = None
 
-    
+
     def add_record(self = None, address = None, data = None):
-        if address == int.from_bytes(b'EOF', 'big', **('byteorder',)):
+        if address == EOF_ADDRESS:
             raise RuntimeError(f'''Start address {address:x} is invalid in the IPS format. Please shift your starting address back by one byte to avoid it.''')
-        if address > 16777215:
+        if address > MAX_ADDRESS:
             raise RuntimeError(f'''Start address {address:x} is too large for the IPS format. Addresses must fit into 3 bytes.''')
-        if len(data) > 65535:
+        if len(data) > MAX_RECORD_SIZE:
             raise RuntimeError(f'''Record with length {len(data)} is too large for the IPS format. Records must be less than 65536 bytes.''')
         record = {
             'address': address,
             'data': data }
         self.records.append(record)
 
-    
-    def add_rle_record(self = None, address = None, data = None, count = ('address', 'int', 'data', 'bytes', 'count', 'int', 'return', 'None')):
-        if address == int.from_bytes(b'EOF', 'big', **('byteorder',)):
+
+    def add_rle_record(self = None, address = None, data = None, count = None):
+        if address == EOF_ADDRESS:
             raise RuntimeError(f'''Start address {address:x} is invalid in the IPS format. Please shift your starting address back by one byte to avoid it.''')
-        if address > 16777215:
+        if address > MAX_ADDRESS:
             raise RuntimeError(f'''Start address {address:x} is too large for the IPS format. Addresses must fit into 3 bytes.''')
-        if count > 65535:
+        if count > MAX_RECORD_SIZE:
             raise RuntimeError(f'''RLE record with length {count} is too large for the IPS format. RLE records must be less than 65536 bytes.''')
         if len(data) != 1:
             raise RuntimeError(f'''Data for RLE record must be exactly one byte! Received {data!r}.''')
@@ -118,11 +441,11 @@ class Patch:
             'rle_count': count }
         self.records.append(record)
 
-    
+
     def set_truncate_length(self = None, truncate_length = None):
         self.truncate_length = truncate_length
 
-    
+
     def trace(self = None):
         print('Start   End     Size   Data\n------  ------  -----  ----')
         for record in self.records:
@@ -140,37 +463,159 @@ class Patch:
             print(f'''Truncate to {self.truncate_length} bytes''')
             return None
 
-    
+
     def encode(self = None):
         encoded_bytes = bytearray()
         encoded_bytes += 'PATCH'.encode('ascii')
         for record in self.records:
-            encoded_bytes += record['address'].to_bytes(3, 'big', **('byteorder',))
+            encoded_bytes += record['address'].to_bytes(3, byteorder='big')
             if 'rle_count' in record:
-                encoded_bytes += 0.to_bytes(2, 'big', **('byteorder',))
-                encoded_bytes += record['rle_count'].to_bytes(2, 'big', **('byteorder',))
+                encoded_bytes += (0).to_bytes(2, byteorder='big')
+                encoded_bytes += record['rle_count'].to_bytes(2, byteorder='big')
             else:
-                encoded_bytes += len(record['data']).to_bytes(2, 'big', **('byteorder',))
+                encoded_bytes += len(record['data']).to_bytes(2, byteorder='big')
             encoded_bytes += record['data']
         encoded_bytes += 'EOF'.encode('ascii')
         if self.truncate_length is not None:
-            encoded_bytes += self.truncate_length.to_bytes(3, 'big', **('byteorder',))
+            encoded_bytes += self.truncate_length.to_bytes(3, byteorder='big')
         return encoded_bytes
 
-    
-    def apply(self = None, in_data = None):
-        out_data = bytearray(in_data)
+
+    def touched_ranges(self = None):
+        '''Returns the sorted, merged (start, end) ranges of the output that the
+        records write to, clipped to the truncate length. Known as soon as the
+        patch is decoded, before it is applied.'''
+        ranges = []
         for record in self.records:
-            if record['address'] >= len(out_data):
-                out_data += bytes([
-                    0] * ((record['address'] - len(out_data)) + 1))
-            if 'rle_count' in record:
-                out_data[record['address']:record['address'] + record['rle_count']] = b''.join([
-                    record['data']] * record['rle_count'])
-                continue
-            out_data[record['address']:record['address'] + len(record['data'])] = record['data']
+            start = record['address']
+            end = start + (record['rle_count'] if 'rle_count' in record else len(record['data']))
+            if self.truncate_length is not None:
+                end = min(end, self.truncate_length)
+            if start < end:
+                ranges.append((start, end))
+        return merge_ranges(ranges)
+
+
+    def _records_end(self = None):
+        '''Returns the size the records grow the data to, with a record of no
+        length still growing it up to its address.'''
+        end = 0
+        for record in self.records:
+            length = record['rle_count'] if 'rle_count' in record else len(record['data'])
+            end = max(end, record['address'] + max(length, 1))
+        return end
+
+
+    def output_size(self = None, input_size = None):
+        '''Returns the size of the data that applying the patch to `input_size`
+        bytes produces. Records past the end of the input grow it, and the
+        truncate length then caps the result.'''
+        size = max(input_size, self._records_end())
         if self.truncate_length is not None:
-            out_data = out_data[:self.truncate_length]
-        return out_data
+            size = min(size, self.truncate_length)
+        return size
+
+
+    def _write_records(self = None, view = None, input_size = None):
+        '''Writes every record into `view`, which already holds the input and
+        is exactly output_size(input_size) long. Returns the merged (start,
+        end) ranges that differ from the input, including any growth.'''
+        size = len(view)
+        dirty = []
+        if size > input_size:
+            dirty.append((input_size, size))
+        for record in self.records:
+            start = record['address']
+            if 'rle_count' in record:
+                end = min(start + record['rle_count'], size)
+                _fill(view, start, end, record['data'][0])
+            else:
+                end = min(start + len(record['data']), size)
+                if start < end:
+                    view[start:end] = memoryview(record['data'])[:end - start]
+            if start < end:
+                dirty.append((start, end))
+        return merge_ranges(dirty)
+
+
+    def apply_in_place(self = None, data = None):
+        '''Applies the patch directly to a bytearray, resizing it to the output
+        size first so that no intermediate copies are made.
+
+        Returns:
+            The sorted, merged (start, end) ranges of `data` that were written.
+        '''
+        input_size = len(data)
+        size = self.output_size(input_size)
+        if size < input_size:
+            del data[size:]
+        elif size > input_size:
+            data.extend(bytes(size - input_size))
+        with memoryview(data) as view:
+            return self._write_records(view, input_size)
 
 
+    def apply_to_file(self = None, path = None):
+        '''Applies the patch to a file on disk through a memory map, without
+        reading the file into memory.
+
+        Returns:
+            The sorted, merged (start, end) ranges of the file that were written.
+        '''
+        with open(path, 'r+b') as file:
+            input_size = os.fstat(file.fileno()).st_size
+            size = self.output_size(input_size)
+            if size != input_size:
+                file.truncate(size)
+            if size == 0:
+                return []
+            with mmap.mmap(file.fileno(), size) as mapped:
+                with memoryview(mapped) as view:
+                    dirty = self._write_records(view, input_size)
+                mapped.flush()
+        return dirty
+
+
+    def apply_stream(self = None, source = None, target = None):
+        '''Copies the `source` file to `target` in chunks and then writes the
+        records into it. Returns the merged (start, end) ranges written.'''
+        source.seek(0, os.SEEK_END)
+        input_size = source.tell()
+        source.seek(0)
+        size = self.output_size(input_size)
+        copy_stream(source, target, min(input_size, size))
+        copy_stream(source, target, size - input_size)
+        dirty = []
+        if size > input_size:
+            dirty.append((input_size, size))
+        for record in self.records:
+            start = record['address']
+            if 'rle_count' in record:
+                end = min(start + record['rle_count'], size)
+                target.seek(start)
+                block = bytes(record['data']) * min(end - start, STREAM_CHUNK_SIZE)
+                for offset in range(start, end, STREAM_CHUNK_SIZE):
+                    target.write(block[:end - offset])
+            else:
+                end = min(start + len(record['data']), size)
+                if start < end:
+                    target.seek(start)
+                    target.write(record['data'][:end - start])
+            if start < end:
+                dirty.append((start, end))
+        target.flush()
+        return merge_ranges(dirty)
+
+
+    def apply(self = None, in_data = None):
+        '''Returns a patched copy of `in_data`. The output is allocated once at
+        its final size and the records are written into it in place.'''
+        size = self.output_size(len(in_data))
+        out_data = bytearray(size)
+        with memoryview(in_data) as source:
+            copied = min(size, len(source))
+            out_data[:copied] = source[:copied]
+        with memoryview(out_data) as view:
+            self._write_records(view, len(in_data))
+        return out_data
+
@@ -0,0 +1,188 @@
+'''
+UPS patches.
+
+A UPS patch stores the XOR of the source and target wherever they differ, so
+the same patch turns the source into the target and the target back into the
+source. Sizes are varints with no 16 MB limit, and CRC32s of the source, the
+target and the patch itself are part of the format.
+'''
+from __future__ import annotations
+import re
+import zlib
+from .base import PatchChecksumError, PatchFormat, PatchFormatError, as_byte_view, copy_stream, crc32_stream, decode_varint, encode_varint, merge_ranges, read_checksum, verify_patch_checksum
+
+UPS_MAGIC = b'UPS1'
+_CHANGED_RUN = re.compile(b'[^\x00]+')
+_HUNK_END = re.compile(b'\x00')
+
+
+def _xor(a, b):
+    '''XORs two equally long byte strings in C.'''
+    return (int.from_bytes(a, byteorder='little') ^ int.from_bytes(b, byteorder='little')).to_bytes(len(a), byteorder='little')
+
+
+class UPSPatch(PatchFormat):
+
+    def __init__(self = None, source_size = 0, target_size = 0, source_crc32 = 0, target_crc32 = 0):
+        self.source_size = source_size
+        self.target_size = target_size
+        self.source_crc32 = source_crc32
+        self.target_crc32 = target_crc32
+        self.hunks = []
+
+
+    def add_hunk(self = None, address = None, data = None):
+        '''Adds the XOR of source and target starting at `address`. The data
+        must not contain zero bytes, which end a hunk in the format.'''
+        self.hunks.append({
+            'address': address,
+            'data': data })
+
+
+    def load(filename = None):
+        with open(filename, 'rb') as file:
+            return UPSPatch.from_bytes(file.read())
+
+    load = staticmethod(load)
+
+    def from_bytes(data = None):
+        '''Parses a UPS patch held in memory.'''
+        return UPSPatch.from_buffer(data)
+
+    from_bytes = staticmethod(from_bytes)
+
+    def from_buffer(buffer = None):
+        '''Parses a UPS patch from any object supporting the buffer protocol.
+        Hunk data are memoryview slices of `buffer`, not copies.'''
+        view = as_byte_view(buffer)
+        if len(view) < 16 or view[:4] != UPS_MAGIC:
+            raise PatchFormatError('Not a UPS patch file.')
+        verify_patch_checksum(view)
+        end = len(view) - 12
+        (source_size, offset) = decode_varint(view, 4, end)
+        (target_size, offset) = decode_varint(view, offset, end)
+        patch = UPSPatch(source_size, target_size, read_checksum(view, end), read_checksum(view, end + 4))
+        address = 0
+        while offset < end:
+            (skip, offset) = decode_varint(view, offset, end)
+            address += skip
+            match = _HUNK_END.search(view, offset, end)
+            if match is None:
+                raise PatchFormatError('Unexpected end of patch.')
+            terminator = match.start()
+            patch.add_hunk(address, view[offset:terminator])
+            address += terminator - offset + 1
+            offset = terminator + 1
+        return patch
+
+    from_buffer = staticmethod(from_buffer)
+
+    def create(source_data = None, target_data = None):
+        '''Creates the patch between `source_data` and `target_data`. The
+        shorter of the two is treated as padded with zeros.'''
+        size = max(len(source_data), len(target_data))
+        source = bytes(source_data).ljust(size, b'\x00')
+        target = bytes(target_data).ljust(size, b'\x00')
+        patch = UPSPatch(len(source_data), len(target_data), zlib.crc32(source_data), zlib.crc32(target_data))
+        xor_data = _xor(source, target)
+        for run in _CHANGED_RUN.finditer(xor_data):
+            patch.add_hunk(run.start(), xor_data[run.start():run.end()])
+        return patch
+
+    create = staticmethod(create)
+
+    def encode(self = None):
+        encoded_bytes = bytearray(UPS_MAGIC)
+        encoded_bytes += encode_varint(self.source_size)
+        encoded_bytes += encode_varint(self.target_size)
+        address = 0
+        for hunk in self.hunks:
+            encoded_bytes += encode_varint(hunk['address'] - address)
+            encoded_bytes += hunk['data']
+            encoded_bytes += b'\x00'
+            address = hunk['address'] + len(hunk['data']) + 1
+        encoded_bytes += self.source_crc32.to_bytes(4, byteorder='little')
+        encoded_bytes += self.target_crc32.to_bytes(4, byteorder='little')
+        encoded_bytes += zlib.crc32(encoded_bytes).to_bytes(4, byteorder='little')
+        return encoded_bytes
+
+
+    def output_size(self = None, input_size = None):
+        '''UPS patches apply both ways, so the target of the source is
+        returned unless `input_size` is the size of the target.'''
+        if input_size == self.target_size and input_size != self.source_size:
+            return self.source_size
+        return self.target_size
+
+
+    def touched_ranges(self = None):
+        '''Returns the target ranges the hunks change, plus anything past the
+        end of the source.'''
+        ranges = []
+        for hunk in self.hunks:
+            end = min(hunk['address'] + len(hunk['data']), self.target_size)
+            if hunk['address'] < end:
+                ranges.append((hunk['address'], end))
+        if self.target_size > self.source_size:
+            ranges.append((self.source_size, self.target_size))
+        return merge_ranges(ranges)
+
+
+    def _direction(self = None, size = None, crc = None):
+        '''Returns the output size and CRC32 for input of the given size and
+        CRC32, working out whether the patch is applied or reverted.'''
+        if size == self.source_size and crc == self.source_crc32:
+            return (self.target_size, self.target_crc32)
+        if size == self.target_size and crc == self.target_crc32:
+            return (self.source_size, self.source_crc32)
+        raise PatchChecksumError('The data does not match either side of the UPS patch.')
+
+
+    def check_source(self = None, in_data = None):
+        source = as_byte_view(in_data)
+        self._direction(len(source), zlib.crc32(source))
+
+
+    def apply(self = None, in_data = None):
+        '''Returns the target for the source, or the source for the target.
+        The input is checked against the patch before anything is written,
+        and the result afterwards.'''
+        source = as_byte_view(in_data)
+        (size, expected_crc) = self._direction(len(source), zlib.crc32(source))
+        out_data = bytearray(size)
+        copied = min(size, len(source))
+        out_data[:copied] = source[:copied]
+        for hunk in self.hunks:
+            start = hunk['address']
+            end = min(start + len(hunk['data']), size)
+            if start < end:
+                out_data[start:end] = _xor(out_data[start:end], hunk['data'][:end - start])
+        if zlib.crc32(out_data) != expected_crc:
+            raise PatchChecksumError('The patched data does not match the UPS checksum.')
+        return out_data
+
+
+    def apply_stream(self = None, source = None, target = None):
+        '''Writes the patched `source` file to `target`, XORing the hunks in as
+        the source is read through once more in chunks.'''
+        source.seek(0)
+        (source_crc, source_size) = crc32_stream(source)
+        (size, expected_crc) = self._direction(source_size, source_crc)
+        source.seek(0)
+        crc = 0
+        position = 0
+        for hunk in self.hunks:
+            if hunk['address'] >= size:
+                break
+            crc = copy_stream(source, target, hunk['address'] - position, crc)
+            length = min(len(hunk['data']), size - hunk['address'])
+            chunk = source.read(length).ljust(length, b'\x00')
+            chunk = _xor(chunk, hunk['data'][:length])
+            target.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+            position = hunk['address'] + length
+        crc = copy_stream(source, target, size - position, crc)
+        target.flush()
+        if crc != expected_crc:
+            raise PatchChecksumError('The patched data does not match the UPS checksum.')
+
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for IPS patches.
+Times patch creation and application on ROM-sized data against the
+original pure Python algorithms.
+
+Run with: python tests/benchmark_ips_patch.py
+"""
+
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from libpyretro.ips_util.patch import Patch, np
+
+ROM_SIZE = 8 * 1024 * 1024
+REPEAT = 5
+
+
+def legacy_apply(patch, in_data):
+    """The original apply: copies the input, grows it record by record and
+    builds every RLE run as a new bytes object before copying it in."""
+    out_data = bytearray(in_data)
+    for record in patch.records:
+        if record['address'] >= len(out_data):
+            out_data += bytes([0] * ((record['address'] - len(out_data)) + 1))
+        if 'rle_count' in record:
+            out_data[record['address']:record['address'] + record['rle_count']] = b''.join([record['data']] * record['rle_count'])
+            continue
+        out_data[record['address']:record['address'] + len(record['data'])] = record['data']
+    if patch.truncate_length is not None:
+        out_data = out_data[:patch.truncate_length]
+    return out_data
+
+
+def make_rom(rng, size):
+    """Builds ROM-like data: random code with long runs of padding"""
+    rom = bytearray(rng.randbytes(size))
+    for _ in range(size // 65536):
+        start = rng.randrange(size)
+        length = rng.randint(256, 16384)
+        rom[start:start + length] = b'\xff' * length
+    return bytes(rom[:size])
+
+
+def make_patch(rng, size):
+    """Builds a large translation-style patch with plain and RLE records that
+    also grows the ROM"""
+    patch = Patch()
+    for _ in range(4000):
+        address = rng.randrange(size)
+        if rng.random() < 0.4:
+            patch.add_rle_record(address, bytes([rng.randrange(256)]), rng.randint(1024, 65535))
+        else:
+            patch.add_record(address, rng.randbytes(rng.randint(16, 2048)))
+    patch.add_rle_record(size + 1024 * 1024, b'\xff', 65535)
+    return patch
+
+
+def make_patched_rom(rng, rom):
+    """Applies translation-style edits: new text, fills and moved code"""
+    patched = bytearray(rom)
+    for _ in range(2000):
+        start = rng.randrange(len(rom))
+        if rng.random() < 0.5:
+            patched[start:start + 512] = rng.randbytes(512)
+        else:
+            patched[start:start + 4096] = bytes([rng.randrange(256)]) * 4096
+    return bytes(patched[:len(rom)]) + rng.randbytes(64 * 1024)
+
+
+def bench(label, func):
+    best = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f'{label:<40} {best * 1000:>10.1f} ms')
+    return best
+
+
+def main():
+    rng = random.Random(2024)
+    rom = make_rom(rng, ROM_SIZE)
+    patch = make_patch(rng, ROM_SIZE)
+    assert patch.apply(rom) == legacy_apply(patch, rom)
+    print(f'ROM {ROM_SIZE // 1024} KB, {len(patch.records)} records')
+    legacy = bench('apply (original)', lambda: legacy_apply(patch, rom))
+    current = bench('apply (preallocated)', lambda: patch.apply(rom))
+    buffer = bytearray(rom)
+    in_place = bench('apply_in_place', lambda: patch.apply_in_place(buffer))
+    print(f'speedup: apply {legacy / current:.1f}x, apply_in_place {legacy / in_place:.1f}x')
+
+    patched = make_patched_rom(rng, rom)
+    python = bench('create (pure Python)', lambda: Patch._create_python(rom, patched))
+    if np is None:
+        print('NumPy is not installed, skipping the vectorized create')
+        return None
+    assert Patch._create_vectorized(rom, patched).encode() == Patch._create_python(rom, patched).encode()
+    vectorized = bench('create (NumPy)', lambda: Patch._create_vectorized(rom, patched))
+    print(f'speedup: create {python / vectorized:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
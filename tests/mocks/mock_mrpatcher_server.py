@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MRPatcher service.
+Runs an HTTP/1.1 server on a free localhost port in a background thread and
+records every request it receives, so tests can check what the client sent.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+@dataclass
+class ReceivedRequest:
+    """A request received by the mock service"""
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+    client_port: int
+    # time.monotonic() when the request line arrived, before the body
+    started_at: float = 0.0
+
+
+@dataclass
+class MockMRPatcherConfig:
+    """Configuration for mock service behavior"""
+    # Accept-Encoding advertised on every reply, or None to advertise nothing
+    accept_encoding: Optional[str] = None
+    # Status codes returned, in order, before the service answers normally
+    fail_statuses: List[int] = field(default_factory=list)
+    # Whether compressed uploads are refused with 415
+    refuse_encoded: bool = False
+    # Whether the service answers hash lookups, like newer services do
+    hash_lookup: bool = False
+    # Status an older service answers hash lookups with
+    lookup_status: int = 404
+    # sha256 hex digests of the ROMs the service has seen
+    known_hashes: Set[str] = field(default_factory=set)
+    response: Dict = field(default_factory=lambda: {'game_title': 'MOCK GAME', 'needs_update': False})
+
+
+class _MockMRPatcherHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _record(self, body=b'', started_at=0.0):
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'zstd':
+            body = zstandard.ZstdDecompressor().decompress(body)
+        request = ReceivedRequest(self.command, self.path, dict(self.headers), body, self.client_address[1], started_at)
+        self.server.mock.requests.append(request)
+        return request
+
+    def _reply(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        config = self.server.mock.config
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        if config.accept_encoding is not None:
+            self.send_header('Accept-Encoding', config.accept_encoding)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._record()
+        self._reply(200, {'status': 'ok'})
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                return bytes(body)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def do_POST(self):
+        started_at = time.monotonic()
+        raw_body = self._read_body()
+        config = self.server.mock.config
+        if config.refuse_encoded and self.headers.get('Content-Encoding'):
+            self.server.mock.requests.append(ReceivedRequest(self.command, self.path, dict(self.headers), raw_body, self.client_address[1]))
+            self._reply(415, {'error': 'Unsupported encoding'})
+            return
+        request = self._record(raw_body, started_at)
+        if config.fail_statuses:
+            self._reply(config.fail_statuses.pop(0), {'error': 'Try again'})
+            return
+        if self.path.endswith('/lookup'):
+            if not config.hash_lookup:
+                self._reply(config.lookup_status, {'error': 'Not found'})
+            elif self.headers.get('X-MR-ROM-SHA256') in config.known_hashes:
+                self._reply(200, self.server.mock.handle(request), {'X-MR-Hash-Lookup': '1'})
+            else:
+                self._reply(404, {'error': 'Unknown ROM'}, {'X-MR-Hash-Lookup': '1'})
+            return
+        if not self.path.endswith('/game_id'):
+            config.known_hashes.add(hashlib.sha256(request.body).hexdigest())
+        self._reply(200, self.server.mock.handle(request))
+
+
+class MockMRPatcherServer:
+    """Mock MRPatcher service on localhost"""
+
+    def __init__(self, config: Optional[MockMRPatcherConfig] = None):
+        self.config = config or MockMRPatcherConfig()
+        self.requests: List[ReceivedRequest] = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _MockMRPatcherHandler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}/patch'
+
+    def handle(self, request: ReceivedRequest) -> Dict:
+        """Return the JSON reply to a POST"""
+        return self.config.response
+
+    def posts(self) -> List[ReceivedRequest]:
+        return [request for request in self.requests if request.method == 'POST']
+
+    def uploads(self) -> List[ReceivedRequest]:
+        """Return the POSTs that carried a full ROM"""
+        return [request for request in self.posts() if request.path == '/patch']
+
+    def lookups(self) -> List[ReceivedRequest]:
+        return [request for request in self.posts() if request.path == '/patch/lookup']
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
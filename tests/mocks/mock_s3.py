@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for the S3 firmware bucket.
+Implements the S3Wrapper methods used by firmware downloads, including
+ranged and conditional downloads and connections that drop mid-transfer,
+and records the calls it receives, so tests can check how the client
+used it.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# Key the firmware manifest is stored under, as in S3Wrapper
+MANIFEST_KEY = 'apps/manifest.yaml'
+
+
+class MockS3Error(Exception):
+    """Error raised for a missing or failing object"""
+    pass
+
+
+class MockStreamingBody:
+    """Body of an object being downloaded, like botocore's StreamingBody"""
+
+    def __init__(self, s3: 'MockS3Wrapper', data: bytes, drop_after: Optional[int] = None):
+        self._s3 = s3
+        self._data = data
+        # Bytes sent before the connection drops, or None to send everything
+        self._drop_after = drop_after
+        self.closed = False
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        sent = 0
+        for offset in range(0, len(self._data), chunk_size):
+            chunk = self._data[offset:offset + chunk_size]
+            if self._drop_after is not None and sent + len(chunk) > self._drop_after:
+                chunk = chunk[:self._drop_after - sent]
+            with self._s3._lock:
+                self._s3.bytes_sent += len(chunk)
+            if chunk:
+                yield chunk
+            sent += len(chunk)
+            if sent == self._drop_after:
+                raise MockS3Error("Connection reset")
+
+    def read(self) -> bytes:
+        return b''.join(self.iter_chunks())
+
+    def close(self):
+        self.closed = True
+
+
+class MockS3Wrapper:
+    """Mock S3Wrapper serving objects from memory"""
+
+    def __init__(self, objects: Optional[Dict[str, bytes]] = None, delay: float = 0.0):
+        self.objects: Dict[str, bytes] = dict(objects or {})
+        # Seconds each transfer takes, to make overlapping downloads visible
+        self.delay = delay
+        # Keys whose transfers fail
+        self.fail_keys: Set[str] = set()
+        self.calls: List[str] = []
+        # (key, start, end) of every ranged download
+        self.ranges: List[Tuple[str, int, int]] = []
+        # For each key, bytes sent by its next transfers before they drop
+        self.drop_after: Dict[str, List[int]] = {}
+        # ETag sent with every manifest read, None for unconditional reads
+        self.manifest_etags: List[Optional[str]] = []
+        # Bytes of object content handed to the client
+        self.bytes_sent = 0
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._lock = threading.Lock()
+
+    def _begin(self, key: str) -> bytes:
+        with self._lock:
+            self.calls.append(key)
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            time.sleep(self.delay)
+            if key in self.fail_keys:
+                raise MockS3Error(f"Transfer of {key} failed")
+            if key not in self.objects:
+                raise MockS3Error(f"No such key: {key}")
+            return self.objects[key]
+        finally:
+            with self._lock:
+                self._concurrent -= 1
+
+    def etag(self, key: str) -> str:
+        return '"' + hashlib.md5(self.objects[key]).hexdigest() + '"'
+
+    def open_file(self, key: str, start: Optional[int] = None, end: Optional[int] = None,
+                  etag: Optional[str] = None) -> 'MockStreamingBody':
+        data = self._begin(key)
+        if etag is not None and etag != self.etag(key):
+            raise MockS3Error("Precondition failed")
+        if start is not None or end is not None:
+            start = start or 0
+            end = len(data) if end is None else end
+            with self._lock:
+                self.ranges.append((key, start, end))
+            data = data[start:end]
+        with self._lock:
+            drops = self.drop_after.get(key)
+            drop_after = drops.pop(0) if drops else None
+        return MockStreamingBody(self, data, drop_after)
+
+    def read_manifest(self, etag: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+        data = self._begin(MANIFEST_KEY)
+        with self._lock:
+            self.manifest_etags.append(etag)
+        current_etag = self.etag(MANIFEST_KEY)
+        if etag is not None and etag == current_etag:
+            return None, etag
+        return data.decode('utf-8'), current_etag
+
+    def read_file(self, key: str) -> str:
+        return self._begin(key).decode('utf-8')
+
+    def get_file_metadata(self, key: str) -> Dict:
+        if key not in self.objects:
+            raise MockS3Error(f"No such key: {key}")
+        return {'ContentLength': len(self.objects[key]), 'ETag': self.etag(key)}
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the content-addressed firmware blob store.
+Tests blob paths, checking stored blobs against their digest, and
+removing blobs no version uses.
+"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.blob_store import BlobStore
+from flashing_tool.digest_index import DigestIndex
+
+
+class TestBlobStore(unittest.TestCase):
+    """Test BlobStore"""
+
+    def setUp(self):
+        """Set up a store with a digest index in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+        self.store = BlobStore(self.cache_dir / 'blobs',
+                               digest_index=DigestIndex(self.cache_dir / 'digests.json'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def add_blob(self, data):
+        """Store data under its digest and return the digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        self.store.prepare(digest).write_bytes(data)
+        return digest
+
+    def test_path(self):
+        """Test that blobs are fanned out by the first two digits of their digest"""
+        digest = 'AB' + 'c' * 62
+        path = self.store.path(digest)
+
+        self.assertEqual(path, self.cache_dir / 'blobs' / 'ab' / digest.lower())
+        self.assertFalse(path.parent.exists())
+        self.assertEqual(self.store.prepare(digest), path)
+        self.assertTrue(path.parent.is_dir())
+
+    def test_has(self):
+        """Test that only an intact blob of the right size is reported as stored"""
+        data = os.urandom(4096)
+        digest = self.add_blob(data)
+
+        self.assertTrue(self.store.has(digest))
+        self.assertTrue(self.store.has(digest.upper(), size=len(data)))
+        self.assertFalse(self.store.has(digest, size=len(data) + 1))
+        self.assertFalse(self.store.has(hashlib.sha256(b'other').hexdigest()))
+
+    def test_corrupt_blob(self):
+        """Test that a blob whose contents no longer match its digest is not used"""
+        digest = self.add_blob(os.urandom(4096))
+        self.store.path(digest).write_bytes(os.urandom(4096))
+
+        self.assertFalse(self.store.has(digest))
+
+    def test_collect_garbage(self):
+        """Test that unreferenced blobs are removed and partial downloads are kept"""
+        kept = self.add_blob(b'fpga bitstream')
+        dropped = self.add_blob(b'old mcu firmware')
+        partial = self.store.prepare('ff' * 32).with_name('ff' * 32 + '.part')
+        partial.write_bytes(b'partial')
+
+        removed = self.store.collect_garbage([self.store.path(kept)])
+
+        self.assertEqual(removed, [self.store.path(dropped)])
+        self.assertTrue(self.store.path(kept).exists())
+        self.assertFalse(self.store.path(dropped).exists())
+        self.assertTrue(partial.exists())
+
+    def test_collect_garbage_without_store(self):
+        """Test that collecting garbage before anything was stored does nothing"""
+        self.assertEqual(self.store.collect_garbage([]), [])
+
+    def test_size(self):
+        """Test blob sizes"""
+        digest = self.add_blob(b'x' * 100)
+
+        self.assertEqual(self.store.size(self.store.path(digest)), 100)
+        self.assertEqual(self.store.size(self.store.path('00' * 32)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
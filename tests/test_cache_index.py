@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the firmware cache index.
+Tests the running total size, least recently used eviction within the
+budget, protected versions and persistence.
+"""
+
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.cache_index import FirmwareCacheIndex
+
+MB = 1024 * 1024
+
+
+class TestFirmwareCacheIndex(unittest.TestCase):
+    """Test FirmwareCacheIndex"""
+
+    def setUp(self):
+        """Set up an index path in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_path = Path(self.temp_dir.name) / 'cache_index.json'
+        self.now = 1000.0
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def add_versions(self, index, *versions, size=10 * MB):
+        """Add versions one second apart, oldest first"""
+        for version_str in versions:
+            self.now += 1
+            with patch('flashing_tool.cache_index.time.time', return_value=self.now):
+                index.add(version_str, size)
+
+    def test_total_size(self):
+        """Test that the total size follows adds, resizes and removals"""
+        index = FirmwareCacheIndex(self.index_path)
+        self.add_versions(index, '1.0.0', '1.1.0')
+        self.assertEqual(index.total_size, 20 * MB)
+
+        index.add('1.1.0', 4 * MB)
+        self.assertEqual(index.total_size, 14 * MB)
+
+        index.remove('1.0.0')
+        index.remove('missing')
+        self.assertEqual(index.total_size, 4 * MB)
+
+    def test_total_size_does_not_touch_disk(self):
+        """Test that reading the size does not stat or open anything"""
+        index = FirmwareCacheIndex(self.index_path)
+        self.add_versions(index, '1.0.0')
+
+        with patch('builtins.open') as opened, patch('os.stat') as stat:
+            self.assertEqual(index.total_size, 10 * MB)
+        opened.assert_not_called()
+        stat.assert_not_called()
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest versions are evicted until within budget"""
+        index = FirmwareCacheIndex(self.index_path, budget_bytes=25 * MB)
+        self.add_versions(index, '1.0.0', '1.1.0', '1.2.0', '1.3.0')
+
+        self.assertEqual(index.select_evictions(), ['1.0.0', '1.1.0'])
+
+    def test_touch_refreshes_last_use(self):
+        """Test that a used version is evicted after unused ones"""
+        index = FirmwareCacheIndex(self.index_path, budget_bytes=25 * MB)
+        self.add_versions(index, '1.0.0', '1.1.0', '1.2.0')
+        self.now += 1
+        with patch('flashing_tool.cache_index.time.time', return_value=self.now):
+            index.touch('1.0.0')
+
+        self.assertEqual(index.select_evictions(), ['1.1.0'])
+
+    def test_protected_versions_are_kept(self):
+        """Test that installed, latest and rollback versions are never evicted"""
+        index = FirmwareCacheIndex(self.index_path, budget_bytes=5 * MB)
+        self.add_versions(index, '1.0.0', '1.1.0', '1.2.0', '1.3.0')
+        index.set_installed('1.0.0')
+
+        self.assertEqual(index.select_evictions(protected=['1.3.0', '1.1.0', None]), ['1.2.0'])
+
+    def test_within_budget(self):
+        """Test that nothing is evicted within the budget"""
+        index = FirmwareCacheIndex(self.index_path, budget_bytes=30 * MB)
+        self.add_versions(index, '1.0.0', '1.1.0', '1.2.0')
+
+        self.assertEqual(index.select_evictions(), [])
+
+    def test_persistence(self):
+        """Test that a new index reads back the versions and installed version"""
+        index = FirmwareCacheIndex(self.index_path)
+        self.assertFalse(index.loaded)
+        self.add_versions(index, '1.0.0', '1.1.0')
+        index.set_installed('1.1.0')
+
+        reloaded = FirmwareCacheIndex(self.index_path)
+        self.assertTrue(reloaded.loaded)
+        self.assertEqual(reloaded.total_size, 20 * MB)
+        self.assertEqual(reloaded.versions(), ['1.0.0', '1.1.0'])
+        self.assertEqual(reloaded.installed_version, '1.1.0')
+
+    def test_rebuild_and_clear(self):
+        """Test that a rebuild replaces the entries and clear keeps the installed version"""
+        index = FirmwareCacheIndex(self.index_path)
+        self.add_versions(index, '1.0.0')
+        index.set_installed('1.0.0')
+
+        index.rebuild({'2.0.0': 3 * MB, '2.1.0': 4 * MB})
+        self.assertEqual(index.total_size, 7 * MB)
+        self.assertEqual(set(index.versions()), {'2.0.0', '2.1.0'})
+
+        index.clear()
+        self.assertEqual(index.total_size, 0)
+        self.assertEqual(FirmwareCacheIndex(self.index_path).installed_version, '1.0.0')
+
+    def test_unreadable_index(self):
+        """Test that a corrupt index is ignored"""
+        self.index_path.write_text('{not json')
+
+        index = FirmwareCacheIndex(self.index_path)
+        self.assertFalse(index.loaded)
+        self.assertEqual(index.total_size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
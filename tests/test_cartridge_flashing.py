@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Unit tests for differential cartridge flashing.
+Tests sector planning against the image already on the cartridge and the
+choice between chip and sector erase.
+"""
+
+import unittest
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from libpyretro.cartclinic.flash_plan import CartFlashTiming, EraseStrategy, find_programmable_runs, plan_erase, plan_full_write, plan_sector_writes, sectors_in_ranges
+
+SECTOR_SIZE = 64 * 1024
+SLOW_CHIP_ERASE = CartFlashTiming(sector_erase_typ_s=0.5, sector_erase_max_s=5, chip_erase_typ_s=32, chip_erase_max_s=160, byte_program_typ_s=8e-06)
+FAST_CHIP_ERASE = CartFlashTiming(sector_erase_typ_s=0.018, sector_erase_max_s=0.025, chip_erase_typ_s=0.04, chip_erase_max_s=0.05, byte_program_typ_s=7e-06)
+
+
+class TestSectorPlanning(unittest.TestCase):
+    """Test planning of sector erases and programming"""
+    
+    def setUp(self):
+        """Set up a 256KB test image"""
+        self.current = bytes(range(256)) * (4 * SECTOR_SIZE // 256)
+        
+    def test_identical_image_needs_no_writes(self):
+        """Test that an unchanged image produces an empty plan"""
+        self.assertEqual(plan_sector_writes(self.current, bytearray(self.current), SECTOR_SIZE), [])
+        
+    def test_single_patched_byte_dirties_one_sector(self):
+        """Test that a small patch only touches the sector it lands in"""
+        patched = bytearray(self.current)
+        patched[SECTOR_SIZE * 2 + 100] ^= 0x5A
+        
+        plan = plan_sector_writes(self.current, patched, SECTOR_SIZE)
+        
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0].sector_num, 2)
+        self.assertEqual(plan[0].start, SECTOR_SIZE * 2)
+        self.assertEqual(plan[0].end, SECTOR_SIZE * 3)
+        
+    def test_erased_bytes_are_not_programmed(self):
+        """Test that 0xFF bytes are skipped after the erase"""
+        patched = bytearray(self.current)
+        patched[0:SECTOR_SIZE] = b'\xff' * SECTOR_SIZE
+        patched[16:20] = b'\x01\x02\x03\x04'
+        patched[40] = 0
+        
+        plan = plan_sector_writes(self.current, patched, SECTOR_SIZE)
+        
+        self.assertEqual(plan[0].program_ranges, [(16, 20), (40, 41)])
+        self.assertEqual(plan[0].program_size, 5)
+        
+    def test_growing_image_dirties_uncovered_sectors(self):
+        """Test that data past the end of the known image is always written"""
+        patched = self.current + b'\x00' * SECTOR_SIZE
+        
+        plan = plan_sector_writes(self.current, patched, SECTOR_SIZE)
+        
+        self.assertEqual([sector.sector_num for sector in plan], [4])
+        
+    def test_partial_last_sector(self):
+        """Test that the last sector ends with the image"""
+        plan = plan_full_write(b'\x00' * (SECTOR_SIZE + 10), SECTOR_SIZE)
+        
+        self.assertEqual([(sector.start, sector.end) for sector in plan], [(0, SECTOR_SIZE), (SECTOR_SIZE, SECTOR_SIZE + 10)])
+        
+    def test_programmable_runs(self):
+        """Test finding runs that differ from the erased state"""
+        self.assertEqual(find_programmable_runs(b'\xff\x00\x00\xff\xff\x10', 100), [(101, 103), (105, 106)])
+        self.assertEqual(find_programmable_runs(b'\xff' * 8), [])
+        
+    def test_pre_erased_sectors_are_reprogrammed(self):
+        """Test that sectors erased ahead of time are programmed even if unchanged"""
+        plan = plan_sector_writes(self.current, bytearray(self.current), SECTOR_SIZE, erased_sectors=[1])
+        
+        self.assertEqual([sector.sector_num for sector in plan], [1])
+        self.assertEqual(plan[0].program_ranges, find_programmable_runs(self.current[SECTOR_SIZE:2 * SECTOR_SIZE], SECTOR_SIZE))
+        
+    def test_sectors_in_ranges(self):
+        """Test mapping patched byte ranges onto sectors"""
+        ranges = [(10, 20), (SECTOR_SIZE - 1, SECTOR_SIZE + 1), (3 * SECTOR_SIZE, 3 * SECTOR_SIZE), (5 * SECTOR_SIZE, 6 * SECTOR_SIZE)]
+        
+        self.assertEqual(sectors_in_ranges(ranges, SECTOR_SIZE), [0, 1, 5])
+        
+    def test_invalid_sector_size(self):
+        """Test that a zero sector size is rejected"""
+        with self.assertRaises(ValueError):
+            plan_sector_writes(b'', b'\x00', 0)
+
+
+
+class TestEraseStrategy(unittest.TestCase):
+    """Test choosing between chip erase and sector erase"""
+    
+    def setUp(self):
+        """Set up a 1MB test image that is mostly erased padding"""
+        self.current = bytearray(b'\xff' * (16 * SECTOR_SIZE))
+        self.current[0:SECTOR_SIZE] = b'\x00' * SECTOR_SIZE
+        
+    def test_unchanged_image_needs_no_erase(self):
+        """Test that nothing is erased when the image is unchanged"""
+        plan = plan_erase(self.current, bytes(self.current), SECTOR_SIZE, SLOW_CHIP_ERASE)
+        
+        self.assertEqual(plan.strategy, EraseStrategy.NONE)
+        self.assertEqual(plan.sectors, [])
+        
+    def test_small_patch_uses_sector_erase(self):
+        """Test that a small patch erases only its sectors"""
+        patched = bytearray(self.current)
+        patched[5 * SECTOR_SIZE + 10] = 0x42
+        
+        plan = plan_erase(self.current, patched, SECTOR_SIZE, SLOW_CHIP_ERASE)
+        
+        self.assertEqual(plan.strategy, EraseStrategy.SECTOR)
+        self.assertEqual([sector.sector_num for sector in plan.sectors], [5])
+        
+    def test_full_reflash_uses_chip_erase(self):
+        """Test that rewriting every sector prefers a fast chip erase"""
+        new_image = bytes(range(1, 256)) * (16 * SECTOR_SIZE // 255)
+        
+        plan = plan_erase(self.current, new_image, SECTOR_SIZE, FAST_CHIP_ERASE, host_byte_s=0)
+        
+        self.assertEqual(plan.strategy, EraseStrategy.CHIP)
+        self.assertEqual(len(plan.sectors), len(plan_full_write(new_image, SECTOR_SIZE)))
+        
+    def test_chip_erase_can_be_disallowed(self):
+        """Test that data past the image can be protected from a chip erase"""
+        new_image = bytes(range(1, 256)) * (16 * SECTOR_SIZE // 255)
+        
+        plan = plan_erase(self.current, new_image, SECTOR_SIZE, FAST_CHIP_ERASE, allow_chip_erase=False, host_byte_s=0)
+        
+        self.assertEqual(plan.strategy, EraseStrategy.SECTOR)
+
+
+if __name__ == '__main__':
+    unittest.main()
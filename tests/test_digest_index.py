@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the digest index of cached firmware files.
+Tests that unchanged files are not hashed again, and that changed files
+and audits are.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.digest_index import DigestIndex
+
+
+class TestDigestIndex(unittest.TestCase):
+    """Test DigestIndex"""
+
+    def setUp(self):
+        """Set up a firmware file and an index in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+        self.firmware = os.urandom(256 * 1024)
+        self.file_path = self.cache_dir / 'mcu_firmware.bin'
+        self.file_path.write_bytes(self.firmware)
+        self.index_path = self.cache_dir / 'digests.json'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def hash_calls(self, index, count=1):
+        """Return how many times the file was hashed over `count` lookups"""
+        with patch('flashing_tool.digest_index._hash_files', wraps=lambda paths: [hashlib.sha256(Path(path).read_bytes()).hexdigest() for path in paths]) as hash_file:
+            digests = {index.sha256(self.file_path) for _ in range(count)}
+        self.assertEqual(digests, {hashlib.sha256(self.file_path.read_bytes()).hexdigest()})
+        return hash_file.call_count
+
+    def test_unchanged_file_is_hashed_once(self):
+        """Test that repeated validations of an unchanged file hash it once"""
+        self.assertEqual(self.hash_calls(DigestIndex(self.index_path), count=5), 1)
+        self.assertEqual(self.hash_calls(DigestIndex(self.index_path)), 0)
+
+    def test_recorded_digest_is_used(self):
+        """Test that a digest recorded after a download avoids hashing"""
+        DigestIndex(self.index_path).record(self.file_path, hashlib.sha256(self.firmware).hexdigest())
+
+        self.assertEqual(self.hash_calls(DigestIndex(self.index_path)), 0)
+
+    def test_changed_file_is_hashed_again(self):
+        """Test that a file with a new mtime or size is hashed again"""
+        index = DigestIndex(self.index_path)
+        self.hash_calls(index)
+
+        stat = self.file_path.stat()
+        os.utime(self.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertEqual(self.hash_calls(index), 1)
+
+        with open(self.file_path, 'ab') as f:
+            f.write(b'\x00')
+        self.assertEqual(self.hash_calls(index), 1)
+
+    def test_replaced_file_is_hashed_again(self):
+        """Test that a file replaced by another inode is hashed again"""
+        index = DigestIndex(self.index_path)
+        self.hash_calls(index)
+
+        stat = self.file_path.stat()
+        replacement = self.cache_dir / 'replacement.bin'
+        replacement.write_bytes(os.urandom(len(self.firmware)))
+        os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(replacement, self.file_path)
+        self.assertEqual(self.hash_calls(index), 1)
+
+    def test_periodic_audit(self):
+        """Test that an old digest is verified again after the audit interval"""
+        index = DigestIndex(self.index_path, audit_interval_s=60)
+        self.hash_calls(index)
+
+        with patch('flashing_tool.digest_index.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.hash_calls(index), 1)
+            self.assertEqual(self.hash_calls(index), 0)
+
+    def test_forget(self):
+        """Test that a forgotten file is hashed again"""
+        index = DigestIndex(self.index_path)
+        self.hash_calls(index)
+        index.forget(self.file_path)
+
+        self.assertEqual(self.hash_calls(DigestIndex(self.index_path)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
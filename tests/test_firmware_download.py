@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Unit tests for firmware package downloads.
+Tests that package files are fetched concurrently with combined progress,
+and that failures are handled per file, against an in-memory S3 bucket.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.digest_index import DigestIndex
+from flashing_tool.firmware_download import (
+    BandwidthLimiter, DeltaSource, DownloadJob, FirmwareDownloader, FirmwareDownloadCancelled, FirmwareDownloadError
+)
+from libpyretro.ips_util import BPSPatch
+from tests.mocks.mock_s3 import MockS3Wrapper
+
+
+MCU_FIRMWARE = os.urandom(300 * 1024)
+FPGA_BITSTREAM = os.urandom(200 * 1024)
+
+
+class TestFirmwareDownloader(unittest.TestCase):
+    """Test FirmwareDownloader"""
+
+    def setUp(self):
+        """Set up a bucket holding one firmware package and a cache directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+        self.s3 = MockS3Wrapper({
+            'fw/mcu.bin': MCU_FIRMWARE,
+            'fw/fpga.fs': FPGA_BITSTREAM,
+            'fw/changelog.md': b'Fixed things',
+            'fw/release_notes.md': b'New things',
+        }, delay=0.2)
+
+        retry_delay = patch('flashing_tool.firmware_download.DOWNLOAD_RETRY_DELAY_S', 0)
+        retry_delay.start()
+        self.addCleanup(retry_delay.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def package_jobs(self):
+        """Return the jobs for the package in the bucket"""
+        return [
+            DownloadJob('MCU firmware', 'fw/mcu.bin', self.cache_dir / 'mcu_firmware.bin',
+                        hashlib.sha256(MCU_FIRMWARE).hexdigest(), len(MCU_FIRMWARE)),
+            DownloadJob('FPGA bitstream', 'fw/fpga.fs', self.cache_dir / 'fpga_bitstream.fs',
+                        hashlib.sha256(FPGA_BITSTREAM).hexdigest(), len(FPGA_BITSTREAM)),
+            DownloadJob('changelog', 'fw/changelog.md', required=False),
+            DownloadJob('release notes', 'fw/release_notes.md', required=False),
+        ]
+
+    def test_files_download_concurrently(self):
+        """Test that all files of a package are fetched at the same time"""
+        results = FirmwareDownloader(self.s3).download(self.package_jobs())
+
+        self.assertEqual(self.s3.max_concurrent, 4)
+        self.assertEqual(Path(results['MCU firmware']).read_bytes(), MCU_FIRMWARE)
+        self.assertEqual(Path(results['FPGA bitstream']).read_bytes(), FPGA_BITSTREAM)
+        self.assertEqual(results['changelog'], 'Fixed things')
+        self.assertEqual(results['release notes'], 'New things')
+
+    def test_worker_limit(self):
+        """Test that no more files than the pool size are fetched at once"""
+        FirmwareDownloader(self.s3, workers=2).download(self.package_jobs())
+
+        self.assertEqual(self.s3.max_concurrent, 2)
+
+    def test_combined_byte_progress(self):
+        """Test that progress counts the bytes of all files together"""
+        updates = []
+        FirmwareDownloader(self.s3).download(
+            self.package_jobs(), byte_progress_callback=lambda done, total: updates.append((done, total)))
+
+        total = len(MCU_FIRMWARE) + len(FPGA_BITSTREAM)
+        self.assertEqual(updates[-1], (total, total))
+        self.assertEqual([done for (done, _) in updates], sorted(done for (done, _) in updates))
+
+    def test_optional_file_failure(self):
+        """Test that a missing changelog does not fail the download"""
+        self.s3.fail_keys.add('fw/changelog.md')
+        results = FirmwareDownloader(self.s3).download(self.package_jobs())
+
+        self.assertIsNone(results['changelog'])
+        self.assertTrue(Path(results['MCU firmware']).exists())
+
+    def test_required_file_failure_cleans_up(self):
+        """Test that a failed bitstream removes the MCU firmware already stored"""
+        self.s3.fail_keys.add('fw/fpga.fs')
+        with self.assertRaises(FirmwareDownloadError):
+            FirmwareDownloader(self.s3).download(self.package_jobs())
+
+        self.assertFalse((self.cache_dir / 'mcu_firmware.bin').exists())
+        self.assertFalse((self.cache_dir / 'fpga_bitstream.fs').exists())
+
+    def test_checksum_mismatch(self):
+        """Test that a corrupted file fails the download"""
+        self.s3.objects['fw/mcu.bin'] = bytes([MCU_FIRMWARE[0] ^ 0xff]) + MCU_FIRMWARE[1:]
+        with self.assertRaises(FirmwareDownloadError):
+            FirmwareDownloader(self.s3).download(self.package_jobs())
+
+        self.assertEqual(list(self.cache_dir.iterdir()), [])
+
+
+    def test_streams_into_cache_directory(self):
+        """Test that files are written next to their final path and never read back"""
+        with patch('builtins.open', wraps=open) as opened:
+            FirmwareDownloader(self.s3).download(self.package_jobs())
+
+        written = {Path(call.args[0]).parent for call in opened.call_args_list if call.args[1:] == ('r+b',)}
+        self.assertEqual(written, {self.cache_dir})
+        self.assertFalse([call for call in opened.call_args_list if call.args[1:] == ('rb',)])
+        self.assertEqual(sorted(path.name for path in self.cache_dir.iterdir()),
+                         ['fpga_bitstream.fs', 'mcu_firmware.bin'])
+
+    def test_digests_are_recorded(self):
+        """Test that downloaded files need no hashing to validate afterwards"""
+        digest_index = DigestIndex(self.cache_dir / 'digests.json')
+        FirmwareDownloader(self.s3, digest_index=digest_index).download(self.package_jobs())
+
+        with patch('flashing_tool.digest_index._hash_files') as hash_file:
+            self.assertEqual(digest_index.sha256(self.cache_dir / 'mcu_firmware.bin'),
+                             hashlib.sha256(MCU_FIRMWARE).hexdigest())
+        hash_file.assert_not_called()
+
+    def test_oversized_file_stops_early(self):
+        """Test that a file bigger than the manifest says is abandoned mid-transfer"""
+        self.s3.objects['fw/mcu.bin'] = MCU_FIRMWARE * 8
+        with self.assertRaises(FirmwareDownloadError):
+            FirmwareDownloader(self.s3).download(self.package_jobs()[:1])
+
+        self.assertLess(self.s3.bytes_sent, len(MCU_FIRMWARE) * 2)
+        self.assertEqual(list(self.cache_dir.iterdir()), [])
+
+
+
+class TestResumableDownload(unittest.TestCase):
+    """Test resuming and splitting downloads of large files"""
+
+    def setUp(self):
+        """Set up a bucket holding one large MCU image and a cache directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+        self.image = os.urandom(3 * 1024 * 1024)
+        self.s3 = MockS3Wrapper({'fw/mcu.bin': self.image})
+        self.job = DownloadJob('MCU firmware', 'fw/mcu.bin', self.cache_dir / 'mcu_firmware.bin',
+                               hashlib.sha256(self.image).hexdigest(), len(self.image))
+        retry_delay = patch('flashing_tool.firmware_download.DOWNLOAD_RETRY_DELAY_S', 0)
+        retry_delay.start()
+        self.addCleanup(retry_delay.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def downloader(self, segments=1):
+        """Return a downloader splitting files into up to `segments` ranges"""
+        return FirmwareDownloader(self.s3, segments=segments, min_segment_size=512 * 1024)
+
+    def test_dropped_transfer_resumes(self):
+        """Test that a dropped connection continues from the last byte received"""
+        self.s3.drop_after['fw/mcu.bin'] = [1024 * 1024, 1024 * 1024]
+        self.downloader().download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertEqual(self.s3.bytes_sent, len(self.image))
+        self.assertEqual([start for (_, start, _) in self.s3.ranges], [0, 1024 * 1024, 2 * 1024 * 1024])
+
+    def test_failed_download_resumes_later(self):
+        """Test that a download that gave up is continued by the next attempt"""
+        self.s3.drop_after['fw/mcu.bin'] = [256 * 1024] * 4
+        with self.assertRaises(FirmwareDownloadError):
+            self.downloader().download([self.job])
+        self.assertTrue((self.cache_dir / 'mcu_firmware.bin.part').exists())
+
+        updates = []
+        self.downloader().download([self.job], byte_progress_callback=lambda done, total: updates.append(done))
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertEqual(self.s3.bytes_sent, len(self.image))
+        self.assertEqual(updates[0], 1024 * 1024)
+        self.assertEqual(sorted(path.name for path in self.cache_dir.iterdir()), ['mcu_firmware.bin'])
+
+    def test_changed_object_restarts(self):
+        """Test that a partial download of an object that changed is thrown away"""
+        self.s3.drop_after['fw/mcu.bin'] = [256 * 1024] * 4
+        with self.assertRaises(FirmwareDownloadError):
+            self.downloader().download([self.job])
+
+        self.image = os.urandom(len(self.image))
+        self.s3.objects['fw/mcu.bin'] = self.image
+        self.job.expected_checksum = hashlib.sha256(self.image).hexdigest()
+        self.downloader().download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertEqual(self.s3.ranges[-1], ('fw/mcu.bin', 0, len(self.image)))
+
+    def test_corrupt_part_is_discarded(self):
+        """Test that a resumed file failing its checksum is downloaded again"""
+        self.s3.drop_after['fw/mcu.bin'] = [256 * 1024] * 4
+        with self.assertRaises(FirmwareDownloadError):
+            self.downloader().download([self.job])
+        with open(self.cache_dir / 'mcu_firmware.bin.part', 'r+b') as f:
+            f.write(b'corrupt')
+
+        with self.assertRaises(FirmwareDownloadError):
+            self.downloader().download([self.job])
+        self.downloader().download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+
+    def test_large_file_downloads_in_segments(self):
+        """Test that a large file is fetched as several ranges at once"""
+        self.s3.delay = 0.2
+        self.downloader(segments=4).download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertEqual(len(self.s3.ranges), 4)
+        self.assertEqual(self.s3.max_concurrent, 4)
+        self.assertEqual(self.s3.bytes_sent, len(self.image))
+
+    def test_segments_resume_independently(self):
+        """Test that each range of a split download resumes on its own"""
+        self.s3.drop_after['fw/mcu.bin'] = [100 * 1024] * 3
+        self.downloader(segments=3).download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertEqual(self.s3.bytes_sent, len(self.image))
+
+    def test_cancelled_download_resumes(self):
+        """Test that a cancelled download keeps its progress for the next attempt"""
+        cancel_event = threading.Event()
+
+        def cancel_after_first_megabyte(done, total):
+            if done >= 1024 * 1024:
+                cancel_event.set()
+
+        with self.assertRaises(FirmwareDownloadCancelled):
+            self.downloader().download([self.job], byte_progress_callback=cancel_after_first_megabyte,
+                                       cancel_event=cancel_event)
+        self.assertFalse(self.job.local_path.exists())
+        self.assertTrue((self.cache_dir / 'mcu_firmware.bin.part').exists())
+
+        self.downloader().download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertLess(self.s3.bytes_sent, 2 * len(self.image))
+
+    def test_bandwidth_limit(self):
+        """Test that a limited download takes as long as the limit requires"""
+        started = time.monotonic()
+        self.downloader(segments=3).download([self.job], bandwidth_limit=len(self.image) * 4)
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.image)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_limiter_paces_chunks(self):
+        """Test that chunks are given consecutive slots of the limit"""
+        with patch('flashing_tool.firmware_download.time.monotonic', return_value=100.0):
+            limiter = BandwidthLimiter(1000)
+            self.assertAlmostEqual(limiter.delay(500), 0.5)
+            self.assertAlmostEqual(limiter.delay(500), 1.0)
+        with patch('flashing_tool.firmware_download.time.monotonic', return_value=105.0):
+            self.assertAlmostEqual(limiter.delay(250), 0.25)
+
+
+class TestDeltaDownload(unittest.TestCase):
+    """Test building firmware files from deltas to cached versions"""
+
+    def setUp(self):
+        """Set up a cached old MCU image and a bucket with a new one and its delta"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+        self.old_image = os.urandom(512 * 1024)
+        new_image = bytearray(self.old_image)
+        new_image[4096:8192] = os.urandom(4096)
+        self.new_image = bytes(new_image) + os.urandom(1024)
+        self.base_path = self.cache_dir / 'old' / 'mcu_firmware.bin'
+        self.base_path.parent.mkdir()
+        self.base_path.write_bytes(self.old_image)
+
+        delta = bytes(BPSPatch.create(self.old_image, self.new_image).encode())
+        self.s3 = MockS3Wrapper({'fw/new/mcu.bin': self.new_image, 'fw/new/mcu.bps': delta})
+        self.job = DownloadJob('MCU firmware', 'fw/new/mcu.bin', self.cache_dir / 'mcu_firmware.bin',
+                               hashlib.sha256(self.new_image).hexdigest(), len(self.new_image),
+                               delta=DeltaSource('fw/new/mcu.bps', self.base_path, len(delta)))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_delta_is_applied(self):
+        """Test that only the delta is downloaded when a cached base exists"""
+        updates = []
+        FirmwareDownloader(self.s3).download([self.job], byte_progress_callback=lambda done, total: updates.append((done, total)))
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.new_image)
+        self.assertEqual(self.s3.calls, ['fw/new/mcu.bps'])
+        self.assertLess(self.s3.bytes_sent, len(self.new_image) // 10)
+        self.assertEqual(updates[-1], (len(self.new_image), len(self.new_image)))
+
+    def test_changed_base_falls_back(self):
+        """Test that a delta that does not fit the cached file is replaced by a full download"""
+        self.base_path.write_bytes(os.urandom(len(self.old_image)))
+        FirmwareDownloader(self.s3).download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.new_image)
+        self.assertIn('fw/new/mcu.bin', self.s3.calls)
+
+    def test_wrong_result_falls_back(self):
+        """Test that a result failing the manifest checksum is never stored"""
+        self.new_image = os.urandom(len(self.new_image))
+        self.s3.objects['fw/new/mcu.bin'] = self.new_image
+        self.job.expected_checksum = hashlib.sha256(self.new_image).hexdigest()
+        FirmwareDownloader(self.s3).download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.new_image)
+
+    def test_missing_delta_falls_back(self):
+        """Test that a delta missing from the bucket is replaced by a full download"""
+        del self.s3.objects['fw/new/mcu.bps']
+        FirmwareDownloader(self.s3).download([self.job])
+
+        self.assertEqual(self.job.local_path.read_bytes(), self.new_image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the firmware manager's caching.
+Tests revalidating the cached manifest with its ETag, reusing stored blobs,
+keeping the cache within its budget and finding the Cart Clinic bitstream,
+against an in-memory S3 bucket.
+"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+from unittest.mock import patch
+
+import yaml
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tests.mocks.mock_s3 import MANIFEST_KEY, MockS3Error, MockS3Wrapper
+
+
+@dataclass
+class StubFirmwareVersion:
+    """Stand-in for the device firmware version"""
+    mcu_version: str
+    fpga_version: str
+
+
+def stub_module(name, **attributes):
+    """Create a module holding the given attributes"""
+    module = ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+# The firmware manager imports platformdirs and boto3 through these modules,
+# and a version detector, so stand in for them while it is imported
+STUB_MODULES = {
+    'flashing_tool.constants': stub_module('flashing_tool.constants', APP_DATA_DIR=tempfile.gettempdir()),
+    'flashing_tool.version_detector': stub_module('flashing_tool.version_detector',
+                                                  FirmwareVersion=StubFirmwareVersion),
+    'flashing_tool.s3_wrapper': stub_module('flashing_tool.s3_wrapper', S3Wrapper=MockS3Wrapper,
+                                            S3WrapperError=MockS3Error),
+}
+saved_modules = {name: sys.modules.get(name) for name in [*STUB_MODULES, 'flashing_tool.firmware_manager']}
+sys.modules.update(STUB_MODULES)
+try:
+    from flashing_tool import firmware_manager
+finally:
+    for name, module in saved_modules.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+
+FirmwareManager = firmware_manager.FirmwareManager
+
+
+def firmware_entry(version_str, mcu, fpga):
+    """Return the manifest entry of a firmware version"""
+    return {
+        'version': version_str,
+        'mcu_binary': f'fw/{version_str}/mcu.bin',
+        'fpga_bitstream': f'fw/{version_str}/fpga.fs',
+        'checksum_mcu': hashlib.sha256(mcu).hexdigest(),
+        'checksum_fpga': hashlib.sha256(fpga).hexdigest(),
+        'file_size_mcu': len(mcu),
+        'file_size_fpga': len(fpga),
+    }
+
+
+class FirmwareManagerTestCase(unittest.TestCase):
+    """Firmware manager with its cache in a temporary directory"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        app_data_dir = patch.object(firmware_manager, 'APP_DATA_DIR', self.temp_dir.name)
+        app_data_dir.start()
+        self.addCleanup(app_data_dir.stop)
+        self.s3 = MockS3Wrapper()
+        self.firmware = {}
+
+    def add_firmware(self, version_str, mcu, fpga):
+        """Put a firmware version in the bucket"""
+        self.s3.objects[f'fw/{version_str}/mcu.bin'] = mcu
+        self.s3.objects[f'fw/{version_str}/fpga.fs'] = fpga
+        self.firmware[version_str] = firmware_entry(version_str, mcu, fpga)
+
+    def publish_manifest(self, latest_version):
+        """Put a manifest listing every firmware version in the bucket"""
+        manifest = {'latest_version': latest_version, 'firmware': list(self.firmware.values())}
+        self.s3.objects[MANIFEST_KEY] = yaml.safe_dump(manifest).encode('utf-8')
+
+    def create_manager(self, **kwargs):
+        """Create a firmware manager using the bucket"""
+        return FirmwareManager(s3_wrapper=self.s3, **kwargs)
+
+
+class TestManifestRevalidation(FirmwareManagerTestCase):
+    """Test revalidating the cached manifest with its ETag"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_firmware('1.0', b'mcu 1.0', b'fpga 1.0')
+        self.publish_manifest('1.0')
+
+    def test_unchanged_manifest_is_not_parsed_again(self):
+        """Test that a 304 reply reuses the cached manifest"""
+        manager = self.create_manager(manifest_ttl_s=0)
+        first = manager.get_firmware_manifest()
+
+        with patch.object(manager, '_parse_manifest', wraps=manager._parse_manifest) as parse:
+            second = manager.get_firmware_manifest()
+
+        self.assertEqual(self.s3.manifest_etags, [None, self.s3.etag(MANIFEST_KEY)])
+        parse.assert_not_called()
+        self.assertEqual(second, first)
+
+    def test_changed_manifest_is_downloaded(self):
+        """Test that a manifest with a new ETag is parsed and cached"""
+        manager = self.create_manager(manifest_ttl_s=0)
+        manager.get_firmware_manifest()
+        first_etag = self.s3.etag(MANIFEST_KEY)
+        self.add_firmware('1.1', b'mcu 1.1', b'fpga 1.1')
+        self.publish_manifest('1.1')
+
+        manifest = manager.get_firmware_manifest()
+
+        self.assertEqual(self.s3.manifest_etags, [None, first_etag])
+        self.assertEqual(manifest.latest_version, '1.1')
+        self.assertEqual(manager.manifest_cache.load().etag, self.s3.etag(MANIFEST_KEY))
+
+    def test_fresh_manifest_skips_s3(self):
+        """Test that S3 is not asked within the TTL"""
+        manager = self.create_manager()
+        manager.get_firmware_manifest()
+        manager.get_firmware_manifest()
+
+        self.assertEqual(self.s3.manifest_etags, [None])
+
+
+class TestBlobReuse(FirmwareManagerTestCase):
+    """Test that files an earlier version stored are not downloaded again"""
+
+    def setUp(self):
+        super().setUp()
+        self.fpga = os.urandom(64 * 1024)
+        self.add_firmware('1.0', os.urandom(32 * 1024), self.fpga)
+        self.add_firmware('1.1', os.urandom(32 * 1024), self.fpga)
+        self.publish_manifest('1.1')
+
+    def download(self, manager, version_str):
+        """Download a firmware version listed in the manifest"""
+        return manager.download_firmware(manager.get_firmware_info(version_str))
+
+    def test_stored_blob_is_not_downloaded(self):
+        """Test that an unchanged FPGA bitstream is taken from the blob store"""
+        manager = self.create_manager()
+        first = self.download(manager, '1.0')
+        second = self.download(manager, '1.1')
+
+        self.assertNotIn('fw/1.1/fpga.fs', self.s3.calls)
+        self.assertIn('fw/1.1/mcu.bin', self.s3.calls)
+        self.assertEqual(second.fpga_bitstream_path, first.fpga_bitstream_path)
+        self.assertTrue(manager.validate_firmware_package(second))
+
+    def test_shared_blob_is_counted_once(self):
+        """Test that the cache size counts a shared blob once"""
+        manager = self.create_manager()
+        packages = [self.download(manager, '1.0'), self.download(manager, '1.1')]
+
+        files = {path for package in packages
+                 for path in (package.mcu_binary_path, package.fpga_bitstream_path)}
+        metadata = [manager.firmware_cache_dir / package.version / 'package.json' for package in packages]
+        expected_size = sum(os.path.getsize(path) for path in [*files, *metadata])
+        self.assertEqual(manager.get_cache_size(), expected_size)
+
+
+
+class TestCacheBudget(FirmwareManagerTestCase):
+    """Test evicting versions that share blobs to keep within the budget"""
+
+    def setUp(self):
+        super().setUp()
+        self.fpga = os.urandom(256 * 1024)
+        for version_str in ('1.0', '1.1', '1.2'):
+            self.add_firmware(version_str, os.urandom(32 * 1024), self.fpga)
+        self.publish_manifest('1.2')
+        self.manager = self.create_manager()
+        self.packages = {}
+        for version_str in ('1.0', '1.1', '1.2'):
+            firmware_info = self.manager.get_firmware_info(version_str)
+            self.packages[version_str] = self.manager.download_firmware(firmware_info)
+        # Room for one version on its own, but not for two sharing the bitstream
+        self.manager.cache_index.budget_bytes = 300 * 1024
+
+    def cache_bytes_on_disk(self):
+        """Return the bytes the cached versions take up on disk"""
+        files = set()
+        for version_str in self.manager.list_cached_versions():
+            package = self.packages[version_str]
+            files.update([package.mcu_binary_path, package.fpga_bitstream_path,
+                          self.manager.firmware_cache_dir / version_str / 'package.json'])
+        return sum(os.path.getsize(path) for path in files)
+
+    def test_eviction_continues_past_shared_blobs(self):
+        """Test that eviction goes on when a shared blob frees less than its share"""
+        evicted = self.manager.enforce_cache_budget()
+
+        self.assertEqual(evicted, ['1.0', '1.1'])
+        self.assertEqual(self.manager.list_cached_versions(), ['1.2'])
+        self.assertTrue(os.path.exists(self.packages['1.2'].fpga_bitstream_path))
+        self.assertFalse(os.path.exists(self.packages['1.0'].mcu_binary_path))
+        self.assertEqual(self.manager.get_cache_size(), self.cache_bytes_on_disk())
+        self.assertLessEqual(self.manager.get_cache_size(), self.manager.cache_index.budget_bytes)
+
+    def test_installed_version_is_kept(self):
+        """Test that the installed and latest versions are never evicted"""
+        self.manager.mark_installed('1.0')
+        evicted = self.manager.enforce_cache_budget()
+
+        self.assertEqual(evicted, ['1.1'])
+        self.assertEqual(self.manager.list_cached_versions(), ['1.0', '1.2'])
+        self.assertTrue(os.path.exists(self.packages['1.0'].fpga_bitstream_path))
+        self.assertEqual(self.manager.get_cache_size(), self.cache_bytes_on_disk())
+
+
+
+class TestCartClinicBitstream(FirmwareManagerTestCase):
+    """Test choosing between the cached and the bundled Cart Clinic bitstream"""
+
+    def setUp(self):
+        super().setUp()
+        self.bitstream = os.urandom(16 * 1024)
+        self.s3.objects['cart_clinic/io0_rev.bin'] = self.bitstream
+        self.add_firmware('1.0', b'mcu 1.0', b'fpga 1.0')
+        manifest = {
+            'latest_version': '1.0',
+            'firmware': list(self.firmware.values()),
+            'cart_clinic': {
+                'fpga_bitstream': 'cart_clinic/io0_rev.bin',
+                'checksum_fpga': hashlib.sha256(self.bitstream).hexdigest(),
+                'file_size_fpga': len(self.bitstream),
+            },
+        }
+        self.s3.objects[MANIFEST_KEY] = yaml.safe_dump(manifest).encode('utf-8')
+        self.bundled_path = os.path.join(self.temp_dir.name, 'cart_clinic_io0_rev.bin')
+
+    def test_bundled_bitstream_without_download(self):
+        """Test that the bundled bitstream is used until one is downloaded"""
+        manager = self.create_manager()
+        manager.get_firmware_manifest()
+
+        self.assertEqual(manager.get_cart_clinic_bitstream_path(self.bundled_path), self.bundled_path)
+
+    def test_cached_bitstream_after_download(self):
+        """Test that a downloaded bitstream matching the manifest is used"""
+        manager = self.create_manager()
+        cached_path = manager.download_cart_clinic_bitstream(manager.get_firmware_manifest().cart_clinic)
+
+        self.assertEqual(manager.get_cart_clinic_bitstream_path(self.bundled_path), cached_path)
+        with open(cached_path, 'rb') as f:
+            self.assertEqual(f.read(), self.bitstream)
+
+    def test_corrupt_cached_bitstream_is_not_used(self):
+        """Test that the bundled bitstream is used if the cached one is damaged"""
+        manager = self.create_manager()
+        cached_path = manager.download_cart_clinic_bitstream(manager.get_firmware_manifest().cart_clinic)
+        with open(cached_path, 'r+b') as f:
+            f.write(b'\x00' * 16)
+
+        self.assertEqual(manager.get_cart_clinic_bitstream_path(self.bundled_path), self.bundled_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
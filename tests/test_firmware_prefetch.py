@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the background firmware prefetch.
+Tests what is prefetched, the bandwidth limit it downloads with, and
+cancelling it, against a stand-in firmware manager.
+"""
+
+import threading
+import unittest
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.firmware_download import FirmwareDownloadCancelled
+from flashing_tool.firmware_prefetch import FirmwarePrefetcher
+
+
+class StubFirmwareManager:
+    """Firmware manager recording the downloads asked of it"""
+
+    def __init__(self, manifest, cached_versions=()):
+        self.manifest = manifest
+        self.cached_versions = list(cached_versions)
+        self.downloads = []
+        self.download_started = threading.Event()
+        self.block_download = False
+
+    def get_firmware_manifest(self):
+        return self.manifest
+
+    def get_firmware_info(self, version_str, manifest):
+        return SimpleNamespace(version=manifest.latest_version)
+
+    def list_cached_versions(self):
+        return self.cached_versions
+
+    def download_firmware(self, firmware_info, cancel_event=None, bandwidth_limit=None):
+        self.downloads.append((firmware_info.version, bandwidth_limit))
+        self.download_started.set()
+        if self.block_download:
+            cancel_event.wait(5)
+            raise FirmwareDownloadCancelled("Download cancelled")
+
+    def download_cart_clinic_bitstream(self, bitstream_info, cancel_event=None, bandwidth_limit=None):
+        self.downloads.append((bitstream_info, bandwidth_limit))
+
+
+class TestFirmwarePrefetcher(unittest.TestCase):
+    """Test FirmwarePrefetcher"""
+
+    def manifest(self, cart_clinic='cart_clinic_bitstream'):
+        """Return a manifest whose latest version is 1.2.0"""
+        return SimpleNamespace(latest_version='1.2.0', cart_clinic=cart_clinic)
+
+    def run_prefetch(self, manager, **kwargs):
+        """Run a prefetch to completion"""
+        prefetcher = FirmwarePrefetcher(manager, **kwargs)
+        self.assertTrue(prefetcher.start())
+        prefetcher._thread.join(5)
+        self.assertFalse(prefetcher.running)
+        return prefetcher
+
+    def test_prefetches_latest_and_cart_clinic(self):
+        """Test that the latest package and Cart Clinic bitstream are downloaded with the limit"""
+        manager = StubFirmwareManager(self.manifest())
+        self.run_prefetch(manager, bandwidth_limit=1000)
+
+        self.assertEqual(manager.downloads, [('1.2.0', 1000), ('cart_clinic_bitstream', 1000)])
+
+    def test_without_cart_clinic(self):
+        """Test that a manifest without a Cart Clinic bitstream only prefetches firmware"""
+        manager = StubFirmwareManager(self.manifest(cart_clinic=None))
+        self.run_prefetch(manager)
+
+        self.assertEqual([version for (version, _) in manager.downloads], ['1.2.0'])
+
+    def test_no_manifest(self):
+        """Test that nothing is downloaded when the manifest cannot be fetched"""
+        manager = StubFirmwareManager(None)
+        self.run_prefetch(manager)
+
+        self.assertEqual(manager.downloads, [])
+
+    def test_cancel(self):
+        """Test that cancelling stops the prefetch before the Cart Clinic bitstream"""
+        manager = StubFirmwareManager(self.manifest())
+        manager.block_download = True
+        prefetcher = FirmwarePrefetcher(manager)
+        prefetcher.start()
+        self.assertTrue(manager.download_started.wait(5))
+
+        prefetcher.cancel(timeout=5)
+
+        self.assertFalse(prefetcher.running)
+        self.assertEqual([version for (version, _) in manager.downloads], ['1.2.0'])
+
+    def test_start_while_running(self):
+        """Test that only one prefetch runs at a time"""
+        manager = StubFirmwareManager(self.manifest())
+        manager.block_download = True
+        prefetcher = FirmwarePrefetcher(manager)
+        self.assertTrue(prefetcher.start())
+        manager.download_started.wait(5)
+
+        self.assertFalse(prefetcher.start())
+        prefetcher.cancel(timeout=5)
+
+    def test_cancel_before_start(self):
+        """Test that cancelling a prefetch that never started does nothing"""
+        FirmwarePrefetcher(StubFirmwareManager(self.manifest())).cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Unit tests for programming cartridge flash through a Session.
+Tests the commands sent for byte-at-a-time, unlock bypass and write buffer
+programming, and the polling of erases, against a fake transport that
+answers like the FPGA and the flash chip behind it.
+"""
+
+import struct
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from libpyretro.cartclinic.comms import session as session_module
+from libpyretro.cartclinic.comms.session import Session
+from libpyretro.cartclinic.protocol.common import CartFlashChip, CartFlashInfo, CmdId
+
+BANK_SIZE = 0x4000
+BUFFER_SIZE = 32
+
+UNLOCK = [(CmdId.WriteCartByte, 0xAAA, 0xAA), (CmdId.WriteCartByte, 0x555, 0x55)]
+ABORT_WRITE_TO_BUFFER = UNLOCK + [(CmdId.WriteCartByte, 0xAAA, 0xF0)]
+RESET_FLASH_CONTROLLER = UNLOCK + [(CmdId.WriteCartByte, 0, 0xF0)]
+ENTER_UNLOCK_BYPASS = UNLOCK + [(CmdId.WriteCartByte, 0xAAA, 0x20)]
+EXIT_UNLOCK_BYPASS = [(CmdId.WriteCartByte, 0, 0x90), (CmdId.WriteCartByte, 0, 0x00)]
+
+
+def decode(message):
+    """Split a message into (cmd_id, addr, data) commands"""
+    return [struct.unpack('<BHB', message[i:i + 4]) for i in range(0, len(message), 4)]
+
+
+def bus_address(rom_offset):
+    """Cartridge bus address of a ROM offset with its bank selected"""
+    if rom_offset < BANK_SIZE:
+        return rom_offset
+    return BANK_SIZE | rom_offset % BANK_SIZE
+
+
+class FakeFlashTransport:
+    """Transport answering every command like the FPGA would
+
+    Reads return the contents of `image`, i.e. the flash as it is once
+    programming finished. While `busy_reads` is non-zero, reads instead
+    return the toggling DQ6 bit of a chip still running its embedded
+    algorithm, together with any `busy_status` bits. Bytes programmed at an offset in `failing_offsets` read
+    back wrong, and the transfer numbered `raise_at` fails outright.
+    """
+
+    def __init__(self, image=b''):
+        self.image = bytearray(image)
+        self.busy_reads = 0
+        self.busy_status = 0
+        self.failing_offsets = set()
+        self.raise_at = None
+        self.transfers = []
+        self._bank = 0
+        self._toggle = 0
+
+    def connect(self, port, baudrate, timeout):
+        return True
+
+    def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def send_command(self, command):
+        commands = decode(command)
+        self.transfers.append(commands)
+        if len(self.transfers) - 1 == self.raise_at:
+            raise IOError("Serial write failed")
+        return b''.join(struct.pack('<BHB', cmd_id, addr, self._reply(cmd_id, addr, data))
+                        for cmd_id, addr, data in commands)
+
+    def _rom_offset(self, addr):
+        if addr < BANK_SIZE:
+            return addr
+        return self._bank * BANK_SIZE + addr % BANK_SIZE
+
+    def _reply(self, cmd_id, addr, data):
+        if cmd_id == CmdId.WriteCartByte:
+            if addr == 0x2100:
+                self._bank = self._bank & 0x100 | data
+            elif addr == 0x3000:
+                self._bank = self._bank & 0xFF | data << 8
+            return data
+        if cmd_id == CmdId.ReadCartByte:
+            if self.busy_reads:
+                self.busy_reads -= 1
+                self._toggle ^= 0x40
+                return self._toggle | self.busy_status
+            offset = self._rom_offset(addr)
+            return self.image[offset] if offset < len(self.image) else 0xFF
+        if cmd_id == CmdId.WriteCartFlashByte and self._rom_offset(addr) in self.failing_offsets:
+            return data ^ 0xFF
+        return data
+
+
+class FlashProgrammingTestCase(unittest.TestCase):
+    """Session connected to a fake transport"""
+
+    def connect(self, image, unlock_bypass=False, write_buffer_size=0):
+        """Connect a session to a fake flash chip holding image once programmed"""
+        self.transport = FakeFlashTransport(image)
+        self.session = Session(self.transport)
+        self.assertTrue(self.session.connect('fake'))
+        self.session._flash_info = CartFlashInfo(
+            part_id=CartFlashChip.Infineon_S29JL032J70,
+            part_number='S29JL032J70',
+            vendor='Infineon',
+            total_size_kb=4096,
+            sector_size_kb=64,
+            grouping='uniform',
+            recovery_offset_kb=0,
+            unlock_bypass=unlock_bypass,
+            write_buffer_size=write_buffer_size
+        )
+        return self.session
+
+
+class TestByteProgramming(FlashProgrammingTestCase):
+    """Test programming flash a byte at a time, with and without unlock bypass"""
+
+    def program_transfers(self):
+        """Return the transfers that program bytes"""
+        return [commands for commands in self.transport.transfers
+                if any(cmd_id == CmdId.WriteCartFlashByte for (cmd_id, _, _) in commands)]
+
+    def test_unlock_bypass_sequence(self):
+        """Test that bypass mode is entered with 0x20, bytes use 0xA0 alone and 0x90/0x00 exits"""
+        data = b'\x12\x34\x56'
+        session = self.connect(b'', unlock_bypass=True)
+
+        self.assertTrue(session.program_flash(0x10, data))
+
+        program = []
+        for i, data_byte in enumerate(data):
+            program += [(CmdId.WriteCartByte, 0xAAA, 0xA0), (CmdId.WriteCartFlashByte, 0x10 + i, data_byte)]
+        self.assertEqual(self.transport.transfers, [ENTER_UNLOCK_BYPASS, program, EXIT_UNLOCK_BYPASS])
+
+    def test_exit_unlock_bypass_after_failure(self):
+        """Test that bypass mode is exited and the chip reset when a byte fails to program"""
+        data = bytes(range(100))
+        session = self.connect(b'', unlock_bypass=True)
+        self.transport.failing_offsets.add(80)
+
+        self.assertFalse(session.program_flash(0, data))
+
+        # The first batch programs, the second fails verification
+        self.assertEqual(len(self.program_transfers()), 2)
+        self.assertEqual(self.transport.transfers[0], ENTER_UNLOCK_BYPASS)
+        self.assertEqual(self.transport.transfers[-2:], [EXIT_UNLOCK_BYPASS, RESET_FLASH_CONTROLLER])
+
+    def test_exit_unlock_bypass_after_transfer_error(self):
+        """Test that bypass mode is exited when a transfer fails partway through"""
+        data = bytes(range(100))
+        session = self.connect(b'', unlock_bypass=True)
+        self.transport.raise_at = 2
+
+        self.assertFalse(session.program_flash(0, data))
+
+        self.assertEqual(len(self.transport.transfers), 5)
+        self.assertEqual(self.transport.transfers[-2:], [EXIT_UNLOCK_BYPASS, RESET_FLASH_CONTROLLER])
+
+    def test_full_unlock_without_bypass(self):
+        """Test that chips without unlock bypass get the full unlock sequence for every byte"""
+        data = b'\x12\x34'
+        session = self.connect(b'', unlock_bypass=False)
+
+        self.assertTrue(session.program_flash(0x4010, data))
+
+        program = []
+        for i, data_byte in enumerate(data):
+            program += UNLOCK + [(CmdId.WriteCartByte, 0xAAA, 0xA0), (CmdId.WriteCartFlashByte, 0x4010 + i, data_byte)]
+        self.assertEqual(self.program_transfers(), [program])
+        self.assertNotIn(ENTER_UNLOCK_BYPASS, self.transport.transfers)
+        self.assertNotIn(EXIT_UNLOCK_BYPASS, self.transport.transfers)
+
+
+class TestWriteBufferProgramming(FlashProgrammingTestCase):
+    """Test programming flash a write buffer page at a time"""
+
+    def buffer_writes(self):
+        """Return (sector_addr, count, data, confirm) of every write to buffer sent"""
+        writes = []
+        for commands in self.transport.transfers:
+            if len(commands) < 5 or commands[:2] != UNLOCK or commands[2][2] != 0x25:
+                continue
+            sector_addr = commands[2][1]
+            count = commands[3][2]
+            data = commands[4:5 + count]
+            confirm = commands[5 + count]
+            writes.append((sector_addr, count, data, confirm))
+        return writes
+
+    def test_write_to_buffer_sequence(self):
+        """Test that a page is sent as 0x25, the count, the data and the 0x29 confirm"""
+        data = bytes(range(0x10, 0x18))
+        image = bytearray(b'\xFF' * 0x200)
+        image[0x100:0x108] = data
+        session = self.connect(image, write_buffer_size=BUFFER_SIZE)
+
+        self.assertTrue(session.program_flash(0x100, data))
+
+        self.assertEqual(len(self.transport.transfers), 1)
+        commands = self.transport.transfers[0]
+        expected = UNLOCK + [(CmdId.WriteCartByte, 0x100, 0x25), (CmdId.WriteCartByte, 0x100, len(data) - 1)]
+        expected += [(CmdId.WriteCartByte, 0x100 + i, data_byte) for i, data_byte in enumerate(data)]
+        expected += [(CmdId.WriteCartByte, 0x100, 0x29)]
+        expected += [(CmdId.ReadCartByte, 0x107, 0)] * session_module.FLASH_BUFFER_STATUS_READS
+        expected += [(CmdId.ReadCartByte, 0x100 + i, 0) for i in range(len(data))]
+        self.assertEqual(commands, expected)
+
+    def test_chunking_at_page_and_bank_boundaries(self):
+        """Test that pages never cross a write buffer page or a bank boundary"""
+        start = BANK_SIZE - 16
+        data = bytes(i & 0xFF for i in range(64))
+        image = bytearray(b'\xFF' * (2 * BANK_SIZE))
+        image[start:start + len(data)] = data
+        session = self.connect(image, write_buffer_size=BUFFER_SIZE)
+
+        self.assertTrue(session.program_flash(start, data))
+
+        writes = self.buffer_writes()
+        self.assertEqual([(sector_addr, count + 1) for (sector_addr, count, _, _) in writes],
+                         [(bus_address(start), 16), (bus_address(BANK_SIZE), 32), (bus_address(BANK_SIZE + 32), 16)])
+
+        programmed = bytearray()
+        for sector_addr, count, page, confirm in writes:
+            self.assertEqual([addr for (_, addr, _) in page], list(range(sector_addr, sector_addr + count + 1)))
+            self.assertEqual(confirm, (CmdId.WriteCartByte, sector_addr, 0x29))
+            programmed += bytes(data_byte for (_, _, data_byte) in page)
+        self.assertEqual(bytes(programmed), data)
+
+        # Bank 1 is mapped in once, before its first page
+        bank_selects = [commands for commands in self.transport.transfers if commands[0][1] in (0x2100, 0x3000)]
+        self.assertEqual(bank_selects, [[(CmdId.WriteCartByte, 0x3000, 0)], [(CmdId.WriteCartByte, 0x2100, 1)]])
+
+    def test_polls_page_until_programmed(self):
+        """Test that a page still programming after its status reads is polled"""
+        data = bytes(range(BUFFER_SIZE))
+        session = self.connect(data, write_buffer_size=BUFFER_SIZE)
+        self.transport.busy_reads = 6
+
+        self.assertTrue(session.program_flash(0, data))
+
+        self.assertEqual(len(self.buffer_writes()), 1)
+        self.assertNotIn(ABORT_WRITE_TO_BUFFER, self.transport.transfers)
+
+    def test_page_read_back_mismatch_aborts(self):
+        """Test that a page whose contents read back wrong fails and aborts the write"""
+        data = bytes(range(2 * BUFFER_SIZE))
+        image = bytearray(data)
+        image[5] ^= 0x01
+        session = self.connect(image, write_buffer_size=BUFFER_SIZE)
+
+        self.assertFalse(session.program_flash(0, data))
+
+        self.assertEqual(len(self.buffer_writes()), 1)
+        self.assertEqual(self.transport.transfers[-1], ABORT_WRITE_TO_BUFFER)
+
+    def test_page_read_back_after_polling(self):
+        """Test that a page confirmed by polling is read back again before moving on"""
+        data = bytes(range(BUFFER_SIZE))
+        image = bytearray(data)
+        image[5] ^= 0x01
+        session = self.connect(image, write_buffer_size=BUFFER_SIZE)
+        self.transport.busy_reads = 2
+
+        self.assertFalse(session.program_flash(0, data))
+
+        page_read = [(CmdId.ReadCartByte, i, 0) for i in range(BUFFER_SIZE)]
+        self.assertEqual(self.transport.transfers[-2:], [page_read, ABORT_WRITE_TO_BUFFER])
+
+    def test_timeout_aborts_write_to_buffer(self):
+        """Test that 0xF0 is sent when a page does not finish programming"""
+        data = bytes(range(2 * BUFFER_SIZE))
+        session = self.connect(data, write_buffer_size=BUFFER_SIZE)
+        self.transport.busy_reads = 1 << 30
+
+        with patch.object(session_module, 'FLASH_BUFFER_PROGRAM_TIMEOUT_S', 0.05):
+            self.assertFalse(session.program_flash(0, data))
+
+        # The second page is never sent and the operation is aborted last
+        self.assertEqual(len(self.buffer_writes()), 1)
+        self.assertEqual(self.transport.transfers[-1], ABORT_WRITE_TO_BUFFER)
+
+
+class TestErasePolling(FlashProgrammingTestCase):
+    """Test polling the chip while it erases"""
+
+    def test_sector_erase_sleeps_between_polls(self):
+        """Test that sector erase polls sleep for a fraction of the typical sector erase time"""
+        session = self.connect(b'')
+        self.transport.busy_reads = 4
+
+        with patch.object(session_module.time, 'sleep') as sleep:
+            self.assertTrue(session.erase_flash_sector(1, 0x10000))
+
+        # Two polls found the chip busy; the third found it done
+        self.assertEqual([call.args for call in sleep.call_args_list], [(0.5 / session_module.FLASH_ERASE_POLLS_PER_TYPICAL,)] * 2)
+
+    def test_chip_erase_poll_interval_is_capped(self):
+        """Test that the slow chip erase is still polled at least every FLASH_ERASE_POLL_MAX_S"""
+        session = self.connect(b'')
+        self.transport.busy_reads = 2
+
+        with patch.object(session_module.time, 'sleep') as sleep:
+            self.assertTrue(session.erase_flash_chip())
+
+        sleep.assert_called_once_with(session_module.FLASH_ERASE_POLL_MAX_S)
+
+    def test_internal_timeout(self):
+        """Test that DQ5 set while DQ6 keeps toggling fails the erase and resets the chip"""
+        session = self.connect(b'')
+        self.transport.busy_reads = 1 << 30
+        self.transport.busy_status = 0x20
+
+        with patch.object(session_module.time, 'sleep') as sleep:
+            self.assertFalse(session.erase_flash_sector(0, 0x10000))
+
+        # The first poll sees DQ5, the confirming poll still sees DQ6 toggle
+        sleep.assert_not_called()
+        self.assertEqual(self.transport.transfers[-1], RESET_FLASH_CONTROLLER)
+
+    def test_dq5_after_the_erase_finished(self):
+        """Test that DQ5 seen as the chip finishes does not fail the erase"""
+        session = self.connect(b'')
+        self.transport.busy_reads = 2
+        self.transport.busy_status = 0x20
+
+        with patch.object(session_module.time, 'sleep'):
+            self.assertTrue(session.erase_flash_sector(0, 0x10000))
+
+        self.assertNotIn(RESET_FLASH_CONTROLLER, self.transport.transfers)
+
+    def test_erase_timeout(self):
+        """Test that an erase still busy at its deadline fails and resets the chip"""
+        session = self.connect(b'')
+        self.transport.busy_reads = 1 << 30
+
+        with patch.object(session_module, 'FLASH_ERASE_TIMEOUT_MARGIN', 0.001), \
+                patch.object(session_module.time, 'sleep') as sleep:
+            self.assertFalse(session.erase_flash_sector(0, 0x10000))
+
+        self.assertTrue(sleep.called)
+        self.assertEqual(self.transport.transfers[-1], RESET_FLASH_CONTROLLER)
+
+    def test_program_polls_do_not_sleep(self):
+        """Test that polling a write buffer page does not sleep"""
+        data = bytes(range(BUFFER_SIZE))
+        session = self.connect(data, write_buffer_size=BUFFER_SIZE)
+        self.transport.busy_reads = 6
+
+        with patch.object(session_module.time, 'sleep') as sleep:
+            self.assertTrue(session.program_flash(0, data))
+
+        sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Unit tests for game info lookups.
+Tests that lookups are shared per cart fingerprint, retried after failures
+and cached on disk, against a local stand-in for the patch service.
+"""
+
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from cartclinic.game_info import GameInfoLookup
+from cartclinic.mrpatcher import GAME_ID_SIZE, cart_fingerprint
+from cartclinic.patch_cache import PatchCache
+from tests.mocks.mock_mrpatcher_server import MockMRPatcherConfig, MockMRPatcherServer
+
+
+GAME_INFO = {'game_title': 'tetris', 'save_settings': {'offset_kb': 256, 'save_compatible': True}}
+
+
+class TestGameInfoLookup(unittest.TestCase):
+    """Test GameInfoLookup"""
+
+    def setUp(self):
+        """Set up a cache in a temporary directory and a ROM ID block"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = PatchCache(self.temp_dir.name)
+        self.bank_0 = bytes(range(256)) * 64
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def game_id_requests(self, server):
+        """Return the game ID requests the server received"""
+        return [request for request in server.posts() if request.path == '/patch/game_id']
+
+    def test_lookup_is_shared(self):
+        """Test that flows on the same cart share one lookup"""
+        with MockMRPatcherServer(MockMRPatcherConfig(response=GAME_INFO)) as server:
+            lookup = GameInfoLookup(self.cache)
+            lookup.prefetch(server.endpoint, self.bank_0)
+            game_info = lookup.get(server.endpoint, self.bank_0[:GAME_ID_SIZE])
+
+        self.assertEqual(game_info.save_settings.offset_kb, 256)
+        (request,) = self.game_id_requests(server)
+        self.assertEqual(request.body, self.bank_0[:GAME_ID_SIZE])
+
+    def test_cache_survives_restart(self):
+        """Test that a new lookup finds the game info in the on-disk cache"""
+        with MockMRPatcherServer(MockMRPatcherConfig(response=GAME_INFO)) as server:
+            GameInfoLookup(self.cache).get(server.endpoint, self.bank_0)
+            game_info = GameInfoLookup(PatchCache(self.temp_dir.name)).get(server.endpoint, self.bank_0)
+
+        self.assertEqual(game_info.game_title, 'tetris')
+        self.assertEqual(len(self.game_id_requests(server)), 1)
+
+    def test_errors_are_retried(self):
+        """Test that a lookup the service could not answer is tried again"""
+        config = MockMRPatcherConfig(response={'error': 'busy', 'error_code': 1})
+        with MockMRPatcherServer(config) as server:
+            lookup = GameInfoLookup(self.cache)
+            self.assertEqual(lookup.get(server.endpoint, self.bank_0).error, 'busy')
+            config.response = GAME_INFO
+            game_info = lookup.get(server.endpoint, self.bank_0)
+
+        self.assertEqual(game_info.game_title, 'tetris')
+        self.assertEqual(len(self.game_id_requests(server)), 2)
+
+    def test_fingerprint_uses_id_block(self):
+        """Test that carts are told apart by their ID block only"""
+        other_bank_0 = self.bank_0[:GAME_ID_SIZE] + b'\x00' * (len(self.bank_0) - GAME_ID_SIZE)
+        changed_id = b'\xff' + self.bank_0[1:]
+
+        self.assertEqual(cart_fingerprint(self.bank_0), cart_fingerprint(other_bank_0))
+        self.assertNotEqual(cart_fingerprint(self.bank_0), cart_fingerprint(changed_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the shared file hashing utility.
+Tests single and combined digests against hashlib and zlib, and hashing
+several files at once.
+"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+import sys
+import zlib
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.hashing import HASH_BUFFER_SIZE, hash_file, hash_files
+
+
+class TestHashing(unittest.TestCase):
+    """Test hash_file and hash_files"""
+
+    def setUp(self):
+        """Set up files of a few sizes in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.files = {}
+        for (name, size) in [('empty.bin', 0), ('small.bin', 1000), ('large.bin', 3 * HASH_BUFFER_SIZE + 17)]:
+            path = Path(self.temp_dir.name) / name
+            path.write_bytes(os.urandom(size))
+            self.files[name] = path
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def expected(self, path):
+        """Return the digests of a file computed directly"""
+        data = path.read_bytes()
+        return {
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'md5': hashlib.md5(data).hexdigest(),
+            'crc32': f"{zlib.crc32(data):08x}",
+        }
+
+    def test_single_digest(self):
+        """Test that a single digest matches hashlib"""
+        for path in self.files.values():
+            self.assertEqual(hash_file(path), {'sha256': self.expected(path)['sha256']})
+
+    def test_combined_digests(self):
+        """Test that several digests are computed together in one pass"""
+        for path in self.files.values():
+            self.assertEqual(hash_file(path, ('sha256', 'crc32', 'md5')), self.expected(path))
+
+    def test_combined_digests_read_once(self):
+        """Test that computing several digests does not read the file per digest"""
+        with patch('builtins.open', wraps=open) as opened:
+            hash_file(self.files['large.bin'], ('sha256', 'crc32', 'md5'))
+
+        self.assertEqual(opened.call_count, 1)
+
+    def test_crc32_only(self):
+        """Test that CRC32 works on its own"""
+        path = self.files['large.bin']
+        self.assertEqual(hash_file(path, ('crc32',)), {'crc32': self.expected(path)['crc32']})
+
+    def test_many_files(self):
+        """Test that files hashed concurrently keep their order"""
+        paths = list(self.files.values()) * 3
+        results = hash_files(paths, ('sha256', 'md5'), workers=4)
+
+        self.assertEqual(results, [{'sha256': self.expected(path)['sha256'], 'md5': self.expected(path)['md5']}
+                                   for path in paths])
+
+    def test_missing_file(self):
+        """Test that a missing file raises"""
+        with self.assertRaises(FileNotFoundError):
+            hash_files([self.files['small.bin'], Path(self.temp_dir.name) / 'missing.bin'])
+
+
+if __name__ == '__main__':
+    unittest.main()
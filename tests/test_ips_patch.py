@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Unit tests for IPS patches.
+Tests encoding, decoding and applying patches, both into a new buffer and in
+place.
+"""
+
+import os
+import random
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from libpyretro.ips_util.patch import EOF_ADDRESS, Patch, np
+
+
+def reference_apply(patch, in_data):
+    """The original record-by-record apply, used as the expected result"""
+    out_data = bytearray(in_data)
+    for record in patch.records:
+        if record['address'] >= len(out_data):
+            out_data += bytes([0] * ((record['address'] - len(out_data)) + 1))
+        if 'rle_count' in record:
+            out_data[record['address']:record['address'] + record['rle_count']] = b''.join([record['data']] * record['rle_count'])
+            continue
+        out_data[record['address']:record['address'] + len(record['data'])] = record['data']
+    if patch.truncate_length is not None:
+        out_data = out_data[:patch.truncate_length]
+    return out_data
+
+
+def random_patch(rng, size):
+    """Builds a patch with plain and RLE records, some of them past `size`"""
+    patch = Patch()
+    for _ in range(rng.randint(1, 40)):
+        address = rng.randrange(0, size + 4096)
+        if rng.random() < 0.3:
+            patch.add_rle_record(address, bytes([rng.randrange(256)]), rng.randint(1, 3000))
+        else:
+            patch.add_record(address, bytes(rng.randrange(256) for _ in range(rng.randint(1, 200))))
+    if rng.random() < 0.3:
+        patch.set_truncate_length(rng.randrange(size // 2, size + 8192))
+    return patch
+
+
+class TestPatchApply(unittest.TestCase):
+    """Test applying IPS patches"""
+
+    def setUp(self):
+        """Set up a 64KB test ROM"""
+        self.rng = random.Random(1234)
+        self.rom = bytes(self.rng.randrange(256) for _ in range(64 * 1024))
+
+    def test_apply_matches_reference(self):
+        """Test that apply gives the same bytes as the original algorithm"""
+        for _ in range(50):
+            patch = random_patch(self.rng, len(self.rom))
+            self.assertEqual(patch.apply(self.rom), reference_apply(patch, self.rom))
+
+    def test_apply_does_not_modify_input(self):
+        """Test that apply leaves its input untouched"""
+        rom = bytearray(self.rom)
+        patch = Patch()
+        patch.add_record(10, b'\x01\x02\x03')
+        patch.apply(rom)
+        self.assertEqual(rom, self.rom)
+
+    def test_apply_in_place_matches_apply(self):
+        """Test that patching in place resizes and patches the buffer"""
+        for _ in range(50):
+            patch = random_patch(self.rng, len(self.rom))
+            data = bytearray(self.rom)
+            patch.apply_in_place(data)
+            self.assertEqual(data, reference_apply(patch, self.rom))
+
+    def test_apply_in_place_returns_dirty_ranges(self):
+        """Test that the written ranges are merged and sorted"""
+        patch = Patch()
+        patch.add_rle_record(100, b'\xff', 50)
+        patch.add_record(20, b'\x00' * 10)
+        patch.add_record(140, b'\x01' * 20)
+        data = bytearray(self.rom)
+
+        self.assertEqual(patch.apply_in_place(data), [(20, 30), (100, 160)])
+
+    def test_growth_is_dirty(self):
+        """Test that bytes added past the end of the input count as dirty"""
+        patch = Patch()
+        patch.add_record(len(self.rom) + 10, b'\xaa\xbb')
+        data = bytearray(self.rom)
+
+        self.assertEqual(patch.apply_in_place(data), [(len(self.rom), len(self.rom) + 12)])
+        self.assertEqual(data[len(self.rom):], b'\x00' * 10 + b'\xaa\xbb')
+
+    def test_truncate_clips_records(self):
+        """Test that records past the truncate length are clipped"""
+        patch = Patch()
+        patch.add_rle_record(90, b'\x11', 20)
+        patch.set_truncate_length(100)
+        data = bytearray(self.rom)
+
+        self.assertEqual(patch.apply_in_place(data), [(90, 100)])
+        self.assertEqual(len(data), 100)
+        self.assertEqual(data[90:], b'\x11' * 10)
+
+    def test_apply_to_file(self):
+        """Test patching a file through a memory map"""
+        patch = random_patch(self.rng, len(self.rom))
+        with tempfile.NamedTemporaryFile(delete=False) as rom_file:
+            rom_file.write(self.rom)
+        try:
+            dirty = patch.apply_to_file(rom_file.name)
+            with open(rom_file.name, 'rb') as patched_file:
+                self.assertEqual(patched_file.read(), reference_apply(patch, self.rom))
+            self.assertEqual(dirty, patch.apply_in_place(bytearray(self.rom)))
+        finally:
+            os.remove(rom_file.name)
+
+
+class TestPatchEncoding(unittest.TestCase):
+    """Test encoding, loading and creating IPS patches"""
+
+    def test_load_round_trip(self):
+        """Test that an encoded patch loads back into the same records"""
+        patch = Patch()
+        patch.add_record(0x100, b'\x01\x02\x03')
+        patch.add_rle_record(0x2000, b'\x7f', 500)
+        patch.set_truncate_length(0x8000)
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.ips') as patch_file:
+            patch_file.write(patch.encode())
+        try:
+            loaded = Patch.load(patch_file.name)
+        finally:
+            os.remove(patch_file.name)
+
+        self.assertEqual(loaded.records, patch.records)
+        self.assertEqual(loaded.truncate_length, 0x8000)
+
+    def test_from_bytes_matches_load(self):
+        """Test that parsing in memory gives the same patch as loading a file"""
+        patch = Patch()
+        patch.add_record(0x10, b'\xde\xad')
+        patch.add_rle_record(0x4000, b'\x00', 0x1234)
+        encoded = patch.encode()
+
+        parsed = Patch.from_bytes(bytes(encoded))
+
+        self.assertEqual(parsed.records, patch.records)
+        self.assertIsNone(parsed.truncate_length)
+        self.assertEqual(parsed.apply(bytes(0x8000)), patch.apply(bytes(0x8000)))
+
+    def test_from_buffer_does_not_copy_payloads(self):
+        """Test that record payloads are views into the parsed buffer"""
+        patch = Patch()
+        patch.add_record(0x20, b'\x01\x02\x03\x04')
+        buffer = bytearray(patch.encode())
+
+        parsed = Patch.from_buffer(buffer)
+
+        self.assertIs(parsed.records[0]['data'].obj, buffer)
+        self.assertEqual(parsed.records[0]['data'], b'\x01\x02\x03\x04')
+
+    def test_from_bytes_rejects_bad_data(self):
+        """Test that a bad header or a cut off record raises an error"""
+        patch = Patch()
+        patch.add_record(0x20, b'\x01\x02\x03\x04')
+        encoded = bytes(patch.encode())
+
+        with self.assertRaises(Exception):
+            Patch.from_bytes(b'PITCH' + encoded[5:])
+        with self.assertRaises(Exception):
+            Patch.from_bytes(encoded[:12])
+
+    def test_create_then_apply(self):
+        """Test that a created patch turns the original into the patched data"""
+        rng = random.Random(99)
+        original = bytes(rng.randrange(256) for _ in range(32 * 1024))
+        patched = bytearray(original)
+        patched[100:110] = b'\x00' * 10
+        patched[5000:5300] = b'\xee' * 300
+        patched[9000] ^= 0xff
+        patched += b'\x12' * 40
+
+        self.assertEqual(Patch.create(original, patched).apply(original), patched)
+
+
+class TestPatchCompose(unittest.TestCase):
+    """Test merging patches into a single normalised patch"""
+
+    def setUp(self):
+        """Set up a 64KB test ROM"""
+        self.rng = random.Random(777)
+        self.rom = self.rng.randbytes(64 * 1024)
+
+    def apply_all(self, patches, data):
+        """Apply the patches one after another"""
+        for patch in patches:
+            data = patch.apply(data)
+        return data
+
+    def test_compose_matches_sequential_apply(self):
+        """Test that the composed patch has the effect of all of them"""
+        for _ in range(30):
+            patches = [random_patch(self.rng, len(self.rom)) for _ in range(3)]
+            try:
+                composed = Patch.compose(*patches)
+            except ValueError:
+                composed = Patch.compose(*patches, input_size=len(self.rom))
+            self.assertEqual(composed.apply(self.rom), self.apply_all(patches, self.rom))
+
+    def test_compose_is_normalised(self):
+        """Test that records are sorted, disjoint, coalesced and RLE encoded"""
+        first = Patch()
+        first.add_record(300, b'\x05' * 40)
+        first.add_record(100, b'\x01\x02')
+        second = Patch()
+        second.add_record(102, b'\x03\x04')
+        second.add_record(310, b'\x06\x07')
+
+        composed = Patch.compose(first, second)
+
+        self.assertEqual(composed.touched_ranges(), [(100, 104), (300, 340)])
+        self.assertEqual(composed.records[0], {'address': 100, 'data': b'\x01\x02\x03\x04'})
+        self.assertEqual(composed.records[1], {'address': 300, 'data': b'\x05', 'rle_count': 10})
+        self.assertEqual(composed.records[2], {'address': 310, 'data': b'\x06\x07'})
+        self.assertEqual(composed.records[3], {'address': 312, 'data': b'\x05', 'rle_count': 28})
+        self.assertEqual(composed.apply(self.rom), self.apply_all([first, second], self.rom))
+
+    def test_truncated_then_grown_bytes_are_zero(self):
+        """Test that bytes truncated away and grown back are written as zero"""
+        first = Patch()
+        first.set_truncate_length(1000)
+        second = Patch()
+        second.add_record(1010, b'\xaa')
+
+        composed = Patch.compose(first, second)
+
+        self.assertEqual(composed.apply(self.rom), self.apply_all([first, second], self.rom))
+        self.assertEqual(composed.truncate_length, 1011)
+
+    def test_input_size_dependent_composition(self):
+        """Test that an input size is required when the result depends on it"""
+        first = Patch()
+        first.add_record(5000, b'\x01')
+        second = Patch()
+        second.set_truncate_length(4000)
+
+        with self.assertRaises(ValueError):
+            Patch.compose(first, second)
+        for size in (100, 4500, 8000):
+            rom = self.rom[:size]
+            composed = Patch.compose(first, second, input_size=size)
+            self.assertEqual(composed.apply(rom), self.apply_all([first, second], rom))
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestVectorizedCreate(unittest.TestCase):
+    """Test that the NumPy diff engine matches the pure Python one"""
+
+    def setUp(self):
+        """Set up a 256KB test ROM"""
+        self.rng = random.Random(4321)
+        self.original = self.rng.randbytes(256 * 1024)
+
+    def assertSamePatch(self, original, patched):
+        """Assert both create paths encode to the same bytes"""
+        expected = Patch._create_python(original, patched)
+        actual = Patch._create_vectorized(original, patched)
+        self.assertEqual(actual.encode(), expected.encode())
+        self.assertEqual(actual.apply(original), expected.apply(original))
+
+    def test_random_edits(self):
+        """Test runs of random, repeated and mixed bytes"""
+        for _ in range(20):
+            patched = bytearray(self.original)
+            for _ in range(20):
+                start = self.rng.randrange(len(patched))
+                length = self.rng.choice([1, 3, 4, 8, 9, 13, 14, 200, 5000])
+                if self.rng.random() < 0.5:
+                    patched[start:start + length] = bytes([self.rng.randrange(256)]) * len(patched[start:start + length])
+                else:
+                    chunk = b''.join(bytes([self.rng.randrange(3)]) * self.rng.choice([1, 2, 4, 9, 14]) for _ in range(length))
+                    patched[start:start + length] = chunk[:len(patched[start:start + length])]
+            self.assertSamePatch(self.original, patched)
+
+    def test_long_runs_are_split(self):
+        """Test records and RLE runs longer than an IPS record can hold"""
+        patched = bytearray(self.original)
+        patched[1000:1000 + 150000] = self.rng.randbytes(150000)
+        patched[200000:250000] = b'\x01\x02' * 25000
+        self.assertSamePatch(self.original, patched)
+        patched = bytearray(self.original)
+        patched[1000:1000 + 140000] = b'\xab' * 140000
+        self.assertSamePatch(self.original, patched)
+
+    def test_truncate_and_grow(self):
+        """Test patched data shorter and longer than the original"""
+        self.assertSamePatch(self.original, self.original[:100000] + b'\x00' * 10)
+        self.assertSamePatch(self.original, self.original + self.rng.randbytes(3000))
+        self.assertSamePatch(self.original, self.original + b'\x00' * 3000)
+
+    def test_eof_address_workaround(self):
+        """Test a run starting at the address that spells EOF"""
+        original = bytes(EOF_ADDRESS + 100)
+        patched = bytearray(original)
+        patched[EOF_ADDRESS:EOF_ADDRESS + 80] = self.rng.randbytes(80)
+        self.assertSamePatch(original, patched)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the firmware manifest cache.
+Tests the TTL, revalidation bookkeeping and handling of caches written by
+other versions of the app.
+"""
+
+import json
+import tempfile
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from flashing_tool.manifest_cache import ManifestCache, MANIFEST_CACHE_SCHEMA_VERSION
+
+
+MANIFEST = {'latest_version': '1.2.0', 'firmware_list': [{'version': '1.2.0', 'deltas': []}]}
+
+
+class TestManifestCache(unittest.TestCase):
+    """Test ManifestCache"""
+
+    def setUp(self):
+        """Set up a cache file in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / 'manifest.json'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        """Test that a stored manifest is loaded by a new cache"""
+        ManifestCache(self.path).store(MANIFEST, '"abc"')
+        cached = ManifestCache(self.path).load()
+
+        self.assertEqual(cached.data, MANIFEST)
+        self.assertEqual(cached.etag, '"abc"')
+
+    def test_ttl(self):
+        """Test that a manifest is fresh only within the TTL"""
+        cache = ManifestCache(self.path, ttl_s=60)
+        cached = cache.store(MANIFEST, '"abc"')
+        self.assertTrue(cache.is_fresh(cached))
+
+        with patch('flashing_tool.manifest_cache.time.time', return_value=cached.fetched_at + 61):
+            self.assertFalse(cache.is_fresh(cached))
+        with patch('flashing_tool.manifest_cache.time.time', return_value=cached.fetched_at - 1):
+            self.assertFalse(cache.is_fresh(cached))
+
+    def test_refresh_restarts_ttl(self):
+        """Test that a manifest S3 confirmed is fresh again and keeps its ETag"""
+        cache = ManifestCache(self.path, ttl_s=60)
+        with patch('flashing_tool.manifest_cache.time.time', return_value=time.time() - 120):
+            cached = cache.store(MANIFEST, '"abc"')
+        self.assertFalse(cache.is_fresh(cached))
+
+        refreshed = cache.refresh(cached)
+        self.assertTrue(cache.is_fresh(refreshed))
+        self.assertEqual(ManifestCache(self.path).load().etag, '"abc"')
+
+    def test_load_is_memoised(self):
+        """Test that repeated loads do not read the file again"""
+        cache = ManifestCache(self.path)
+        cache.store(MANIFEST, '"abc"')
+        with patch('builtins.open', side_effect=AssertionError('file read')):
+            self.assertEqual(cache.load().data, MANIFEST)
+
+    def test_other_schema_is_ignored(self):
+        """Test that a cache from another schema version is not used"""
+        self.path.write_text(json.dumps({
+            'schema_version': MANIFEST_CACHE_SCHEMA_VERSION + 1,
+            'etag': '"abc"', 'fetched_at': time.time(), 'manifest': MANIFEST}))
+
+        self.assertIsNone(ManifestCache(self.path).load())
+
+    def test_corrupt_cache_is_ignored(self):
+        """Test that an unreadable cache is treated as missing"""
+        self.path.write_text('{"schema_version": 1, "manif')
+
+        self.assertIsNone(ManifestCache(self.path).load())
+
+    def test_clear(self):
+        """Test that clearing removes the cached manifest"""
+        cache = ManifestCache(self.path)
+        cache.store(MANIFEST, '"abc"')
+        cache.clear()
+
+        self.assertIsNone(cache.load())
+        self.assertFalse(self.path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the MRPatcher HTTP client.
+Tests connection reuse, retries, hash lookups and compressed and streamed
+uploads against a local stand-in for the patch service.
+"""
+
+import hashlib
+import random
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from cartclinic.mrpatcher import GAME_ID_SIZE, MRPatcherAPI, choose_encoding, zstandard
+from cartclinic.rom_stream import RomStream, RomStreamAborted
+from tests.mocks.mock_mrpatcher_server import MockMRPatcherConfig, MockMRPatcherServer
+
+
+def make_rom(size=512 * 1024):
+    """Create a ROM of random banks separated by 0xFF padding"""
+    rng = random.Random(37)
+    rom = bytearray(b'\xff' * size)
+    for offset in range(0, size, 64 * 1024):
+        rom[offset:offset + 8192] = rng.randbytes(8192)
+    return bytes(rom)
+
+
+class TestMRPatcherClient(unittest.TestCase):
+    """Test MRPatcherAPI against a local service"""
+
+    def setUp(self):
+        self.rom = make_rom()
+
+    def test_uncompressed_upload(self):
+        """Test that the ROM is sent as-is when the service advertises no encodings"""
+        with MockMRPatcherServer() as server:
+            response = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        (post,) = server.uploads()
+        self.assertNotIn('Content-Encoding', post.headers)
+        self.assertEqual(post.body, self.rom)
+
+    def test_gzip_upload(self):
+        """Test that the ROM is gzipped when the service accepts gzip"""
+        with MockMRPatcherServer(MockMRPatcherConfig(accept_encoding='gzip')) as server:
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        (post,) = server.uploads()
+        self.assertEqual(post.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(post.body, self.rom)
+        self.assertLess(int(post.headers['Content-Length']), len(self.rom) // 4)
+
+    @unittest.skipIf(zstandard is None, "zstandard not installed")
+    def test_zstd_upload(self):
+        """Test that zstd is preferred when the service accepts it"""
+        with MockMRPatcherServer(MockMRPatcherConfig(accept_encoding='gzip, zstd')) as server:
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        (post,) = server.uploads()
+        self.assertEqual(post.headers['Content-Encoding'], 'zstd')
+        self.assertEqual(post.body, self.rom)
+
+    def test_refused_encoding_falls_back(self):
+        """Test that a 415 reply makes the client resend uncompressed"""
+        config = MockMRPatcherConfig(accept_encoding='gzip', refuse_encoded=True)
+        with MockMRPatcherServer(config) as server:
+            response = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        encodings = [post.headers.get('Content-Encoding') for post in server.uploads()]
+        self.assertEqual(encodings, ['gzip', None, None])
+
+    def test_connection_is_reused(self):
+        """Test that consecutive requests share one kept-alive connection"""
+        with MockMRPatcherServer() as server:
+            api = MRPatcherAPI(server.endpoint)
+            api.request_patch(self.rom)
+            api.get_game_id(self.rom)
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual([request.path for request in server.requests], ['/patch/lookup', '/patch', '/patch', '/patch/game_id', '/patch'])
+        self.assertEqual(len({request.client_port for request in server.requests}), 1)
+        self.assertEqual(server.requests[3].body, self.rom[:GAME_ID_SIZE])
+
+    def test_overloaded_service_is_retried(self):
+        """Test that 503 replies are retried"""
+        config = MockMRPatcherConfig(hash_lookup=True, known_hashes={hashlib.sha256(self.rom).hexdigest()}, fail_statuses=[503, 503])
+        with MockMRPatcherServer(config) as server:
+            response = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        self.assertEqual(len(server.lookups()), 3)
+        self.assertEqual(server.uploads(), [])
+
+
+class TestHashLookup(unittest.TestCase):
+    """Test looking up patches by ROM hash before uploading"""
+
+    def setUp(self):
+        self.rom = make_rom()
+        self.rom_hash = hashlib.sha256(self.rom).hexdigest()
+
+    def test_known_rom_is_not_uploaded(self):
+        """Test that a ROM the service knows is only sent as its ID block"""
+        config = MockMRPatcherConfig(hash_lookup=True, known_hashes={self.rom_hash})
+        with MockMRPatcherServer(config) as server:
+            response = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        self.assertEqual(server.uploads(), [])
+        (lookup,) = server.lookups()
+        self.assertEqual(lookup.body, self.rom[:GAME_ID_SIZE])
+        self.assertEqual(lookup.headers['X-MR-ROM-SHA256'], self.rom_hash)
+        self.assertEqual(lookup.headers['X-MR-ROM-Size'], str(len(self.rom)))
+
+    def test_unknown_rom_is_uploaded(self):
+        """Test that an unknown ROM is uploaded, and only looked up afterwards"""
+        with MockMRPatcherServer(MockMRPatcherConfig(hash_lookup=True)) as server:
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual([request.path for request in server.posts()], ['/patch/lookup', '/patch', '/patch/lookup'])
+        self.assertEqual(server.uploads()[0].body, self.rom)
+
+    def test_older_service_falls_back(self):
+        """Test that lookups stop once the service turns out not to support them"""
+        with MockMRPatcherServer() as server:
+            first = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+            MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+        self.assertEqual(first.game_title, 'MOCK GAME')
+        self.assertEqual([request.path for request in server.posts()], ['/patch/lookup', '/patch', '/patch'])
+
+    def test_any_unmarked_error_stops_lookups(self):
+        """Test that lookups stop after any error reply without the lookup marker"""
+        for status in (400, 403, 500):
+            with self.subTest(status=status):
+                with MockMRPatcherServer(MockMRPatcherConfig(lookup_status=status)) as server:
+                    first = MRPatcherAPI(server.endpoint).request_patch(self.rom)
+                    MRPatcherAPI(server.endpoint).request_patch(self.rom)
+
+                self.assertEqual(first.game_title, 'MOCK GAME')
+                self.assertEqual([request.path for request in server.posts()], ['/patch/lookup', '/patch', '/patch'])
+
+
+class TestStreamingUpload(unittest.TestCase):
+    """Test uploading a ROM while it is still being read"""
+
+    def setUp(self):
+        self.rom = make_rom()
+        self.rom_stream = RomStream()
+
+    def read_cartridge(self, delay=0.01):
+        """Feed the ROM into the stream bank by bank, like a cartridge read"""
+        for offset in range(0, len(self.rom), 16384):
+            time.sleep(delay)
+            self.rom_stream.append(self.rom[offset:offset + 16384])
+        self.read_done_at = time.monotonic()
+        self.rom_stream.close()
+
+    def stream_to(self, server):
+        """Request a patch from the server while the ROM is read"""
+        reader = threading.Thread(target=self.read_cartridge)
+        reader.start()
+        try:
+            return MRPatcherAPI(server.endpoint).request_patch_stream(self.rom_stream)
+        finally:
+            reader.join()
+
+    def test_upload_overlaps_read(self):
+        """Test that the upload starts before the read ends on older services"""
+        with MockMRPatcherServer(MockMRPatcherConfig(accept_encoding='gzip')) as server:
+            MRPatcherAPI(server.endpoint).request_patch(b'older service')
+            response = self.stream_to(server)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        upload = server.uploads()[-1]
+        self.assertEqual(upload.headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(upload.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(upload.body, self.rom)
+        self.assertLess(upload.started_at, self.read_done_at)
+
+    def test_lookup_waits_for_read(self):
+        """Test that services with hash lookups get the finished ROM's hash"""
+        config = MockMRPatcherConfig(hash_lookup=True, known_hashes={hashlib.sha256(self.rom).hexdigest()})
+        with MockMRPatcherServer(config) as server:
+            response = self.stream_to(server)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        self.assertEqual(server.uploads(), [])
+
+    def test_lookup_miss_streams_upload(self):
+        """Test that a ROM the service does not know is streamed after the lookup"""
+        with MockMRPatcherServer(MockMRPatcherConfig(hash_lookup=True)) as server:
+            response = self.stream_to(server)
+
+        self.assertEqual(response.game_title, 'MOCK GAME')
+        self.assertEqual([request.path for request in server.posts()], ['/patch/lookup', '/patch'])
+        (lookup,) = server.lookups()
+        self.assertEqual(lookup.headers['X-MR-ROM-SHA256'], hashlib.sha256(self.rom).hexdigest())
+        (upload,) = server.uploads()
+        self.assertEqual(upload.headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(upload.body, self.rom)
+
+    def test_game_id_block_is_available_early(self):
+        """Test that the ID block can be read before the rest of the ROM"""
+        reader = threading.Thread(target=self.read_cartridge, args=(0.02,))
+        reader.start()
+        id_block = self.rom_stream.wait_for(GAME_ID_SIZE)
+        id_block_at = time.monotonic()
+        reader.join()
+
+        self.assertEqual(id_block, self.rom[:GAME_ID_SIZE])
+        self.assertLess(id_block_at, self.read_done_at)
+
+    def test_failed_read_aborts_consumers(self):
+        """Test that consumers stop when the cartridge read fails"""
+        self.rom_stream.append(self.rom[:100])
+        self.rom_stream.abort(IOError('unplugged'))
+
+        with self.assertRaises(RomStreamAborted):
+            self.rom_stream.wait_for(GAME_ID_SIZE)
+        with self.assertRaises(RomStreamAborted):
+            list(self.rom_stream.chunks())
+
+    def test_chunks_restart(self):
+        """Test that the stream can be read again from the start"""
+        self.read_cartridge(0)
+
+        self.assertEqual(b''.join(self.rom_stream.chunks()), self.rom)
+        self.assertEqual(b''.join(self.rom_stream.chunks()), self.rom)
+
+
+class TestChooseEncoding(unittest.TestCase):
+    """Test picking an upload encoding from Accept-Encoding"""
+
+    def test_preferences(self):
+        """Test the supported encodings and refusals"""
+        self.assertIsNone(choose_encoding(''))
+        self.assertIsNone(choose_encoding('br, identity'))
+        self.assertEqual(choose_encoding('deflate, GZIP'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0'))
+        self.assertEqual(choose_encoding('gzip;q=0.5, zstd'), 'zstd' if zstandard is not None else 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the patch service response cache.
+Tests cache hits, ETag revalidation, keying and size-bounded eviction,
+with the HTTP session mocked.
+"""
+
+import os
+import tempfile
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from cartclinic.mrpatcher import GameSaveSettings, MRPatcherAPI, MRPatcherResponse
+from cartclinic.patch_cache import PatchCache
+
+
+def make_reply(status_code=200, body=None, etag=None):
+    """Create a mock HTTP reply"""
+    reply = MagicMock()
+    reply.status_code = status_code
+    reply.json.return_value = body or {}
+    reply.headers = {'ETag': etag} if etag else {}
+    return reply
+
+
+class TestPatchCache(unittest.TestCase):
+    """Test PatchCache storage"""
+
+    def setUp(self):
+        """Set up a cache in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = PatchCache(self.temp_dir.name, ttl_s=60, max_bytes=4096)
+        self.response = MRPatcherResponse(game_title='GAME', needs_update=True, patch='UEFUQ0g=', save_settings=GameSaveSettings(offset_kb=8))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        """Test that a stored response loads back unchanged"""
+        key = self.cache.key_for(b'rom')
+        self.cache.put(key, self.response, '"v1"')
+
+        entry = self.cache.get(key)
+
+        self.assertEqual(entry.response, self.response)
+        self.assertEqual(entry.etag, '"v1"')
+        self.assertTrue(entry.is_fresh())
+
+    def test_key_depends_on_rom(self):
+        """Test that different ROMs get different keys"""
+        self.assertEqual(self.cache.key_for(b'rom'), self.cache.key_for(bytearray(b'rom')))
+        self.assertNotEqual(self.cache.key_for(b'rom'), self.cache.key_for(b'rom2'))
+
+    def test_refresh_makes_entry_fresh(self):
+        """Test that refreshing a stale entry restarts its TTL"""
+        self.cache.ttl_s = 0
+        key = self.cache.key_for(b'rom')
+        self.cache.put(key, self.response)
+        self.assertFalse(self.cache.get(key).is_fresh())
+
+        self.cache.ttl_s = 60
+        self.cache.refresh(key)
+
+        self.assertTrue(self.cache.get(key).is_fresh())
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the cache evicts the oldest unused entries to fit"""
+        self.cache.max_bytes = 1024 * 1024
+        keys = [self.cache.key_for(bytes([index])) for index in range(8)]
+        for age, key in enumerate(keys):
+            self.cache.put(key, MRPatcherResponse(patch='A' * 1000))
+            stamp = time.time() - 100 + age
+            os.utime(self.cache._path(key), (stamp, stamp))
+        self.cache.get(keys[0])
+        self.cache.max_bytes = 4096
+        self.cache.put(self.cache.key_for(b'new'), self.response)
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        total = sum(path.stat().st_size for path in Path(self.temp_dir.name).glob('*.json'))
+        self.assertLessEqual(total, 4096)
+
+    def test_corrupt_entry_is_a_miss(self):
+        """Test that an unreadable entry is discarded"""
+        key = self.cache.key_for(b'rom')
+        self.cache._path(key).write_text('{not json')
+
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(self.cache._path(key).exists())
+
+
+class TestCachedPatchRequests(unittest.TestCase):
+    """Test MRPatcherAPI with a cache"""
+
+    def setUp(self):
+        """Set up an API client with a cache in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = PatchCache(self.temp_dir.name, ttl_s=60)
+        self.session = MagicMock()
+        self.session.get.return_value = make_reply()
+        self.api = MRPatcherAPI('http://patcher.invalid', cache=self.cache, session=self.session)
+        self.body = {'game_title': 'GAME', 'needs_update': True, 'patch': 'UEFUQ0g=', 'unknown_field': 1}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def upload_count(self):
+        """Count the POSTs that uploaded a full ROM"""
+        return sum(1 for call in self.session.post.call_args_list if call.args[0] == self.api.endpoint)
+
+    def test_fresh_response_skips_request(self):
+        """Test that a second request for the same ROM is served from the cache"""
+        self.session.post.return_value = make_reply(body=self.body, etag='"v1"')
+
+        first = self.api.request_patch(b'rom')
+        second = self.api.request_patch(b'rom')
+
+        self.assertEqual(self.upload_count(), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second.game_title, 'GAME')
+
+    def test_stale_response_is_revalidated(self):
+        """Test that a stale response is sent with its ETag and reused on 304"""
+        self.session.post.return_value = make_reply(body=self.body, etag='"v1"')
+        self.api.request_patch(b'rom')
+        self.cache.ttl_s = 0
+        self.session.post.return_value = make_reply(status_code=304)
+
+        response = self.api.request_patch(b'rom')
+
+        self.assertEqual(self.session.post.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(response.game_title, 'GAME')
+
+    def test_errors_are_not_cached(self):
+        """Test that error responses are requested again"""
+        self.session.post.return_value = make_reply(body={'error': 'busy', 'error_code': 503})
+
+        self.api.request_patch(b'rom')
+        self.api.request_patch(b'rom')
+
+        self.assertEqual(self.upload_count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Unit tests for BPS and UPS patches.
+Tests creating, encoding and applying patches in memory and as streams,
+and the CRC32 checks on the source, target and patch.
+"""
+
+import io
+import random
+import unittest
+import sys
+import zlib
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from libpyretro.ips_util import BPSPatch, Patch, PatchChecksumError, PatchFormatError, UPSPatch, patch_from_bytes
+from libpyretro.ips_util.bps import SOURCE_COPY
+
+
+class PatchFormatTests:
+    """Tests shared by every patch format"""
+
+    patch_format = None
+
+    def setUp(self):
+        """Set up a 128KB source and a target with new, moved and added data"""
+        self.rng = random.Random(55)
+        self.source = self.rng.randbytes(128 * 1024)
+        target = bytearray(self.source)
+        target[1000:1200] = self.rng.randbytes(200)
+        target[50000:54000] = self.source[90000:94000]
+        target[70000:70100] = b'\x00' * 100
+        self.target = bytes(target) + self.rng.randbytes(3000)
+
+    def test_round_trip(self):
+        """Test that an encoded patch parses back and applies"""
+        patch = self.patch_format.create(self.source, self.target)
+        parsed = patch_from_bytes(bytes(patch.encode()))
+
+        self.assertIsInstance(parsed, self.patch_format)
+        self.assertEqual(parsed.apply(self.source), self.target)
+
+    def test_apply_stream(self):
+        """Test that streaming apply writes the same target"""
+        patch = patch_from_bytes(bytes(self.patch_format.create(self.source, self.target).encode()))
+        target = io.BytesIO()
+
+        patch.apply_stream(io.BytesIO(self.source), target)
+
+        self.assertEqual(target.getvalue(), self.target)
+
+    def test_touched_ranges_cover_changes(self):
+        """Test that every changed or added byte is in a touched range"""
+        patch = self.patch_format.create(self.source, self.target)
+        ranges = patch.touched_ranges()
+
+        for offset in (1000, 1199, 50000, 70050, len(self.source), len(self.target) - 1):
+            self.assertTrue(any(start <= offset < end for start, end in ranges), offset)
+        self.assertFalse(any(start <= 20000 < end for start, end in ranges))
+
+    def test_wrong_source_is_rejected(self):
+        """Test that a source with the wrong checksum is refused"""
+        patch = self.patch_format.create(self.source, self.target)
+        wrong_source = bytearray(self.source)
+        wrong_source[5] ^= 1
+
+        with self.assertRaises(PatchChecksumError):
+            patch.apply(wrong_source)
+        with self.assertRaises(PatchChecksumError):
+            patch.apply_stream(io.BytesIO(bytes(wrong_source)), io.BytesIO())
+
+    def test_check_source(self):
+        """Test that the source can be checked without applying the patch"""
+        patch = self.patch_format.create(self.source, self.target)
+        wrong_size = self.source + b'\x00'
+
+        patch.check_source(self.source)
+        with self.assertRaises(PatchChecksumError):
+            patch.check_source(wrong_size)
+
+    def test_damaged_patch_is_rejected(self):
+        """Test that a patch with a bad checksum is refused"""
+        encoded = bytearray(self.patch_format.create(self.source, self.target).encode())
+        encoded[len(encoded) // 2] ^= 1
+
+        with self.assertRaises(PatchChecksumError):
+            self.patch_format.from_bytes(bytes(encoded))
+
+
+class TestBPSPatch(PatchFormatTests, unittest.TestCase):
+    """Test BPS patches"""
+
+    patch_format = BPSPatch
+
+    def test_moved_data_is_copied(self):
+        """Test that data moved within the ROM becomes a source copy"""
+        source = self.rng.randbytes(256 * 1024)
+        target = source[100000:] + source[:100000]
+
+        patch = BPSPatch.create(source, target)
+
+        self.assertEqual([action['action'] for action in patch.actions], [SOURCE_COPY, SOURCE_COPY])
+        self.assertLess(len(patch.encode()), 64)
+        self.assertEqual(patch.apply(source), target)
+
+    def test_overlapping_target_copy(self):
+        """Test that a target copy overlapping its output repeats bytes"""
+        source = bytes(range(10))
+        expected = bytearray(source)
+        for offset in range(20):
+            expected.append(expected[7 + offset])
+        patch = BPSPatch(len(source), len(expected), zlib.crc32(source), zlib.crc32(expected))
+        patch.add_source_read(10)
+        patch.add_target_copy(7, 20)
+        parsed = BPSPatch.from_bytes(bytes(patch.encode()))
+        target = io.BytesIO()
+
+        parsed.apply_stream(io.BytesIO(source), target)
+
+        self.assertEqual(parsed.apply(source), expected)
+        self.assertEqual(target.getvalue(), expected)
+
+
+class TestUPSPatch(PatchFormatTests, unittest.TestCase):
+    """Test UPS patches"""
+
+    patch_format = UPSPatch
+
+    def test_revert(self):
+        """Test that applying to the target gives back the source"""
+        patch = UPSPatch.create(self.source, self.target)
+
+        self.assertEqual(patch.apply(self.target), self.source)
+
+
+class TestIPSCheckSource(unittest.TestCase):
+    """Test that IPS patches, which record no source, accept any source"""
+
+    def test_check_source(self):
+        """Test that checking the source of an IPS patch never raises"""
+        patch = Patch.create(b'\x00' * 64, b'\x01' * 64)
+
+        patch.check_source(b'\x02' * 32)
+
+
+class TestPatchDetection(unittest.TestCase):
+    """Test picking the format of a patch"""
+
+    def test_ips_is_detected(self):
+        """Test that IPS patches are parsed with Patch"""
+        patch = Patch()
+        patch.add_record(4, b'\x01')
+
+        self.assertIsInstance(patch_from_bytes(bytes(patch.encode())), Patch)
+
+    def test_unknown_format(self):
+        """Test that unknown data is rejected"""
+        with self.assertRaises(PatchFormatError):
+            patch_from_bytes(b'NOTAPATCH')
+
+
+if __name__ == '__main__':
+    unittest.main()